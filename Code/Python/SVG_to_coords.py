@@ -1,7 +1,9 @@
 import xml.etree.ElementTree as ET
 import os
 import re
+import hashlib
 import numpy as np
+from typing import NamedTuple
 
 def find_next_letter(text, position, cache):
     for i in range(position + 1, len(text)):
@@ -19,76 +21,405 @@ def find_next_comma(text, position):
             return i
     return -1
 
-def read_path2(path: str, decimal_places=3):
-    command_matrix = []
-    current_line = []
-    current_num = ''
-    is_decimal = False
-    numbers_after_decimal = 0
-
-    for char in path:
-        match char:
-            case 'M'| 'm' | 'L' | 'l' | 'H' | 'h' | 'V' | 'v' | 'C' | 'c' | 'S' | 's' | 'Q' | 'q' | 'T' | 't' | 'A' | 'a' | 'Z' | 'z':
-                if current_num:
-                    current_line.append(current_num)
-                    is_decimal = False
-                    current_num = ''
-
-                if current_line:
-                    command_matrix.append(current_line)
-                current_line = [char]
-            case ' ' | ',':
-                if current_num:
-                    current_line.append(current_num)
-                    is_decimal = False
-                    current_num = ''
-            case '-':
-                if current_num:
-                    current_line.append(current_num)
-                is_decimal = False
-                current_num = '-'
-            case '.':
-                if current_num and is_decimal:
-                    current_line.append(current_num)
-                    current_num = '.'
-                else:
-                    current_num += '.'
-                numbers_after_decimal = 0
-                is_decimal = True
-            case _:
-                current_num += char
-                numbers_after_decimal += 1
-                if is_decimal and (numbers_after_decimal >= decimal_places):
-                    current_line.append(current_num)
-                    is_decimal = False
-                    current_num = ''
-
-    if current_num:
-        current_line.append(current_num)
-
-    if current_line:
-        command_matrix.append(current_line)
-
-    return command_matrix
+PATH_COMMANDS = 'MmLlHhVvCcSsQqTtAaZz'
+
+# Fallback tokenizer used for numbers in exponent notation or with too many digits to
+# rebuild exactly from their digits.
+PATH_TOKEN_PATTERN = re.compile(r'[' + PATH_COMMANDS + r']|[-+]?(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?')
+
+_IS_COMMAND = np.zeros(256, dtype=bool)
+_IS_COMMAND[np.frombuffer(PATH_COMMANDS.encode('ascii'), dtype=np.uint8)] = True
+_MAX_DIGITS = 15
+_POWERS_OF_TEN = 10.0 ** np.arange(_MAX_DIGITS + 1)
+
+
+class PathData(NamedTuple):
+    """Tokenized path data of one svg path element.
+
+    attributes:
+        opcodes: a 1D uint8 array of the ascii code of each command letter.
+        args: a 1D float64 array of every number in the path, in order.
+        offsets: a 1D array of len(opcodes) + 1 indices, the arguments of command i are
+            args[offsets[i]:offsets[i+1]].
+        transform: a (2, 3) affine matrix applied to the path's points, or None. Set on paths
+            that are drawn through a <use> element.
+    """
+    opcodes: np.ndarray
+    args: np.ndarray
+    offsets: np.ndarray
+    transform: np.ndarray = None
+
+
+def _tokenize_regex(path: str):
+    """tokenize path data with a regular expression, handles every svg number format."""
+    tokens = np.array(PATH_TOKEN_PATTERN.findall(path))
+    if tokens.size == 0:
+        return np.zeros(0, dtype=np.uint8), np.zeros(0), np.zeros(1, dtype=np.intp)
+    is_command = np.char.isalpha(tokens)
+    opcodes = np.frombuffer(''.join(tokens[is_command]).encode('ascii'), dtype=np.uint8)
+    args = tokens[~is_command].astype(np.float64)
+    offsets = np.append(np.cumsum(~is_command)[is_command], args.size)
+    return opcodes, args, offsets
+
+
+def _tokenize_bytes(path: str):
+    """tokenize path data by classifying its characters with numpy.
+
+    Each number is rebuilt from its digits as an exact integer mantissa divided by a power
+    of ten, which gives the same correctly rounded value as float(). Returns None if a
+    number has too many digits for that to be exact.
+    """
+    codes = np.frombuffer(path.encode(), dtype=np.uint8)
+    is_digit = (codes >= 48) & (codes <= 57)
+    is_dot = codes == 46
+    is_sign = (codes == 45) | (codes == 43)
+    is_number = is_digit | is_dot | is_sign
+
+    # a number starts after any non number character or at a sign
+    starts = is_number.copy()
+    starts[1:] &= ~is_number[:-1] | is_sign[1:]
+    token = np.cumsum(starts, dtype=np.int32) - 1
+
+    # a second decimal point in the same number starts a new one, ex: 1.5.5 -> 1.5 .5
+    dot_positions = np.flatnonzero(is_dot)
+    dot_token = token[dot_positions]
+    repeated_dot = np.zeros(dot_positions.size, dtype=bool)
+    repeated_dot[1:] = dot_token[1:] == dot_token[:-1]
+    if repeated_dot.any():
+        starts[dot_positions[repeated_dot]] = True
+        token = np.cumsum(starts, dtype=np.int32) - 1
+        dot_token = token[dot_positions]
+    start_positions = np.flatnonzero(starts)
+    n_tokens = start_positions.size
+
+    # sum up the digits of each number into an integer mantissa
+    digit_positions = np.flatnonzero(is_digit)
+    digit_token = token[digit_positions]
+    n_digits = np.bincount(digit_token, minlength=n_tokens)
+    if n_digits.max(initial=0) > _MAX_DIGITS:
+        return None
+    first_digit = np.cumsum(n_digits) - n_digits
+    power = n_digits[digit_token] - 1 - (np.arange(digit_positions.size) - first_digit[digit_token])
+    mantissa = np.bincount(digit_token, weights=(codes[digit_positions] - 48) * _POWERS_OF_TEN[power], minlength=n_tokens)
+
+    # shift the decimal point by the number of digits after it
+    dot_position = np.full(n_tokens, codes.size)
+    dot_position[dot_token] = dot_positions
+    fraction_digits = np.bincount(digit_token[digit_positions > dot_position[digit_token]], minlength=n_tokens)
+    values = mantissa / _POWERS_OF_TEN[fraction_digits]
+    values[codes[start_positions] == 45] *= -1
+
+    # drop stray signs or points that have no digits
+    has_digits = n_digits > 0
+    args = values[has_digits]
+    command_positions = np.flatnonzero(_IS_COMMAND[codes])
+    offsets = np.append(np.searchsorted(start_positions[has_digits], command_positions), args.size)
+    return codes[command_positions], args, offsets
+
+
+def tokenize_path(path: str, decimal_places=None) -> PathData:
+    """convert the d attribute of an svg path into numeric arrays.
+
+    parameters:
+        path: the d attribute of an svg path element.
+        decimal_places: if given, round every number to this many decimal places.
+
+    returns:
+        a PathData of the command opcodes, their arguments and the offsets of each
+        command's arguments.
+    """
+    tokens = None
+    if 'e' not in path and 'E' not in path:
+        tokens = _tokenize_bytes(path)
+    if tokens is None:
+        tokens = _tokenize_regex(path)
+
+    opcodes, args, offsets = tokens
+    if decimal_places is not None:
+        args = np.round(args, decimal_places)
+    return PathData(opcodes, args, offsets)
+
+# axis of each argument of an absolute command, 0 for x, 1 for y and -1 for arguments that
+# are not coordinates. The pattern repeats for every set of arguments of the command.
+_ARGUMENT_AXES = {'M': (0, 1), 'L': (0, 1), 'H': (0,), 'V': (1,), 'C': (0, 1), 'S': (0, 1),
+                  'Q': (0, 1), 'T': (0, 1), 'A': (-1, -1, -1, -1, -1, 0, 1)}
+_AXIS_TABLE = np.full((256, 7), -1)
+_AXIS_PERIOD = np.ones(256, dtype=int)
+for _command, _axes in _ARGUMENT_AXES.items():
+    _AXIS_TABLE[ord(_command), :len(_axes)] = _axes
+    _AXIS_PERIOD[ord(_command)] = len(_axes)
+
+
+def path_key(path: PathData, decimal_places=6):
+    """hash the shape of a path independently of where it is drawn.
+
+    The absolute coordinates of the path are made relative to its first move, so two paths
+    that only differ by a translation get the same key.
+
+    parameters:
+        path: the tokenized path data.
+        decimal_places: precision the normalized coordinates are compared at.
+
+    returns:
+        the key of the path's shape as bytes and the x, y coordinates of its first move.
+    """
+    opcodes, args, offsets = path.opcodes, path.args, path.offsets
+    origin = np.zeros(2)
+    if len(opcodes) and chr(opcodes[0]) in 'Mm' and offsets[1] - offsets[0] >= 2:
+        origin = args[offsets[0]:offsets[0]+2]
+
+    # find the axis of every argument and subtract the origin from absolute coordinates
+    command = np.repeat(np.arange(len(opcodes)), np.diff(offsets))
+    command_opcodes = opcodes[command]
+    position = np.arange(offsets[0], offsets[-1]) - offsets[command]
+    axis = _AXIS_TABLE[command_opcodes, position % _AXIS_PERIOD[command_opcodes]]
+    normalized = args[offsets[0]:offsets[-1]] - np.where(axis >= 0, origin[np.maximum(axis, 0)], 0)
+    if len(opcodes) and chr(opcodes[0]) == 'm':
+        # the first move of a path is absolute even when written in lower case
+        normalized[0:2] -= origin
+    normalized = np.round(normalized, decimal_places) + 0.0     # + 0.0 turns -0.0 into 0.0
+
+    digest = hashlib.blake2b(opcodes.tobytes(), digest_size=16)
+    digest.update(np.diff(offsets).tobytes())
+    digest.update(normalized.tobytes())
+    return digest.digest(), origin
+
+
+def parse_transform(transform: str) -> np.array:
+    """convert an svg transform attribute into an affine matrix.
+
+    Supports the matrix, translate, scale, rotate, skewX and skewY transform functions.
+
+    returns:
+        a (3, 3) affine transformation matrix.
+    """
+    result = np.identity(3)
+    for name, values in re.findall(r'(matrix|translate|scale|rotate|skewX|skewY)\s*\(([^)]*)\)', transform):
+        values = [float(value) for value in PATH_TOKEN_PATTERN.findall(values)]
+        matrix = np.identity(3)
+        match name:
+            case 'matrix':
+                matrix[:2] = np.reshape(values[:6], (3, 2)).T
+            case 'translate':
+                matrix[:2, 2] = values[0], (values[1] if len(values) > 1 else 0)
+            case 'scale':
+                matrix[0, 0], matrix[1, 1] = values[0], (values[1] if len(values) > 1 else values[0])
+            case 'rotate':
+                angle = np.radians(values[0])
+                matrix[:2, :2] = [[np.cos(angle), -np.sin(angle)], [np.sin(angle), np.cos(angle)]]
+                if len(values) == 3:
+                    # rotate about a point: translate(cx, cy) rotate(a) translate(-cx, -cy)
+                    center = np.array(values[1:3])
+                    matrix[:2, 2] = center - matrix[:2, :2] @ center
+            case 'skewX':
+                matrix[0, 1] = np.tan(np.radians(values[0]))
+            case 'skewY':
+                matrix[1, 0] = np.tan(np.radians(values[0]))
+        result = result @ matrix
+    return result
+
+
+def referenced_ids(svg_file) -> set:
+    """find the ids of the elements a <use> element references, reading the file incrementally.
+
+    parameters:
+        svg_file: path to (or open file object of) the svg file to read.
+
+    returns:
+        a set of the referenced ids, without the leading #.
+    """
+    namespace = '{http://www.w3.org/2000/svg}'
+    parents = []
+    ids = set()
+    for event, element in ET.iterparse(svg_file, events=('start', 'end')):
+        if event == 'start':
+            parents.append(element)
+            continue
+        parents.pop()
+        if element.tag == namespace + 'use':
+            href = element.attrib.get('href', element.attrib.get('{http://www.w3.org/1999/xlink}href', ''))
+            if href.startswith('#'):
+                ids.add(href[1:])
+        element.clear()
+        if parents:
+            parents[-1].remove(element)
+    return ids
+
+
+def can_reread(svg_file) -> bool:
+    """whether an svg file can be read again from its start, like a file path or a seekable file
+    object, but not a pipe or stdin."""
+    return not hasattr(svg_file, 'read') or (hasattr(svg_file, 'seekable') and svg_file.seekable())
+
+
+def read_definitions(svg_file, decimal_places=3) -> dict:
+    """read the paths of every element a <use> element references, wherever it is in the file.
+
+    The whole file is read twice, once to find the referenced ids and once to collect their
+    paths, so only use it when a <use> element references an element that wasn't kept.
+
+    parameters:
+        svg_file: path to (or seekable file object of) the svg file to read. An open file is
+            read from its start and left where it was.
+        decimal_places: number of decimal places to round each coordinate to, or None to
+            keep them as written.
+
+    returns:
+        a dict of the list of PathData drawn by each referenced element.
+    """
+    position = svg_file.tell() if hasattr(svg_file, 'read') else None
+    if position is not None:
+        svg_file.seek(0)
+    ids = referenced_ids(svg_file)
+    if position is not None:
+        svg_file.seek(0)
+    definitions = {}
+    for _ in walk_svg(svg_file, decimal_places, definitions, lambda element_id, hidden: element_id in ids):
+        pass
+    if position is not None:
+        svg_file.seek(position)
+    return definitions
+
+
+def walk_svg(svg_file, decimal_places, definitions: dict, keep, find_missing=None):
+    """yield the tokenized path data of each drawn path in an svg file. (see iter_svg_paths)
+
+    parameters:
+        svg_file: path to (or open file object of) the svg file to read.
+        decimal_places: number of decimal places to round each coordinate to, or None.
+        definitions: a dict of the list of PathData drawn by each element with an id, filled
+            in as elements are read.
+        keep: a function of an element's id and whether it is inside a <defs> or <symbol>
+            element that returns whether its paths are kept in definitions.
+        find_missing: an optional function of an id a <use> element references that isn't in
+            definitions, which can add it before the <use> element is resolved.
+
+    yields:
+        the tokenized PathData of one path element.
+    """
+    namespace = '{http://www.w3.org/2000/svg}'
+    hidden_tags = (namespace + 'defs', namespace + 'symbol')
+    parents = []
+    hidden_depth = 0        # number of open <defs> or <symbol> elements
+    collectors = []         # (id, paths) of open elements that are kept
+    for event, element in ET.iterparse(svg_file, events=('start', 'end')):
+        if event == 'start':
+            parents.append(element)
+            if element.tag in hidden_tags:
+                hidden_depth += 1
+            element_id = element.attrib.get('id')
+            kept = element_id is not None and len(parents) > 1 and keep(element_id, hidden_depth > 0)
+            collectors.append((element_id, []) if kept else None)
+            continue
+
+        parents.pop()
+        paths = []
+        if element.tag == namespace + 'path':
+            paths = [tokenize_path(element.attrib.get('d', ''), decimal_places)]
+        elif element.tag == namespace + 'use':
+            href = element.attrib.get('href', element.attrib.get('{http://www.w3.org/1999/xlink}href', '')).lstrip('#')
+            if href and href not in definitions and find_missing is not None:
+                find_missing(href)
+            use_transform = parse_transform(element.attrib.get('transform', ''))
+            use_transform[:2, 2] += use_transform[:2, :2] @ [float(element.attrib.get('x', 0)), float(element.attrib.get('y', 0))]
+            for path in definitions.get(href, []):
+                transform = use_transform if path.transform is None else use_transform @ np.vstack((path.transform, [0, 0, 1]))
+                paths.append(path._replace(transform=transform[:2]))
+        elif element.tag in hidden_tags:
+            hidden_depth -= 1
+
+        collector = collectors.pop()
+        for open_collector in collectors:
+            if open_collector is not None:
+                open_collector[1].extend(paths)
+        if collector is not None:
+            collector[1].extend(paths)
+            definitions[collector[0]] = collector[1]
+
+        element.clear()
+        if parents:
+            parents[-1].remove(element)
+        if hidden_depth == 0:
+            yield from paths
+
+
+def iter_svg_paths(svg_file, decimal_places=3):
+    """yield the tokenized path data of each path in an svg file as soon as its element is read.
+
+    The file is parsed incrementally so only the element currently being read is held in
+    memory. Each element is cleared and detached from its parent as soon as it has been read,
+    which keeps peak memory flat on multi-megabyte drawings.
+
+    <use> elements are resolved to the paths of the element they reference, and the
+    referenced paths are yielded again with the <use> element's x, y and transform attributes
+    set as their transform. Paths inside <defs> and <symbol> are only drawn through a <use>
+    element. Only the paths of elements with an id inside <defs> and <symbol> are kept while
+    reading, so drawings where every path has an id stay flat too. When a <use> element
+    references any other element, a file that can be read again is read in full once more to
+    find the paths of every referenced element (see read_definitions). A file that can't, like
+    a pipe, keeps the paths of every element with an id instead, and references to elements
+    later in it draw nothing.
+
+    parameters:
+        svg_file: path to (or open file object of) the svg file to read.
+        decimal_places: number of decimal places to round each coordinate to, or None to
+            keep them as written.
+
+    yields:
+        the tokenized PathData of one path element.
+    """
+    definitions = {}
+    if not can_reread(svg_file):
+        yield from walk_svg(svg_file, decimal_places, definitions, lambda element_id, hidden: True)
+        return
+
+    complete = False        # definitions has every referenced element once read_definitions ran
+
+    def keep(element_id, hidden):
+        return hidden and not complete
+
+    def find_missing(element_id):
+        nonlocal complete
+        if not complete:
+            definitions.update(read_definitions(svg_file, decimal_places))
+            complete = True
+
+    yield from walk_svg(svg_file, decimal_places, definitions, keep, find_missing)
 
 def parse_svg(svg_file, decimal_places=3):
-    tree = ET.parse(svg_file)
-    #print(tree)
-    root = tree.getroot()
-    #print(root)
-
-    # Define SVG namespace
-    svg_namespace = {'svg': 'http://www.w3.org/2000/svg'}
-
-    # Find all path elements
-    paths = root.findall('.//svg:path', namespaces=svg_namespace)
-    command_matrix = []
-    for path in paths:
-        d_attrib = path.attrib.get('d', '')
-        command_matrix.append(read_path2(d_attrib, decimal_places))
-    return command_matrix
+    """read the tokenized path data of every path in an svg file.
+
+    parameters:
+        svg_file: path to (or open file object of) the svg file to read.
+        decimal_places: number of decimal places to round each coordinate to, or None to
+            keep them as written.
+
+    returns:
+        a list with the PathData of each path element in document order.
+    """
+    return list(iter_svg_paths(svg_file, decimal_places))
 
 if __name__ == "__main__":
+    import io
+    import threading
+
+    # stream a drawing with <use> elements through a pipe, which can't be read twice, and check
+    # it draws the same paths as reading it from a file
+    svg = (b'<svg xmlns="http://www.w3.org/2000/svg" xmlns:xlink="http://www.w3.org/1999/xlink">'
+           b'<defs><path id="dot" d="M0 0 L1 1"/></defs><path id="line" d="M0 0 L10 0"/>'
+           b'<use xlink:href="#dot" x="5"/><use href="#line" transform="scale(2)"/></svg>')
+    read_end, write_end = os.pipe()
+    writer = threading.Thread(target=lambda: (os.write(write_end, svg), os.close(write_end)))
+    writer.start()
+    with os.fdopen(read_end, 'rb') as pipe:
+        streamed = list(iter_svg_paths(pipe))
+    writer.join()
+    read = parse_svg(io.BytesIO(svg))
+    assert len(streamed) == len(read) == 3
+    assert all(np.array_equal(a.args, b.args) and np.array_equal(a.transform, b.transform)
+               for a, b in zip(streamed, read))
+    print(f"streamed {len(streamed)} paths from a pipe")
+
     current_working_directory = os.getcwd()
     #file_name = input("What file do you want to use?\n")
     file_name = "hello_world"
@@ -97,4 +428,4 @@ if __name__ == "__main__":
     #convert_to_toolpath(paths)
 
     #test_string = "M501.333,96H10.667C4.779,96,0,100.779,0,106.667v298.667C0,411.221,4.779,416,10.667,416h490.667c5.888,0,10.667,4.779,-10.667,-10.667V106.667C512,100.779,507.221,96,501.333,96z M490.667,394.667H21.333V117.333h469.333V394.667z"
-    #print(read_path2(test_string))
\ No newline at end of file
+    #print(tokenize_path(test_string))
\ No newline at end of file
@@ -1,10 +1,13 @@
 """This file contains code for animating the robot arm as it moves through a series of angles."""
 import numpy as np
 import plotly.graph_objects as go
-from forward_kinematics import generate_link_coordinates
+import plotly.io as pio
+from forward_kinematics import batch_link_coordinates
 
 # Time steps
 time_steps = np.linspace(0, 180, 20)  # Adjust the range and step size as needed
+TRAIL_CHUNK_STEPS = 100         # steps of the actual toolpath in each trace, each frame resends at most this many points
+SLIDER_STEPS = 200              # most frames the slider can jump to
 
 
 def animate_arm(angular_toolpath: np.array, cartesian_toolpath: np.array = None) -> None:
@@ -14,31 +17,25 @@ def animate_arm(angular_toolpath: np.array, cartesian_toolpath: np.array = None)
     parameters:
         angular_toolpath: a two dimensional array of angles that represent the position 
             of each servo for a given timestep.
+        cartesian_toolpath: an optional (3, N) array of the x, y & z coordinates of the desired
+            toolpath, it is only drawn once so it doesn't need to be downsampled.
     """
     # If no cartesian toolpath is specified , create an single point at 0, 0, 0.
     if cartesian_toolpath is None:
         cartesian_toolpath = np.array([[0],[0],[0]])
 
-    # Initialize empty arrays for x, y, and z coordinates
-    x = np.zeros((len(angular_toolpath), 7), dtype=float)
-    y = np.zeros((len(angular_toolpath), 7), dtype=float)
-    z = np.zeros((len(angular_toolpath), 7), dtype=float)
-
-    # Generate link coordinates for each time step.
-    for i, step in enumerate(angular_toolpath):
-        link_coordinates = generate_link_coordinates(step[0], step[1], step[2], step[3])
-        x[i] = link_coordinates["x"]
-        y[i] = link_coordinates["y"]
-        z[i] = link_coordinates["z"]
+    # Generate link coordinates for every time step at once, each a (time steps, 7) array,
+    # rounded to a hundredth of a mm so they take fewer characters in the figure.
+    x, y, z = batch_link_coordinates(angular_toolpath).round(2).transpose(2, 0, 1)
 
     # find maximum & minimum x, y & z values of all coordinates for axis ranges.
     padding = 50
-    max_x = max([max(i) for i in x]) + padding
-    min_x = min([min(i) for i in x]) - padding
-    max_y = max([max(i) for i in y]) + padding
-    min_y = min([min(i) for i in y]) - padding
-    max_z = max([max(i) for i in z]) + padding
-    min_z = min([min(i) for i in z])
+    max_x = x.max() + padding
+    min_x = x.min() - padding
+    max_y = y.max() + padding
+    min_y = y.min() - padding
+    max_z = z.max() + padding
+    min_z = z.min()
 
     # define aspect ratios such that the plot's x, y, & z axis have equal units.
     range_x = max_x - min_x
@@ -60,12 +57,29 @@ def animate_arm(angular_toolpath: np.array, cartesian_toolpath: np.array = None)
                 )
     )
 
-    # Create coordinate list for the actual toolpath (last joint of the robot)
+    # Create coordinate list for the actual toolpath (last joint of the robot), split into
+    # chunks of TRAIL_CHUNK_STEPS steps that each get their own trace
     toolpath_x = x[:,6].T
     toolpath_y = y[:,6].T
     toolpath_z = z[:,6].T
+    chunks = int(np.ceil(len(x)/TRAIL_CHUNK_STEPS))
+    first_trail_trace = 3
+
+    def trail(chunk, end):
+        """the part of the actual toolpath in a chunk up to a step."""
+        start = chunk*TRAIL_CHUNK_STEPS
+        return go.Scatter3d(
+            x = toolpath_x[start:end],
+            y = toolpath_y[start:end],
+            z = toolpath_z[start:end],
+            name = "actual_toolpath",
+            legendgroup = "actual_toolpath",
+            showlegend = chunk == 0,
+            mode="markers",
+            marker=dict(color="black", size=2),
+        )
 
-    # Create figure
+    # Create figure, the desired toolpath never changes so it's only sent here and not in the frames
     fig = go.Figure(
         data=[
             go.Scatter3d(
@@ -92,63 +106,33 @@ def animate_arm(angular_toolpath: np.array, cartesian_toolpath: np.array = None)
                 mode="markers",
                 marker=dict(color="green", size=2),
             ),
-            go.Scatter3d(
-                x = toolpath_x[0:0],
-                y = toolpath_y[0:0],
-                z = toolpath_z[0:0],
-                name = "actual_toolpath",
-                mode="markers",
-                marker=dict(color="black", size=2),
-            )
-        ],
+        ] + [trail(chunk, 0) for chunk in range(chunks)],
         layout= animation_layout
     )
 
-    # Frames
-    frames = [
-        go.Frame(
+    # Frames only update the traces that change: the arm and the chunk of the trail it is
+    # drawing. Finished chunks keep the points of their last frame, and the first frame of each
+    # chunk empties the ones after it so the trail is cleared when the animation starts over.
+    # They are plain dicts, validating thousands of go.Frame objects takes far longer than
+    # drawing them.
+    frames = []
+    for k in range(len(x)):
+        chunk = k // TRAIL_CHUNK_STEPS
+        cleared = range(chunk + 1, chunks) if k % TRAIL_CHUNK_STEPS == 0 else range(0)
+        frames.append(dict(
             data=[
-                go.Scatter3d(
-                    x=x[k],
-                    y=y[k],
-                    z=z[k],
-                    mode="markers",
-                    marker=dict(color="red", size=10),
-                    name="joints",
-                ),
-                go.Scatter3d(
-                    x=x[k],
-                    y=y[k],
-                    z=z[k],
-                    mode="lines",
-                    line=dict(color="blue", width=5),
-                    name="links",
+                dict(type="scatter3d", x=x[k], y=y[k], z=z[k], marker=dict(size=10)),
+                dict(type="scatter3d", x=x[k], y=y[k], z=z[k]),
+                dict(
+                    type="scatter3d",
+                    x = toolpath_x[chunk*TRAIL_CHUNK_STEPS:k + 1],
+                    y = toolpath_y[chunk*TRAIL_CHUNK_STEPS:k + 1],
+                    z = toolpath_z[chunk*TRAIL_CHUNK_STEPS:k + 1],
                 ),
-                go.Scatter3d(
-                    x = cartesian_toolpath[0],
-                    y = cartesian_toolpath[1],
-                    z = cartesian_toolpath[2],
-                    name = "desired_toolpath",
-                    mode="markers",
-                    marker=dict(color="green", size=2),
-                ),
-                go.Scatter3d(
-                    x = toolpath_x[:k],
-                    y = toolpath_y[:k],
-                    z = toolpath_z[:k],
-                    name = "actual_toolpath",
-                    mode="markers",
-                    marker=dict(color="black", size=2),
-                )
-            ],
-            # traces= [0, 1], # corresponds to which traces should be displayed...
+            ] + [dict(type="scatter3d", x=[], y=[], z=[]) for _ in cleared],
+            traces=[0, 1, first_trail_trace + chunk] + [first_trail_trace + later for later in cleared],
             name=f"frame{k}",
-            layout=animation_layout,
-        )
-        for k in range(len(x))
-    ]
-
-    fig.update(frames=frames)
+        ))
 
     def frame_args(duration):
         return {
@@ -158,6 +142,9 @@ def animate_arm(angular_toolpath: np.array, cartesian_toolpath: np.array = None)
             "transition": {"duration": duration, "easing": "linear"},
         }
 
+    # a slider step for every frame of a long toolpath is too fine to use, so at most
+    # SLIDER_STEPS evenly spaced frames get one
+    slider_frames = np.unique(np.linspace(0, len(frames) - 1, min(len(frames), SLIDER_STEPS)).round().astype(int))
     sliders = [
         {
             "pad": {"b": 10, "t": 60},
@@ -166,11 +153,11 @@ def animate_arm(angular_toolpath: np.array, cartesian_toolpath: np.array = None)
             "y": 0,
             "steps": [
                 {
-                    "args": [[f.name], frame_args(0)],
+                    "args": [[frames[k]["name"]], frame_args(0)],
                     "label": str(k),
                     "method": "animate",
                 }
-                for k, f in enumerate(fig.frames)
+                for k in slider_frames
             ],
         }
     ]
@@ -200,8 +187,9 @@ def animate_arm(angular_toolpath: np.array, cartesian_toolpath: np.array = None)
         sliders=sliders,
     )
 
-    fig.update_layout(sliders=sliders)
-    fig.show()
+    figure = fig.to_dict()
+    figure["frames"] = frames
+    pio.show(figure, validate=False)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,100 @@
+"""
+This file times the preprocessing stages of the pipeline on the drawings in the svgs directory
+so changes to the toolpath generation can be compared before and after.
+
+usage: python benchmark.py [svg names without extension]
+
+Resampling is timed on the 3d toolpath of the fitted drawing, against the interpolate_toolpath
+that resample_toolpath replaced, kept here and run once since it takes seconds on the spirals.
+"""
+import os
+import sys
+import time
+import numpy as np
+from SVG_to_coords import parse_svg
+from coords_to_toolpath import read_path
+from fit_path import fit_path
+from generate_toolpath import add_pen_lifts, resample_toolpath
+from constants import DRAWING_BOUNDS, CURVE_TOLERANCE_MM, MAX_STEP_MM
+
+SVG_DIRECTORY = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'svgs')
+
+
+def interpolate_toolpath(toolpath: np.array)-> np.array:
+    """
+    interpolate between points in a toolpath to create a smoother toolpath that has
+    a maximum step distance of MAX_STEP_MM between points. Also clip points that are too close
+    together. This is the old resampling of generate_toolpath, which copies the whole toolpath
+    for every point it adds or removes.
+    
+    parameters:
+        toolpath: a 2D numpy array of the x, y, z coordinates of the pen tip in mm 
+            in the base coordinate frame. ex: [[x1, y1, z1], [x2, y2, z2], [x3, y3, z3]]
+    
+    returns:
+        a 2D numpy array of the smoothed x, y, z coordinates of the pen tip in mm 
+        in the base coordinate frame. ex: [[x1, y1, z1], [x2, y2, z2], [x3, y3, z3]]
+    """
+    max_step_squared = MAX_STEP_MM**2
+    i = 1
+    while i < toolpath.shape[0]:
+        # calculate the distance between the current point and the previous point
+        distance_squared = np.sum((toolpath[i] - toolpath[i-1])**2)
+
+        # if the distance between the current point and the previous point is less than the max step clip the point
+        if distance_squared < max_step_squared:
+            toolpath = np.delete(toolpath, i, 0)
+            i -= 1
+
+        # if the distance between the current point and the previous point is greater than the max step interpolate between them
+        elif distance_squared > max_step_squared:
+            num_points = int(np.ceil(np.sqrt(distance_squared) / MAX_STEP_MM))
+            interpolated_points = np.linspace(toolpath[i-1], toolpath[i], num_points+1)
+            toolpath = np.insert(toolpath, i, interpolated_points, axis=0)
+            i += num_points
+        
+        i += 1
+    
+    return toolpath
+
+
+def time_stage(function, *args, repeats=3):
+    """run a function several times and return its result with the fastest run time in seconds."""
+    best = float('inf')
+    for _ in range(repeats):
+        start = time.perf_counter()
+        result = function(*args)
+        best = min(best, time.perf_counter() - start)
+    return result, best
+
+
+def benchmark_svg(file_path: str) -> dict:
+    """time each stage of the pipeline for a single svg file.
+
+    returns:
+        a dict of the run time of each stage in seconds and the number of points produced.
+    """
+    coords, parse_time = time_stage(parse_svg, file_path)
+    toolpath, read_time = time_stage(read_path, coords)
+    toolpath_3d = add_pen_lifts(fit_path(read_path(coords, CURVE_TOLERANCE_MM), DRAWING_BOUNDS))
+    _, interpolate_time = time_stage(interpolate_toolpath, toolpath_3d.points, repeats=1)
+    resampled_toolpath, resample_time = time_stage(resample_toolpath, toolpath_3d)
+    return {
+        'parse_svg': parse_time,
+        'read_path': read_time,
+        'points': len(toolpath.points),
+        'interpolate_toolpath': interpolate_time,
+        'resample_toolpath': resample_time,
+        'resampled_points': len(resampled_toolpath.points),
+    }
+
+
+if __name__ == "__main__":
+    names = sys.argv[1:] or sorted(name[:-4] for name in os.listdir(SVG_DIRECTORY) if name.endswith('.svg'))
+
+    print(f"{'svg':<28}{'points':>10}{'parse_svg':>12}{'read_path':>12}{'interpolate':>14}{'resample':>12}{'speedup':>10}")
+    for name in names:
+        results = benchmark_svg(os.path.join(SVG_DIRECTORY, name + '.svg'))
+        print(f"{name:<28}{results['points']:>10}{results['parse_svg']:>12.4f}{results['read_path']:>12.4f}"
+              f"{results['interpolate_toolpath']:>14.4f}{results['resample_toolpath']:>12.4f}"
+              f"{results['interpolate_toolpath']/results['resample_toolpath']:>9.0f}x")
@@ -4,7 +4,7 @@ get the actual motors positions to line up with our modeled ones
 """
 
 from motor_controller import MotorController, bits_to_degrees, degrees_to_bits, getch
-from forward_kinematics import forward_kinematics
+from forward_kinematics import batch_forward_kinematics
 import time
 import numpy as np
 from constants import ANGLE_OFFSET, ANGLE_SCALING, MOTOR_IDS
@@ -27,7 +27,7 @@ for i in range(0, int(RUNTIME_S/STEP_TIME_S)):
     positions_bits = controller.get_motor_positions()
     positions_degrees_physical = bits_to_degrees(positions_bits)
     positions_degrees_theoretical = ANGLE_SCALING * (positions_degrees_physical - ANGLE_OFFSET)
-    end_deffector_coords = forward_kinematics(positions_degrees_theoretical[0], positions_degrees_theoretical[1], positions_degrees_theoretical[2], positions_degrees_theoretical[3])[5][0:3, 3]
+    end_deffector_coords = batch_forward_kinematics(positions_degrees_theoretical)[0]
     print("Current motor positions: ", positions_degrees_physical, "end deffector coords: ", end_deffector_coords)
     time.sleep(STEP_TIME_S)
 
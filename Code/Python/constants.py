@@ -25,6 +25,7 @@ THETA_4_MAX =  99
 
 PEN_LIFT_MM = 5        # mm  [PEN LIFT HEIGHT]
 MAX_STEP_MM = 1       # mm  [MAXIMUM DISTANCE BETWEEN POINTS IN THE TOOLPATH]
+MIN_STEP_MM = 0.5     # mm  [MINIMUM DISTANCE BETWEEN POINTS IN THE TOOLPATH, AT MOST HALF THE MAXIMUM]
 
 
 
@@ -48,7 +49,21 @@ MOTOR_IDS = [1, 2, 3, 4]                                # The motor ids for the
 ESC_CH = 0x1b                                           # The escape character used to exit the program.
 TABLE_HEIGHT_MM = -2                                 #  The height of the table in mm in the base coordinate frame.
 
-POINTS_IN_CURVE = 100
+POINTS_IN_CURVE = 100                                   # Points per curve when no flattening tolerance is given.
+CURVE_TOLERANCE_MM = 0.05                               # Maximum distance in mm between a flattened curve and the true curve after fitting.
+BASE_ROTATION_COST_MM = 2                               # mm of pen-up travel one degree of base rotation is worth when ordering strokes.
+MERGE_TOLERANCE_MM = 0.01                               # Distance in mm between the ends of two strokes for them to be joined into one.
+SIMPLIFY_TOLERANCE_MM = 0.05                            # Largest distance in mm between a point removed by simplification and the stroke.
+DUPLICATE_TOLERANCE_MM = 0.1                            # Distance in mm between two lines for the later one to count as a duplicate, keep below the pen width.
+PEN_DOWN_GAP_MM = 0.3                                   # Longest gap in mm between strokes the pen is dragged across instead of lifted.
+DRAW_FEED_MM_S = 20                                     # Pen speed in mm/s while drawing.
+TRAVEL_FEED_MM_S = 80                                   # Pen speed in mm/s while the pen is lifted.
+ACCELERATION_MM_S2 = 1000                               # Largest acceleration of the pen tip in mm/s^2.
+JUNCTION_DEVIATION_MM = 0.05                            # How far in mm a corner may be rounded off, lower slows the pen more at corners.
+CONTROL_PERIOD_S = 0.05                                 # Time in s between two motor commands, keep above the bus round trip time.
+JOINT_SPEED_DEG_S = 120                                 # Speed of the fastest joint in degrees/s during pen-up moves between strokes.
+JOINT_ACCELERATION_DEG_S2 = 600                         # Acceleration of the fastest joint in degrees/s^2 during pen-up moves.
+TRAVEL_CLEARANCE_MM = 2                                 # Lowest height in mm of the pen above the table during pen-up moves.
 
 GAINS = [
     {
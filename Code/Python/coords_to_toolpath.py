@@ -3,8 +3,10 @@ import os
 import re
 import numpy as np
 from SVG_to_coords import *
-import plotly.express as px
-import bezier
+from flatten_curves import flatten_cubics_adaptive, cubic_segment_counts, quadratic_to_cubic, arc_to_cubics
+from fit_path import fit_scale
+from toolpath import Toolpath
+from concurrent.futures import ProcessPoolExecutor
 from constants import *
 
 def get_last_x(arr):
@@ -29,92 +31,233 @@ def get_last_y(arr):
         # Handle arrays with more than 2 dimensions as needed
         raise ValueError("Arrays with more than 2 dimensions are not supported.")
 
-def read_path(command_matrix):
-    toolpath_set = False
-    total_toolpath = []
-    for command_path in command_matrix:
-        for command_line in command_path:
-            match command_line[0]:
-                case 'M':
-                    if toolpath_set:
-                        total_toolpath.append(toolpath)
-                    toolpath = np.array([float(command_line[1]), float(command_line[2])], dtype=float)
-                    toolpath_set = True
-                case 'm':
-                    if toolpath_set:
-                        total_toolpath.append(toolpath)
-                        toolpath = np.array([float(command_line[1]) + get_last_x(total_toolpath[-1]), float(command_line[2]) + get_last_y(total_toolpath[-1])], dtype=float)
-                    else:
-                        toolpath = np.array([float(command_line[1]), float(command_line[2])], dtype=float)    
-                    toolpath_set = True
-                case 'L':
-                    for i in range(1, len(command_line)-1, 2):
-                        toolpath = np.vstack((toolpath, np.array([float(command_line[i]), float(command_line[i+1])])))
-                case 'l':
-                    for i in range(1, len(command_line)-1, 2):
-                        toolpath = np.vstack((toolpath, np.array([float(command_line[i]) + get_last_x(toolpath), float(command_line[i+1]) + get_last_y(toolpath)])))
-                case 'H':
-                    for i in range(1, len(command_line)):
-                        toolpath = np.vstack((toolpath, np.array([float(command_line[i]), get_last_y(toolpath)])))
-                case 'h':
-                    for i in range(1, len(command_line)):
-                        toolpath = np.vstack((toolpath, np.array([float(command_line[i]) + get_last_x(toolpath), get_last_y(toolpath)])))
-                case 'V':
-                    for i in range(1, len(command_line)):
-                        toolpath = np.vstack((toolpath, np.array([get_last_x(toolpath), float(command_line[i])])))
-                case 'v':
-                    for i in range(1, len(command_line)):
-                        toolpath = np.vstack((toolpath, np.array([get_last_x(toolpath), float(command_line[i]) + get_last_y(toolpath)])))
-                case 'C':
-                    number_of_curves = int((len(command_line) - 1)/6)
-                    for i in range(0, number_of_curves):
-                        nodes = np.asfortranarray([
-                            [get_last_x(toolpath), float(command_line[1+6*i]), float(command_line[3+6*i]), float(command_line[5+6*i])],
-                            [get_last_y(toolpath), float(command_line[2+6*i]), float(command_line[4+6*i]), float(command_line[6+6*i])],
-                        ])
-                        curve = bezier.Curve(nodes, degree=3)
-                        for i in range(1, POINTS_IN_CURVE+1):
-                            percentage = i/POINTS_IN_CURVE
-                            toolpath = np.vstack((toolpath, curve.evaluate(percentage).T))
-                case 'c':
-                    number_of_curves = int((len(command_line) - 1)/6)
-                    for i in range(0, number_of_curves):
-                        nodes = np.asfortranarray([
-                            [get_last_x(toolpath), float(command_line[1+6*i])+ get_last_x(toolpath), float(command_line[3+6*i])+ get_last_x(toolpath), float(command_line[5+6*i])+ get_last_x(toolpath)],
-                            [get_last_y(toolpath), float(command_line[2+6*i])+ get_last_y(toolpath), float(command_line[4+6*i])+ get_last_y(toolpath), float(command_line[6+6*i])+ get_last_y(toolpath)],
-                        ])
-                        curve = bezier.Curve(nodes, degree=3)
-                        for i in range(1, POINTS_IN_CURVE+1):
-                            percentage = i/POINTS_IN_CURVE
-                            toolpath = np.vstack((toolpath, curve.evaluate(percentage).T))  
-                case 'S':
-                    toolpath = np.vstack((toolpath, np.array([float(command_line[3]), float(command_line[4])])))
-                case 's':
-                    toolpath = np.vstack((toolpath, np.array([float(command_line[3]) + get_last_x(toolpath), float(command_line[4]) + get_last_y(toolpath)])))
-                case 'Q':
-                    toolpath = np.vstack((toolpath, np.array([float(command_line[3]), float(command_line[4])])))
-                case 'q':
-                    toolpath = np.vstack((toolpath, np.array([float(command_line[3]) + get_last_x(toolpath), float(command_line[4]) + get_last_y(toolpath)])))
-                case 'T':
-                    toolpath = np.vstack((toolpath, np.array([float(command_line[1]), float(command_line[2])])))
-                case 't':
-                    toolpath = np.vstack((toolpath, np.array([float(command_line[1]) + get_last_x(toolpath), float(command_line[2]) + get_last_y(toolpath)])))
-                case 'A':
-                    toolpath = np.vstack((toolpath, np.array([float(command_line[6]), float(command_line[7])])))
-                case 'a':
-                    toolpath = np.vstack((toolpath, np.array([float(command_line[6]) + get_last_x(toolpath), float(command_line[7]) + get_last_y(toolpath)])))
-                case 'Z' | 'z':
-                    toolpath = np.vstack((toolpath, toolpath[0]))
-                case _:
+# smallest number of path commands worth starting worker processes for
+PARALLEL_MIN_COMMANDS = 20000
+
+def walk_path(path):
+    """walk the commands of one path and collect the points of each subpath.
+
+    Straight segments are turned into points directly. Every curve (cubic, smooth, quadratic
+    and elliptical arc) is converted to a cubic bezier and left as a placeholder in its
+    subpath so all curves can be sampled in one batch. (see read_path)
+
+    parameters:
+        path: the tokenized PathData of one svg path element.
+
+    returns:
+        a list with a list of point chunks for each subpath, where a slice chunk stands for
+        the samples of those curves, and a (N, 4, 2) array of the control points of the curves.
+    """
+    opcodes, args, offsets = path.opcodes, path.args, path.offsets
+    subpaths = []               # chunks of points of each subpath
+    cubics = []                 # control points of every curve as a cubic bezier
+    subpath = []                # chunks of points in the current subpath
+    current = None              # the last point added to the current subpath
+    cubic_control = None        # last control point of the previous C/S, reflected by S
+    quadratic_control = None    # control point of the previous Q/T, reflected by T
+    for command_index, opcode in enumerate(opcodes):
+        command_line = args[offsets[command_index]:offsets[command_index+1]]
+        command = chr(opcode)
+        relative = command.islower()
+        first_curve = len(cubics)
+        points = None
+        match command.upper():
+            case 'M':
+                if subpath:
+                    subpaths.append(subpath)
+                points = command_line[0:2].reshape(1, 2).copy()
+                if relative and subpath:
+                    points += current
+                subpath = []
+            case 'L':
+                points = command_line[:len(command_line)//2*2].reshape(-1, 2)
+                if relative:
+                    points = np.cumsum(np.vstack((current, points)), axis=0)[1:]
+            case 'H':
+                x = np.cumsum(np.append(current[0], command_line))[1:] if relative else command_line
+                points = np.column_stack((x, np.full(len(command_line), current[1])))
+            case 'V':
+                y = np.cumsum(np.append(current[1], command_line))[1:] if relative else command_line
+                points = np.column_stack((np.full(len(command_line), current[0]), y))
+            case 'C':
+                for i in range(0, len(command_line)//6):
+                    nodes = command_line[6*i:6*i+6].reshape(3, 2) + (current if relative else 0)
+                    cubics.append(np.vstack((current, nodes)))
+                    cubic_control, current = nodes[1], nodes[2]
+            case 'S':
+                for i in range(0, len(command_line)//4):
+                    nodes = command_line[4*i:4*i+4].reshape(2, 2) + (current if relative else 0)
+                    reflected = current if cubic_control is None else 2*current - cubic_control
+                    cubics.append(np.vstack((current, reflected, nodes)))
+                    cubic_control, current = nodes[0], nodes[1]
+            case 'Q':
+                for i in range(0, len(command_line)//4):
+                    nodes = command_line[4*i:4*i+4].reshape(2, 2) + (current if relative else 0)
+                    cubics.append(quadratic_to_cubic(current, nodes[0], nodes[1]))
+                    quadratic_control, current = nodes[0], nodes[1]
+            case 'T':
+                for i in range(0, len(command_line)//2):
+                    end = command_line[2*i:2*i+2] + (current if relative else 0)
+                    reflected = current if quadratic_control is None else 2*current - quadratic_control
+                    cubics.append(quadratic_to_cubic(current, reflected, end))
+                    quadratic_control, current = reflected, end
+            case 'A':
+                for i in range(0, len(command_line)//7):
+                    rx, ry, rotation, large_arc, sweep = command_line[7*i:7*i+5]
+                    end = command_line[7*i+5:7*i+7] + (current if relative else 0)
+                    cubics.extend(arc_to_cubics(current, rx, ry, rotation, large_arc, sweep, end))
+                    current = end
+            case 'Z':
+                points = subpath[0][0:1]
+            case _:
+                continue
+
+        # smooth curves only reflect the control point of a directly preceding curve
+        if command.upper() not in 'CS':
+            cubic_control = None
+        if command.upper() not in 'QT':
+            quadratic_control = None
+
+        if points is not None:
+            subpath.append(points)
+            current = points[-1]
+        elif len(cubics) > first_curve:
+            # placeholder for the curve samples, filled in once all curves are evaluated
+            subpath.append(slice(first_curve, len(cubics)))
+    if subpath:
+        subpaths.append(subpath)
+    return subpaths, np.array(cubics).reshape(-1, 4, 2)
+
+
+def walk_paths(paths):
+    """walk a list of paths, used to send a chunk of paths to each worker process."""
+    return [walk_path(path) for path in paths]
+
+
+def split_paths(paths, number_of_chunks):
+    """split a list of paths into consecutive chunks with about the same number of commands."""
+    command_count = np.cumsum([len(path.opcodes) for path in paths])
+    boundaries = np.searchsorted(command_count, command_count[-1] * np.arange(1, number_of_chunks) / number_of_chunks)
+    boundaries = np.unique(np.concatenate(([0], boundaries, [len(paths)])))
+    return [paths[start:stop] for start, stop in zip(boundaries[:-1], boundaries[1:])]
+
+
+def read_path(command_matrix, tolerance_mm=None, bounds=DRAWING_BOUNDS, verbose=False, workers=1):
+    """convert tokenized svg path data into a toolpath of 2D polylines.
+
+    Each subpath is collected as a list of point chunks that are concatenated once at the end,
+    so the cost is linear in the number of points produced. Every curve in the document
+    (cubic, smooth, quadratic and elliptical arc) is converted to a cubic bezier, gathered
+    and then sampled in a single batch.
+
+    Paths with the same shape (see SVG_to_coords.path_key), like repeated letters or paths
+    drawn through <use> elements, are only flattened once and then copied to each position.
+
+    parameters:
+        command_matrix: an iterable of PathData, one per svg path element.
+            (see SVG_to_coords.parse_svg)
+        tolerance_mm: maximum distance in mm between each curve and its polyline once the
+            drawing is fitted to the bounds. If None every curve gets POINTS_IN_CURVE points.
+        bounds: the bounds the drawing will be fitted to, used to convert tolerance_mm into
+            svg units. (see fit_path.fit_path)
+        verbose: print how many curve points were saved compared to POINTS_IN_CURVE and how
+            many paths were copied from an earlier path with the same shape.
+        workers: number of processes to walk the path commands with. Drawings with fewer
+            than PARALLEL_MIN_COMMANDS commands, or only one path, are always walked in this
+            process. The calling script must be guarded by if __name__ == "__main__".
+
+    returns:
+        a Toolpath with a stroke of the x, y coordinates of each subpath with the y axis flipped.
+    """
+    shapes = {}                 # path key -> index of the shape in unique_paths and its origin
+    unique_paths = []
+    path_copies = []            # (shape index, offset, transform) of each path
+    for path in command_matrix:
+        key, origin = path_key(path)
+        if key not in shapes:
+            shapes[key] = (len(unique_paths), origin)
+            unique_paths.append(path)
+        shape, shape_origin = shapes[key]
+        path_copies.append((shape, origin - shape_origin, path.transform))
+
+    command_count = sum(len(path.opcodes) for path in unique_paths)
+    if workers > 1 and len(unique_paths) > 1 and command_count >= PARALLEL_MIN_COMMANDS:
+        walked_paths = []
+        with ProcessPoolExecutor(workers) as executor:
+            for walked_chunk in executor.map(walk_paths, split_paths(unique_paths, workers*4)):
+                walked_paths.extend(walked_chunk)
+    else:
+        walked_paths = walk_paths(unique_paths)
+
+    # merge the paths in document order, shifting each path's curve placeholders to index
+    # into one array of every curve in the drawing
+    subpaths = []
+    shape_subpaths = []         # (first subpath, last subpath) of each shape
+    shape_cubics = []           # (first curve, last curve) of each shape
+    cubic_arrays = []
+    cubic_count = 0
+    for path_subpaths, path_cubics in walked_paths:
+        shape_subpaths.append((len(subpaths), len(subpaths) + len(path_subpaths)))
+        shape_cubics.append((cubic_count, cubic_count + len(path_cubics)))
+        for subpath in path_subpaths:
+            subpaths.append([chunk if isinstance(chunk, np.ndarray) else slice(chunk.start + cubic_count, chunk.stop + cubic_count)
+                             for chunk in subpath])
+        cubic_arrays.append(path_cubics)
+        cubic_count += len(path_cubics)
+    cubics = np.concatenate(cubic_arrays) if cubic_arrays else np.zeros((0, 4, 2))
+
+    curve_points = np.zeros((0, 2))
+    curve_offsets = np.zeros(1, dtype=int)
+    if len(cubics):
+        if tolerance_mm is None:
+            counts = np.full(len(cubics), POINTS_IN_CURVE)
+        else:
+            # the end points of every segment lie on the drawing, so the extent of every copy's
+            # end points can only underestimate the drawing's size and the tolerance in svg
+            # units stays conservative
+            shape_vertices = [np.concatenate([chunk for subpath in subpaths[first_subpath:last_subpath] for chunk in subpath
+                                              if isinstance(chunk, np.ndarray)] + [cubics[first_cubic:last_cubic, 3]])
+                              for (first_subpath, last_subpath), (first_cubic, last_cubic) in zip(shape_subpaths, shape_cubics)]
+            shape_extents = [(vertices.min(axis=0), vertices.max(axis=0)) if len(vertices) else None for vertices in shape_vertices]
+            extents = []
+            scales = np.zeros(len(unique_paths))    # largest stretch of any copy of each shape
+            for shape, offset, transform in path_copies:
+                if shape_extents[shape] is None:
                     continue
-        if toolpath_set:
-            total_toolpath.append(toolpath)
-            toolpath_set = False
+                if transform is None:
+                    scales[shape] = max(scales[shape], 1)
+                    extents.extend(corner + offset for corner in shape_extents[shape])
+                else:
+                    scales[shape] = max(scales[shape], np.linalg.norm(transform[:, :2], 2))
+                    vertices = (shape_vertices[shape] + offset) @ transform[:, :2].T + transform[:, 2]
+                    extents.extend((vertices.min(axis=0), vertices.max(axis=0)))
 
-    # flip y axis
-    for i, toolpath in enumerate(total_toolpath):
-        total_toolpath[i] = toolpath*np.array([1, -1])
-    return total_toolpath
+            # a transform scales the sag of a curve with it, so each curve gets the tolerance of
+            # the most stretched copy of its shape
+            curve_scales = np.repeat(scales, np.diff(shape_cubics, axis=1).ravel())
+            counts = cubic_segment_counts(cubics, tolerance_mm / fit_scale(np.array(extents), bounds) / curve_scales)
+        curve_points = flatten_cubics_adaptive(cubics, counts)
+        curve_offsets = np.append(0, np.cumsum(counts))
+        if verbose:
+            print(f"Flattened {len(cubics)} curves into {curve_offsets[-1]} points, "
+                  f"{len(cubics)*POINTS_IN_CURVE - curve_offsets[-1]} fewer than {POINTS_IN_CURVE} points per curve.")
+
+    if verbose:
+        print(f"Flattened {len(shapes)} unique shapes for {len(path_copies)} paths.")
+
+    polylines = [np.concatenate([chunk if isinstance(chunk, np.ndarray) else curve_points[curve_offsets[chunk.start]:curve_offsets[chunk.stop]]
+                                 for chunk in subpath])
+                 for subpath in subpaths]
+    total_toolpath = []
+    for shape, offset, transform in path_copies:
+        first_subpath, last_subpath = shape_subpaths[shape]
+        for polyline in polylines[first_subpath:last_subpath]:
+            toolpath = polyline + offset
+            if transform is not None:
+                toolpath = toolpath @ transform[:, :2].T + transform[:, 2]
+            # flip y axis
+            total_toolpath.append(toolpath*np.array([1, -1]))
+    return Toolpath.from_strokes(total_toolpath)
 
 # def coords_to_toolpath(coords):
 #     total_toolpath = []
@@ -132,6 +275,8 @@ def read_path(command_matrix):
 #     return total_toolpath
 
 if __name__ == "__main__":
+    import plotly.express as px
+    from decimate import decimate_path
     current_working_directory = os.getcwd()
     #file_name = input("What file do you want to use?\n")
     file_name = "hello_world"
@@ -140,7 +285,7 @@ if __name__ == "__main__":
     print(coords)
     toolpath = read_path(coords)
     print(toolpath)
-    consolidated_toolpath = np.concatenate(toolpath)
+    consolidated_toolpath = decimate_path(toolpath.points)
     fig = px.line(x=consolidated_toolpath[:,0], y=consolidated_toolpath[:,1])
     fig.update_yaxes(scaleanchor="x",scaleratio=1)
     fig.show()
\ No newline at end of file
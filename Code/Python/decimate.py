@@ -0,0 +1,161 @@
+"""
+This file contains functions that cut down the number of points sent to a plot while keeping
+its shape, so figures of long toolpaths stay responsive in the browser.
+
+Time series like joint angles use largest-triangle-three-buckets, which keeps the point of each
+bucket that makes the largest triangle with its neighbours and so keeps peaks. Toolpaths use the
+Ramer-Douglas-Peucker simplification of simplify_path with the smallest tolerance that brings
+them under the limit, which keeps corners. Instead of searching for that tolerance, every point
+is ranked once by the tolerance that would drop it.
+"""
+import numpy as np
+from simplify_path import segment_distances, SIMPLIFY_PIECE_POINTS
+
+PLOT_MAX_POINTS = 5000          # most points drawn in one trace
+
+
+def lttb_indices(x: np.array, y: np.array, max_points: int = PLOT_MAX_POINTS) -> np.array:
+    """pick the points of a time series to plot with largest-triangle-three-buckets.
+
+    parameters:
+        x, y: 1D arrays of the coordinates of the series, with x increasing.
+        max_points: the number of points to keep.
+
+    returns:
+        the sorted indices of the kept points, always including the first and last point.
+    """
+    n = len(y)
+    if n <= max_points:
+        return np.arange(n)
+    if max_points < 3:
+        return np.array([0, n - 1])
+    x, y = np.asarray(x, dtype=float), np.asarray(y, dtype=float)
+
+    # the first and last point are their own buckets, the rest are split as evenly as possible
+    edges = np.append((np.arange(max_points - 2)*(n - 2)/(max_points - 2)).astype(int) + 1, n - 1)
+    counts = np.diff(edges)
+    average_x = np.append(np.add.reduceat(x[:-1], edges[:-1])/counts, x[-1])
+    average_y = np.append(np.add.reduceat(y[:-1], edges[:-1])/counts, y[-1])
+
+    indices = np.empty(max_points, dtype=int)
+    indices[0], indices[-1] = 0, n - 1
+    previous = 0
+    for bucket in range(max_points - 2):
+        start, end = edges[bucket], edges[bucket + 1]
+        # twice the area of the triangle between the last kept point, each point of the bucket
+        # and the average of the next bucket
+        areas = np.abs((x[previous] - average_x[bucket + 1])*(y[start:end] - y[previous])
+                       - (x[previous] - x[start:end])*(average_y[bucket + 1] - y[previous]))
+        previous = start + np.argmax(areas)
+        indices[bucket + 1] = previous
+    return indices
+
+
+def rdp_importance(points: np.array) -> np.array:
+    """rank the points of a polyline by when Ramer-Douglas-Peucker simplification drops them.
+
+    Each piece is split at its farthest point like in simplify_mask, with a tolerance of 0. A
+    point is kept by simplification with a tolerance t exactly when its importance is above t,
+    as it is only reached if every split before it was.
+
+    parameters:
+        points: a (N, 2) or (N, 3) array of the points of the polyline.
+
+    returns:
+        the importance of each point: its distance from the piece it split, or the importance of
+        that piece's split if smaller, inf for points that are always kept and 0 for points on
+        the line between their neighbours.
+    """
+    n = len(points)
+    importance = np.zeros(n)
+    importance[::SIMPLIFY_PIECE_POINTS] = np.inf
+    importance[-1] = np.inf
+    kept = np.flatnonzero(importance)
+    starts, ends, parents = kept[:-1], kept[1:], np.full(len(kept) - 1, np.inf)
+
+    while len(starts):
+        interior = ends - starts - 1
+        has_interior = interior > 0
+        starts, ends, parents, interior = starts[has_interior], ends[has_interior], parents[has_interior], interior[has_interior]
+        if len(starts) == 0:
+            break
+        piece = np.repeat(np.arange(len(starts)), interior)
+        first_interior = np.cumsum(interior) - interior
+        indices = np.arange(piece.size) - first_interior[piece] + starts[piece] + 1
+        distances = segment_distances(points[indices], points[starts[piece]], points[ends[piece]])
+
+        farthest_distance = np.maximum.reduceat(distances, first_interior)
+        is_farthest = distances == farthest_distance[piece]
+        farthest_piece, first_match = np.unique(piece[is_farthest], return_index=True)
+        farthest = indices[is_farthest][first_match]
+        split = farthest_distance[farthest_piece] > 0
+        farthest, farthest_piece = farthest[split], farthest_piece[split]
+        importance[farthest] = np.minimum(farthest_distance[farthest_piece], parents[farthest_piece])
+        starts = np.concatenate((starts[farthest_piece], farthest))
+        ends = np.concatenate((farthest, ends[farthest_piece]))
+        parents = np.tile(importance[farthest], 2)
+    return importance
+
+
+def rdp_indices(points: np.array, max_points: int = PLOT_MAX_POINTS) -> np.array:
+    """pick the points of a polyline to plot with Ramer-Douglas-Peucker simplification.
+
+    parameters:
+        points: a (N, 2) or (N, 3) array of the points of the polyline.
+        max_points: the most points to keep.
+
+    returns:
+        the sorted indices of the max_points most important points, which are the points kept
+        by simplifying with the smallest tolerance that keeps at most max_points points, apart
+        from points tied at that tolerance. The first and last point are always kept.
+    """
+    n = len(points)
+    if n <= max_points:
+        return np.arange(n)
+    importance = rdp_importance(np.asarray(points, dtype=float))
+
+    # the points every piece starts from can be more than the limit for very long polylines
+    always_kept = np.flatnonzero(importance == np.inf)
+    if len(always_kept) >= max_points:
+        return always_kept[np.linspace(0, len(always_kept) - 1, max_points).round().astype(int)]
+    return np.sort(np.argpartition(-importance, max_points - 1)[:max_points])
+
+
+def decimate_series(x: np.array, y: np.array, max_points: int = PLOT_MAX_POINTS) -> tuple:
+    """the x and y coordinates of a time series cut down to at most max_points points."""
+    indices = lttb_indices(x, y, max_points)
+    return np.asarray(x)[indices], np.asarray(y)[indices]
+
+
+def decimate_path(points: np.array, max_points: int = PLOT_MAX_POINTS) -> np.array:
+    """the points of a 2D or 3D toolpath cut down to at most max_points points."""
+    points = np.asarray(points)
+    return points[rdp_indices(points, max_points)]
+
+
+if __name__ == "__main__":
+    import time
+
+    # a noisy signal with a few sharp peaks
+    rng = np.random.default_rng(0)
+    x = np.arange(1000000, dtype=float)
+    y = np.sin(x/20000) + 0.05*rng.standard_normal(len(x))
+    y[[100000, 500000, 900000]] = 3
+    start_time = time.perf_counter()
+    decimated_x, decimated_y = decimate_series(x, y)
+    print(f"lttb: {len(x)} to {len(decimated_x)} points in {time.perf_counter() - start_time:.3f} s, "
+          f"peak kept: {decimated_y.max() == 3}")
+
+    # a spiral
+    angle = np.linspace(0, 200*np.pi, 1000000)
+    spiral = np.column_stack((angle*np.cos(angle), angle*np.sin(angle)))
+    start_time = time.perf_counter()
+    decimated_spiral = decimate_path(spiral)
+    print(f"rdp: {len(spiral)} to {len(decimated_spiral)} points in {time.perf_counter() - start_time:.3f} s")
+
+    import plotly.graph_objects as go
+    fig = go.Figure()
+    fig.add_trace(go.Scatter(x=spiral[::100, 0], y=spiral[::100, 1], mode='lines', name='Every 100th point'))
+    fig.add_trace(go.Scatter(x=decimated_spiral[:, 0], y=decimated_spiral[:, 1], mode='lines', name='Decimated'))
+    fig.update_layout(title='Decimation', showlegend=True)
+    fig.show()
@@ -0,0 +1,161 @@
+"""
+This file contains an offline export of arm animations to MP4 or GIF, for archiving and
+reviewing whole jobs where an interactive plotly figure is too heavy.
+
+Frames are drawn from above with the rasterizer of preview.py: the planned drawing in grey, the
+lines the pen has drawn so far in black and the links of the arm on top. The joint positions
+of every frame come from one batched forward kinematics call. Frames are split into contiguous
+chunks rendered by a pool of processes, each drawing the trail of its first frame once and then
+adding to it frame by frame, and written in order with imageio, which is only imported here.
+
+Each frame is 1/fps of a second of video and speed seconds of the job, where each row of the
+angular toolpath takes CONTROL_PERIOD_S, so a video at speed 1 lasts as long as the drawing.
+"""
+import time
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from constants import *
+from forward_kinematics import batch_forward_kinematics, batch_link_coordinates
+from preview import pen_down_segments, segment_pixels
+
+VIDEO_FPS = 20                  # frames per second of the exported video
+VIDEO_PIXELS_PER_MM = 2         # resolution of the exported video
+VIDEO_MARGIN_MM = 20            # space around the base and the drawing bounds
+VIDEO_CHUNK_FRAMES = 100        # frames rendered by a process at a time
+VIDEO_PEN_WIDTH_MM = 1          # width of the drawn lines, wider than the pen so they show at video resolution
+VIDEO_LINK_WIDTH_MM = 6         # width of the links of the arm
+VIDEO_PLANNED_INK = (200, 200, 200)
+VIDEO_TRAIL_INK = (0, 0, 0)
+VIDEO_LINK_INK = (40, 90, 200)
+VIDEO_PEN_INK = (220, 30, 30)   # colour of the pen tip while it is on the paper, lifted it takes the link colour
+
+# what every process needs to render its frames, set once per process by start_renderer
+renderer = {}
+
+
+def video_frame_steps(steps: int, fps: float = VIDEO_FPS, speed: float = 1) -> np.array:
+    """the row of the angular toolpath shown in each frame.
+
+    parameters:
+        steps: the number of rows of the angular toolpath, each sent CONTROL_PERIOD_S apart.
+        fps: the frame rate of the video.
+        speed: how many times faster than the arm the video plays, below 1 plays in slow motion.
+
+    returns:
+        the index of the row shown in each frame, from the first row to the last.
+    """
+    steps_per_frame = speed/(fps*CONTROL_PERIOD_S)
+    frames = int(np.ceil((steps - 1)/steps_per_frame)) + 1
+    return np.minimum(np.floor(np.arange(frames)*steps_per_frame + 1e-9).astype(int), steps - 1)
+
+
+def start_renderer(state: dict) -> None:
+    """store the arrays shared by every frame in a process of the pool."""
+    renderer.clear()
+    renderer.update(state)
+
+
+def render_frames(frames: range) -> list:
+    """draw a run of consecutive frames with the state set by start_renderer.
+
+    parameters:
+        frames: the indices of the frames, into renderer['frame_steps'].
+
+    returns:
+        a list of (rows, columns, 3) uint8 RGB images.
+    """
+    shape, origin, pixels_per_mm = renderer['shape'], renderer['origin'], renderer['pixels_per_mm']
+    pen_tips, frame_steps, links = renderer['pen_tips'], renderer['frame_steps'], renderer['links']
+
+    # the background with the trail drawn on it, which only grows from frame to frame
+    canvas = renderer['background'].copy()
+    drawn_to = 0                # the canvas has every segment up to this row
+    images = []
+    for frame in frames:
+        step = frame_steps[frame]
+        if step > drawn_to:
+            canvas[segment_pixels(*pen_down_segments(pen_tips[drawn_to:step + 1]), shape, origin,
+                                  pixels_per_mm, VIDEO_PEN_WIDTH_MM)] = VIDEO_TRAIL_INK
+            drawn_to = step
+        image = canvas.copy()
+
+        # the arm from above, from the base through every joint to the pen tip
+        joints = links[frame, :, :2]
+        image[segment_pixels(joints[:-1], joints[1:], shape, origin, pixels_per_mm, VIDEO_LINK_WIDTH_MM)] = VIDEO_LINK_INK
+        if pen_tips[step, 2] < TABLE_HEIGHT_MM + PEN_LIFT_MM/2:
+            image[segment_pixels(joints[-1:], joints[-1:], shape, origin, pixels_per_mm, VIDEO_LINK_WIDTH_MM)] = VIDEO_PEN_INK
+        images.append(image)
+    return images
+
+
+def export_video(angular_toolpath: np.array, file_path: str, cartesian_toolpath=None, fps: float = VIDEO_FPS,
+                 speed: float = 1, workers: int = 1, pixels_per_mm: float = VIDEO_PIXELS_PER_MM, verbose: bool = False) -> None:
+    """
+    Renders the arm moving through an angular toolpath into a video file.
+
+    parameters:
+        angular_toolpath: a (N, 4) array of the angles of joints 1 to 4 in degrees, one row
+            every CONTROL_PERIOD_S.
+        file_path: the video to write, an .mp4 (which needs the imageio-ffmpeg package) or a .gif.
+        cartesian_toolpath: an optional planned toolpath drawn in grey under the arm, see
+            preview.pen_down_segments for what it can be.
+        fps: the frame rate of the video.
+        speed: how many times faster than the arm the video plays. (see video_frame_steps)
+        workers: number of processes rendering frames. The calling script must be guarded by
+            if __name__ == "__main__" when it is more than 1.
+        pixels_per_mm: the resolution of the video.
+        verbose: print the number of frames and how long they took.
+    """
+    import imageio.v2 as imageio
+    start_time = time.perf_counter()
+    angular_toolpath = np.asarray(angular_toolpath, dtype=float)
+    frame_steps = video_frame_steps(len(angular_toolpath), fps, speed)
+
+    # the area around the base and the paper, rounded up to a multiple of 16 pixels for the video encoder
+    low = np.array([min(0, DRAWING_BOUNDS[:, 0].min()), DRAWING_BOUNDS[:, 1].min()]) - VIDEO_MARGIN_MM
+    high = DRAWING_BOUNDS.max(axis=0) + VIDEO_MARGIN_MM
+    origin = np.array([low[0], high[1]])       # the top left corner, see preview.segment_pixels
+    size = high - low
+    shape = tuple(int(np.ceil(size[axis]*pixels_per_mm/16))*16 for axis in (1, 0))
+
+    background = np.full(shape + (3,), 255, dtype=np.uint8)
+    if cartesian_toolpath is not None:
+        background[segment_pixels(*pen_down_segments(cartesian_toolpath), shape, origin, pixels_per_mm,
+                                  VIDEO_PEN_WIDTH_MM)] = VIDEO_PLANNED_INK
+    state = {'background': background,
+             'shape': shape,
+             'origin': origin,
+             'pixels_per_mm': pixels_per_mm,
+             'pen_tips': batch_forward_kinematics(angular_toolpath),
+             'frame_steps': frame_steps,
+             'links': batch_link_coordinates(angular_toolpath[frame_steps])}
+    chunks = [range(first, min(first + VIDEO_CHUNK_FRAMES, len(frame_steps)))
+              for first in range(0, len(frame_steps), VIDEO_CHUNK_FRAMES)]
+
+    with imageio.get_writer(file_path, fps=fps) as writer:
+        if workers > 1 and len(chunks) > 1:
+            with ProcessPoolExecutor(workers, initializer=start_renderer, initargs=(state,)) as executor:
+                for images in executor.map(render_frames, chunks):
+                    for image in images:
+                        writer.append_data(image)
+        else:
+            start_renderer(state)
+            for chunk in chunks:
+                for image in render_frames(chunk):
+                    writer.append_data(image)
+
+    if verbose:
+        print(f"Exported {len(frame_steps)} frames ({len(frame_steps)/fps:.1f} s of video for "
+              f"{len(angular_toolpath)*CONTROL_PERIOD_S:.1f} s of drawing) to {file_path} "
+              f"in {time.perf_counter() - start_time:.1f} s.")
+
+
+if __name__ == "__main__":
+    import os
+    from pipeline_cache import generate_toolpaths
+
+    file_name = 'hello_world'
+    python_directory = os.path.dirname(os.path.abspath(__file__))
+    outputs = generate_toolpaths(os.path.join(python_directory, 'svgs', file_name + '.svg'), verbose=False)
+    export_video(outputs['angular_toolpath'], os.path.join(python_directory, 'data', file_name + '.mp4'),
+                 outputs['cartesian_toolpath'], speed=10, workers=4, verbose=True)
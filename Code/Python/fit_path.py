@@ -3,13 +3,33 @@ This file contains a function and tests for processing a simple 2D drawing into
 scaled cartesian toolpath for the end deffector of our robot arm
 """
 import numpy as np
+from toolpath import Toolpath
+
+def fit_scale(consolidated_toolpath: np.array, bounds: np.array) -> float:
+    """find the scale factor that fits a set of 2D points inside the bounds of the drawing area
+    while keeping their aspect ratio.
+
+    parameters:
+        consolidated_toolpath: a 2D array of x, y coordinates. ex: [[x1, y1], [x2, y2]]
+        bounds: a 2D array of two x, y coordinates of the corners of a rectangle that represent
+            the bounds of the drawing area. ex: [[x1, y1], [x2, y2]]
+
+    returns:
+        the scale factor that maps the size of the points onto the size of the bounds.
+    """
+    toolpath_size = np.ptp(consolidated_toolpath, axis=0)
+    bounds_size = np.ptp(bounds, axis=0)
+
+    # use minimum scalar to keep the aspect ratio of the toolpath the same
+    return min(bounds_size[0] / toolpath_size[0], bounds_size[1] / toolpath_size[1])
+
 
 def fit_path(flat_toolpath, bounds: np.array) -> np.array:
     """fit the 2d toolpath to the bounds of the drawing area using simple bounds.
     
     parameters:
-        flat_toolpath_in: a list of 2D arrays of the x, y coordinates of the pen tip in mm 
-            in the base coordinate frame. ex: [[[x1, y1], [x2, y2]], [[x3, y3], [x4, y4]]]
+        flat_toolpath_in: a Toolpath, or a list of 2D arrays of the x, y coordinates of the pen tip
+            in mm in the base coordinate frame. ex: [[[x1, y1], [x2, y2]], [[x3, y3], [x4, y4]]]
         bounds: a 2D array of two x, y coordinates of the corners of a rectangle that represent 
             the bounds of the drawing area. ex: [[x1, y1], [x2, y2]]
     
@@ -17,17 +37,21 @@ def fit_path(flat_toolpath, bounds: np.array) -> np.array:
         a numpy array of 2D arrays of the x, y coordinates of the pen tip in mm 
         in the base coordinate frame. ex: [[[x1, y1], [x2, y2]], [[x3, y3], [x4, y4]]]
         Each 2D array represents a path that is drawn without taking the pen off the paper.
+        A Toolpath is fitted in place and returned.
     """
 
     # find the min and max x and y values of the toolpath
-    consolidated_toolpath = np.concatenate(flat_toolpath)
+    if isinstance(flat_toolpath, Toolpath):
+        consolidated_toolpath = flat_toolpath.points
+    else:
+        consolidated_toolpath = np.concatenate(flat_toolpath)
     
     # if the toolpath is 2D
     if len(consolidated_toolpath.shape) == 2:
-        x_min_tp = min(consolidated_toolpath[:,0])
-        x_max_tp = max(consolidated_toolpath[:,0])
-        y_min_tp = min(consolidated_toolpath[:,1])
-        y_max_tp = max(consolidated_toolpath[:,1])
+        x_min_tp = consolidated_toolpath[:,0].min()
+        x_max_tp = consolidated_toolpath[:,0].max()
+        y_min_tp = consolidated_toolpath[:,1].min()
+        y_max_tp = consolidated_toolpath[:,1].max()
     else:
         x_min_tp = min(flat_toolpath[:,0])
         x_max_tp = max(flat_toolpath[:,0])
@@ -41,11 +65,7 @@ def fit_path(flat_toolpath, bounds: np.array) -> np.array:
     y_max = max(bounds[:,1])
 
     # calculate the scale factor for the toolpath
-    x_scale = (x_max - x_min) / (x_max_tp - x_min_tp)
-    y_scale = (y_max - y_min) / (y_max_tp - y_min_tp)
-
-    # use minimum scalar to keep the aspect ratio of the toolpath the same
-    scale = min(x_scale, y_scale)
+    scale = fit_scale(np.array([[x_min_tp, y_min_tp], [x_max_tp, y_max_tp]]), bounds)
 
 
     # find center of toolpath and drawing area
@@ -56,7 +76,9 @@ def fit_path(flat_toolpath, bounds: np.array) -> np.array:
     y_center = (y_max + y_min) / 2
     center = np.array([x_center, y_center])
 
-    for path in flat_toolpath:
+    # a toolpath's points are all in one array so they are moved at once
+    paths = [flat_toolpath.points] if isinstance(flat_toolpath, Toolpath) else flat_toolpath
+    for path in paths:
         path -= center_tp           # center the toolpath on the origin
         path *= [scale, scale]  # scale the toolpath
         path += center              # center the toolpath in the drawing area
@@ -73,18 +95,20 @@ if __name__ == "__main__":
 
     # using plotly show the original toolpath, the bounds, and the scaled toolpath
     import plotly.graph_objects as go
+    from decimate import decimate_path
 
     # Create figure
     fig = go.Figure()
 
     # Plot original toolpath
+    consolidated_toolpath = decimate_path(consolidated_toolpath)
     fig.add_trace(go.Scatter(x=consolidated_toolpath[:,0], y=consolidated_toolpath[:,1], mode='markers', name='Original Toolpath'))
 
     # Plot bounds
     fig.add_trace(go.Scatter(x=bounds[:,0], y=bounds[:,1], mode='markers', name='Bounds'))
 
     # Plot scaled toolpath
-    consolidated_scaled_toolpath = np.concatenate(new_path)
+    consolidated_scaled_toolpath = decimate_path(np.concatenate(new_path))
     fig.add_trace(go.Scatter(x=consolidated_scaled_toolpath[:,0], y=consolidated_scaled_toolpath[:,1], mode='markers', name='Scaled Toolpath'))
 
     # Set layout
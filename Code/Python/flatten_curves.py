@@ -0,0 +1,168 @@
+"""
+This file contains vectorized functions for turning the curves of an svg drawing into points,
+evaluating every curve in the document at once instead of one curve at a time.
+
+Quadratic curves and elliptical arcs are converted into cubic bezier curves first so that a
+single kernel flattens every curve type.
+"""
+import numpy as np
+from constants import POINTS_IN_CURVE
+
+# parameters at which each bezier curve is sampled, the start point is already in the path
+CURVE_PARAMETERS = np.arange(1, POINTS_IN_CURVE+1) / POINTS_IN_CURVE
+
+# largest angle of an elliptical arc approximated by a single cubic bezier curve
+ARC_SEGMENT_ANGLE = np.pi / 4
+
+
+def bernstein_basis(parameters: np.array) -> np.array:
+    """calculate the cubic bernstein basis polynomials at each curve parameter.
+
+    parameters:
+        parameters: a 1D array of curve parameters between 0 and 1.
+
+    returns:
+        a (len(parameters), 4) array where row i holds the weight of each control point at
+        parameters[i].
+    """
+    t = np.asarray(parameters, dtype=float)[:, np.newaxis]
+    s = 1 - t
+    return np.hstack((s**3, 3*s**2*t, 3*s*t**2, t**3))
+
+
+CURVE_BASIS = bernstein_basis(CURVE_PARAMETERS)
+
+
+def flatten_cubics(control_points: np.array, basis: np.array = CURVE_BASIS) -> np.array:
+    """evaluate a batch of cubic bezier curves at the same set of parameters.
+
+    parameters:
+        control_points: a (N, 4, 2) array of the start point, two control points and end
+            point of each curve.
+        basis: the bernstein basis of the parameters to sample. (see bernstein_basis)
+
+    returns:
+        a (N, len(basis), 2) array of the sampled points of each curve.
+    """
+    return np.einsum('pk,nkd->npd', basis, control_points)
+
+
+def cubic_segment_counts(control_points: np.array, tolerance: float) -> np.array:
+    """find how many straight segments each cubic bezier curve needs to stay within a tolerance.
+
+    Uses Wang's formula, which bounds the distance between a curve and the polyline through
+    n evenly spaced samples by 3/4 * M / n^2, where M is the largest second difference of
+    the control points.
+
+    parameters:
+        control_points: a (N, 4, 2) array of the control points of each curve.
+        tolerance: the maximum distance allowed between the curve and its polyline in the
+            same units as the control points, or a 1D array of one for each curve.
+
+    returns:
+        a 1D integer array of the number of segments for each curve, at least 1.
+    """
+    second_differences = control_points[:, :2] - 2*control_points[:, 1:3] + control_points[:, 2:]
+    m = np.linalg.norm(second_differences, axis=2).max(axis=1)
+    return np.maximum(np.ceil(np.sqrt(0.75 * m / tolerance)), 1).astype(int)
+
+
+def flatten_cubics_adaptive(control_points: np.array, counts: np.array) -> np.array:
+    """evaluate a batch of cubic bezier curves with a different number of samples per curve.
+
+    parameters:
+        control_points: a (N, 4, 2) array of the control points of each curve.
+        counts: a 1D integer array of the number of segments to split each curve into.
+
+    returns:
+        a (sum(counts), 2) array of the sampled points of every curve in order, not including
+        the start point of each curve.
+    """
+    curve = np.repeat(np.arange(len(counts)), counts)
+    first_sample = np.cumsum(counts) - counts
+    parameters = (np.arange(curve.size) - first_sample[curve] + 1) / counts[curve]
+    return np.einsum('pk,pkd->pd', bernstein_basis(parameters), control_points[curve])
+
+
+def quadratic_to_cubic(start: np.array, control: np.array, end: np.array) -> np.array:
+    """convert a quadratic bezier curve into the identical cubic bezier curve.
+
+    returns:
+        a (4, 2) array of the cubic control points.
+    """
+    return np.array([start, start + 2/3*(control - start), end + 2/3*(control - end), end])
+
+
+def arc_to_cubics(start: np.array, rx: float, ry: float, rotation: float, large_arc: float,
+                  sweep: float, end: np.array) -> np.array:
+    """convert an svg elliptical arc into cubic bezier curves.
+
+    Follows the endpoint to center parameterization in the svg specification (appendix F.6),
+    then approximates each piece of at most ARC_SEGMENT_ANGLE with one cubic.
+
+    parameters:
+        start: the x, y coordinates of the current point.
+        rx, ry, rotation, large_arc, sweep: the arc parameters as written in the path data,
+            rotation is in degrees.
+        end: the x, y coordinates of the end of the arc.
+
+    returns:
+        a (N, 4, 2) array of the control points of the cubic curves.
+    """
+    if np.array_equal(start, end):
+        return np.zeros((0, 4, 2))
+    rx, ry = abs(rx), abs(ry)
+    if rx == 0 or ry == 0:
+        return np.array([quadratic_to_cubic(start, (start + end)/2, end)])
+
+    cos_phi, sin_phi = np.cos(np.radians(rotation)), np.sin(np.radians(rotation))
+    rotation_matrix = np.array([[cos_phi, -sin_phi], [sin_phi, cos_phi]])
+    x1, y1 = rotation_matrix.T @ ((start - end) / 2)
+
+    # scale up radii that are too small to reach the end point
+    radii_check = x1**2/rx**2 + y1**2/ry**2
+    if radii_check > 1:
+        rx, ry = rx*np.sqrt(radii_check), ry*np.sqrt(radii_check)
+
+    numerator = rx**2*ry**2 - rx**2*y1**2 - ry**2*x1**2
+    coefficient = np.sqrt(max(numerator, 0) / (rx**2*y1**2 + ry**2*x1**2))
+    if large_arc == sweep:
+        coefficient = -coefficient
+    center_prime = coefficient * np.array([rx*y1/ry, -ry*x1/rx])
+    center = rotation_matrix @ center_prime + (start + end)/2
+
+    start_angle = np.arctan2((y1 - center_prime[1])/ry, (x1 - center_prime[0])/rx)
+    end_angle = np.arctan2((-y1 - center_prime[1])/ry, (-x1 - center_prime[0])/rx)
+    sweep_angle = end_angle - start_angle
+    if sweep and sweep_angle < 0:
+        sweep_angle += 2*np.pi
+    elif not sweep and sweep_angle > 0:
+        sweep_angle -= 2*np.pi
+
+    # control points of each piece on the unit circle, then stretched onto the ellipse
+    pieces = max(int(np.ceil(abs(sweep_angle) / ARC_SEGMENT_ANGLE)), 1)
+    angles = start_angle + sweep_angle*np.arange(pieces + 1)/pieces
+    handle = 4/3*np.tan(sweep_angle/pieces/4)
+    points = np.column_stack((np.cos(angles), np.sin(angles)))
+    tangents = np.column_stack((-np.sin(angles), np.cos(angles)))
+    unit_cubics = np.stack((points[:-1], points[:-1] + handle*tangents[:-1],
+                            points[1:] - handle*tangents[1:], points[1:]), axis=1)
+    cubics = (unit_cubics * [rx, ry]) @ rotation_matrix.T + center
+
+    # remove rounding error at the shared end points
+    cubics[0, 0] = start
+    cubics[-1, 3] = end
+    return cubics
+
+
+if __name__ == "__main__":
+    curves = np.array([[[0, 0], [0, 1], [1, 1], [1, 0]],
+                       [[1, 0], [1, -1], [2, -1], [2, 0]]], dtype=float)
+    points = flatten_cubics(curves)
+    print(points.shape)
+    print(points[:, [0, POINTS_IN_CURVE//2, -1]])
+
+    arc = arc_to_cubics(np.array([0., 0.]), 10, 10, 0, 0, 1, np.array([20., 0.]))
+    counts = cubic_segment_counts(arc, 0.01)
+    arc_points = flatten_cubics_adaptive(arc, counts)
+    print(counts, np.abs(np.linalg.norm(arc_points - [10, 0], axis=1) - 10).max())
@@ -4,7 +4,6 @@ This file describes the forward kinematic model of the robot and is adapted from
 You can find a description of the robot's geometry in the DH_and_frames.jpg file.
 """
 import numpy as np
-import pandas as pd
 from constants import *
 
 
@@ -69,6 +68,95 @@ def forward_kinematics(theta1: float, theta2: float, theta3: float, theta4: floa
     return t
 
 
+def transformation_matrices(alpha: float, a: float, d: float, theta: np.array) -> np.array:
+    """
+    Calculates the transformation matrices for a batch of joint angles with the same alpha, a & d.
+    (see transformation_matrix)
+
+    parameters:
+        theta: a 1D array of N angles between x_i-1 and x_i measured about z_i-1 in degrees
+
+    returns:
+        a (N, 4, 4) array of transformation matrices.
+    """
+    theta = np.radians(theta)
+    cos_theta, sin_theta = np.cos(theta), np.sin(theta)
+    cos_alpha, sin_alpha = np.cos(np.radians(alpha)), np.sin(np.radians(alpha))
+    t = np.zeros((len(theta), 4, 4))
+    t[:, 0, 0] = cos_theta
+    t[:, 0, 1] = -sin_theta
+    t[:, 0, 3] = a
+    t[:, 1, 0] = sin_theta * cos_alpha
+    t[:, 1, 1] = cos_theta * cos_alpha
+    t[:, 1, 2] = -sin_alpha
+    t[:, 1, 3] = -sin_alpha * d
+    t[:, 2, 0] = sin_theta * sin_alpha
+    t[:, 2, 1] = cos_theta * sin_alpha
+    t[:, 2, 2] = cos_alpha
+    t[:, 2, 3] = cos_alpha * d
+    t[:, 3, 3] = 1
+    return t
+
+
+# the links after joint 4 don't move, so their transformations only need working out once
+LINK_4_TRANSFORM = transformation_matrix(0, L4, 0, THETA_5)
+PEN_TRANSFORM = LINK_4_TRANSFORM @ transformation_matrix(0, L5, 0, 0)
+
+
+def batch_forward_kinematics(angular_toolpath: np.array, frames: bool = False):
+    """
+    Calculates the pen tip position for every set of joint angles of a toolpath at once.
+
+    parameters:
+        angular_toolpath: a (N, 4) array of the angles of joints 1 to 4 in degrees.
+        frames: also return the transformation matrix of every joint frame.
+
+    returns:
+        a (N, 3) array of the x, y, z coordinates of the pen tip in mm in the base coordinate
+        frame, and if frames is True a (N, 6, 4, 4) array of the matrices that map the base
+        frame to each joint, like the list returned by forward_kinematics.
+    """
+    angular_toolpath = np.asarray(angular_toolpath, dtype=float).reshape(-1, 4)
+    if not frames:
+        return pen_tip_positions(angular_toolpath)
+    theta1, theta2, theta3, theta4 = angular_toolpath.T
+    t = np.empty((len(angular_toolpath), 6, 4, 4))
+    t[:, 0] = transformation_matrices(0, 0, L0, theta1)
+    t[:, 1] = np.einsum('nij,njk->nik', t[:, 0], transformation_matrices(-90, 0, 0, theta2 - 90))
+    t[:, 2] = np.einsum('nij,njk->nik', t[:, 1], transformation_matrices(0, L2, 0, theta3))
+    t[:, 3] = np.einsum('nij,njk->nik', t[:, 2], transformation_matrices(0, L3, 0, theta4))
+    t[:, 4] = np.einsum('nij,jk->nik', t[:, 3], LINK_4_TRANSFORM)
+    t[:, 5] = np.einsum('nij,jk->nik', t[:, 3], PEN_TRANSFORM)
+    return t[:, 5, :3, 3].copy(), t
+
+
+def pen_tip_positions(angular_toolpath: np.array) -> np.array:
+    """
+    Calculates the pen tip position for a batch of joint angles at once.
+
+    Joints 2, 3 & 4 and the fixed pen joint all bend in the vertical plane turned by joint 1,
+    so the pen tip is found by adding up the links in that plane instead of multiplying the
+    transformation matrices of every point.
+
+    parameters:
+        angular_toolpath: a (N, 4) array of the angles of joints 1 to 4 in degrees.
+
+    returns:
+        a (N, 3) array of the x, y, z coordinates of the pen tip in mm in the base coordinate frame.
+    """
+    theta1, theta2, theta3, theta4 = np.radians(np.asarray(angular_toolpath, dtype=float)).T
+
+    # elevation of each link above the horizontal
+    elevation2 = np.pi/2 - theta2
+    elevation3 = elevation2 - theta3
+    elevation4 = elevation3 - theta4
+    elevation5 = elevation4 - np.radians(THETA_5)
+
+    reach = L2*np.cos(elevation2) + L3*np.cos(elevation3) + L4*np.cos(elevation4) + L5*np.cos(elevation5)
+    z = L0 + L2*np.sin(elevation2) + L3*np.sin(elevation3) + L4*np.sin(elevation4) + L5*np.sin(elevation5)
+    return np.stack((reach*np.cos(theta1), reach*np.sin(theta1), z), axis=1)
+
+
 def generate_link_coordinates(
     theta1: float, theta2: float, theta3: float, theta4: float
 ):
@@ -117,6 +205,23 @@ def generate_link_coordinates(
     return {"x": x_coords, "y": y_coords, "z": z_coords}
 
 
+def batch_link_coordinates(angular_toolpath: np.array) -> np.array:
+    """
+    Generates the cartesian coordinates of each joint in the robot arm for every set of joint
+    angles of a toolpath at once. (see generate_link_coordinates)
+
+    parameters:
+        angular_toolpath: a (N, 4) array of the angles of joints 1 to 4 in degrees.
+
+    returns:
+        a (N, 7, 3) array of the x, y, z coordinates of the base and each joint frame.
+    """
+    _, t = batch_forward_kinematics(angular_toolpath, frames=True)
+    coordinates = np.zeros((len(t), 7, 3))
+    coordinates[:, 1:] = t[:, :, :3, 3]
+    return coordinates
+
+
 if __name__ == "__main__":
     # Example usage
     # pylint: disable=E1136  # pylint/issues/3139
@@ -4,161 +4,165 @@ This file contains a function and tests for processing a scaled 2D drawing into
 """
 
 import numpy as np
-from constants import PEN_LIFT_MM, MAX_STEP_MM, HOME_POSITION_CARTESIAN, TABLE_HEIGHT_MM
-from inverse_kinematics import generate_link_angles, DRAWING_BOUNDS
-from tqdm import tqdm
+from constants import PEN_LIFT_MM, MAX_STEP_MM, MIN_STEP_MM, HOME_POSITION_CARTESIAN, TABLE_HEIGHT_MM
+from inverse_kinematics import generate_angular_toolpath, DRAWING_BOUNDS
 from fit_path import fit_path
+from toolpath import Toolpath, PEN_DOWN, TRAVEL
 
 
-def interpolate_toolpath(toolpath: np.array)-> np.array:
+def resample_toolpath(toolpath: Toolpath, max_step: float = MAX_STEP_MM, split_travel: bool = True,
+                      min_step: float = MIN_STEP_MM) -> Toolpath:
     """
-    interpolate between points in a toolpath to create a smoother toolpath that has
-    a maximum step distance of MAX_STEP_MM between points. Also clip points that are too close
-    together.
-    
+    resample a toolpath so there is at most max_step between points, in time linear in the
+    number of points. This replaces interpolate_toolpath (now in benchmark.py), which copies the
+    whole toolpath for every point it adds or removes.
+
+    Points are clipped by arc length: only the first point in each max_step of distance along
+    the toolpath is kept, along with the first and last point of every run of PEN_DOWN or
+    TRAVEL points so strokes and pen lifts start and end where they should. Kept points closer
+    than min_step to the point before them are merged into it, as each point of the toolpath
+    takes a whole control period however short its move. Every segment between kept points is
+    then split evenly into pieces no longer than max_step, which are longer than max_step/2.
+
     parameters:
-        toolpath: a 2D numpy array of the x, y, z coordinates of the pen tip in mm 
+        toolpath: a Toolpath, or a 2D array, of the x, y, z coordinates of the pen tip in mm
             in the base coordinate frame. ex: [[x1, y1, z1], [x2, y2, z2], [x3, y3, z3]]
-    
+        max_step: the longest distance in mm between two points of the resampled toolpath.
+        split_travel: if False, only segments between two PEN_DOWN points are split, so pen
+            lifts stay single segments and the moves between lifted points, which are made in
+            joint space, are not sampled. (see trajectory.generate_angular_trajectory)
+        min_step: the shortest distance in mm between two points of the resampled toolpath,
+            at most max_step/2. Only the first and last points of a run, like the ends of a
+            stroke shorter than min_step, can be closer.
+
     returns:
-        a 2D numpy array of the smoothed x, y, z coordinates of the pen tip in mm 
-        in the base coordinate frame. ex: [[x1, y1, z1], [x2, y2, z2], [x3, y3, z3]]
+        a Toolpath of the resampled points. Points added between two PEN_DOWN points are
+        PEN_DOWN, any other added point is TRAVEL.
     """
-    max_step_squared = MAX_STEP_MM**2
-    i = 1
-    while i < toolpath.shape[0]:
-        # calculate the distance between the current point and the previous point
-        distance_squared = np.sum((toolpath[i] - toolpath[i-1])**2)
-
-        # if the distance between the current point and the previous point is less than the max step clip the point
-        if distance_squared < max_step_squared:
-            toolpath = np.delete(toolpath, i, 0)
-            i -= 1
-
-        # if the distance between the current point and the previous point is greater than the max step interpolate between them
-        elif distance_squared > max_step_squared:
-            num_points = int(np.ceil(np.sqrt(distance_squared) / MAX_STEP_MM))
-            interpolated_points = np.linspace(toolpath[i-1], toolpath[i], num_points+1)
-            toolpath = np.insert(toolpath, i, interpolated_points, axis=0)
-            i += num_points
-        
-        i += 1
-    
-    return toolpath
-
-
-
-    # # initialize interpolated toolpath to be same size as toolpath
-    # interpolated_toolpath_length = 100000
-    # interpolated_toolpath = np.zeros((interpolated_toolpath_length,3))
-    # interpolated_toolpaths = [interpolated_toolpath] # list of interpolated toolpaths
-    # interpolated_toolpath_loc = 0 # index of the next point in the interpolated toolpath
-    # last_point = toolpath[0]
-    # max_step_squared = MAX_STEP_MM**2
-
-    # for i in tqdm(range(1, toolpath.shape[0])):
-    #     # calculate the distance between the current point and the previous point
-    #     distance_squared = np.sum((toolpath[i] - last_point)**2)
-
-
-    #     # if the distance between the current point and the previous point is greater than the max step interpolate between them
-    #     if distance_squared > max_step_squared:
-    #         # calculate the number of points to interpolate between the current point and the previous point
-    #         num_points = int(np.ceil(np.sqrt(distance_squared) / MAX_STEP_MM))
-
-    #         # calculate the step size for each dimension
-    #         step_size = (toolpath[i] - last_point) / num_points
-
-    #         # interpolate between the current point and the previous point
-    #         for j in tqdm(range(num_points)):
-    #             last_point += step_size
-    #             # if index is out of bounds add a new interpolated toolpath
-    #             if interpolated_toolpath_loc >= interpolated_toolpath_length:
-    #                 interpolated_toolpath = np.zeros((interpolated_toolpath_length,3))
-    #                 interpolated_toolpaths.append(interpolated_toolpath)
-    #                 interpolated_toolpath_loc = 0
-
-    #             interpolated_toolpath[interpolated_toolpath_loc] = last_point
-    #             interpolated_toolpath_loc += 1
-
-    #     # if the distance between the current point and the previous point is less than the max step clip the point
-    #     elif distance_squared < max_step_squared:
-    #         for j in range(i, toolpath.shape[0]):
-    #             # calculate the distance between the current point and the previous point
-    #             distance_squared = np.sum((toolpath[j] - last_point)**2)
-    #             if distance_squared > MAX_STEP_MM:
-    #                 i = j
-    #                 break
-    
-    # remove information after the last point (interpolated_toolpath_loc is the index of the last point + 1)
-    interpolated_toolpath = interpolated_toolpath[:interpolated_toolpath_loc]
-
-    return np.concatenate(interpolated_toolpaths)
+    if not isinstance(toolpath, Toolpath):
+        toolpath = Toolpath(toolpath)
+    points, flags = toolpath.points, toolpath.flags
+    if len(points) < 2:
+        return Toolpath(points.copy(), flags=flags.copy())
+
+    # clip points that are within max_step of the previous kept point along the toolpath
+    segment_lengths = np.linalg.norm(np.diff(points, axis=0), axis=1)
+    arc_length = np.concatenate(([0], np.cumsum(segment_lengths)))
+    step_index = np.floor(arc_length / max_step)
+    keep = np.diff(step_index, prepend=-1) > 0
+    flag_changes = np.flatnonzero(np.diff(flags) != 0)
+    run_ends = np.zeros(len(points), dtype=bool)
+    run_ends[flag_changes] = run_ends[flag_changes + 1] = True
+    run_ends[[0, -1]] = True
+    keep |= run_ends
+    kept_points, kept_flags, kept_run_ends = points[keep], flags[keep], run_ends[keep]
+
+    # drop kept points that repeat the point before them
+    repeated = np.concatenate(([False], np.all(kept_points[1:] == kept_points[:-1], axis=1)))
+    kept_points, kept_flags, kept_run_ends = kept_points[~repeated], kept_flags[~repeated], kept_run_ends[~repeated]
+
+    # merge points closer than min_step to the point before them, dropping the later point of
+    # each pair unless it ends a run. Only every other point of a chain of close points is
+    # dropped at a time, so the gaps are measured again between the points left
+    while True:
+        close = np.flatnonzero(np.linalg.norm(np.diff(kept_points, axis=0), axis=1) < min_step)
+        drop = np.where(kept_run_ends[close + 1], close, close + 1)
+        drop = np.unique(drop[~kept_run_ends[drop]])
+        drop = drop[np.diff(drop, prepend=-2) > 1]
+        if len(drop) == 0:
+            break
+        kept = np.ones(len(kept_points), dtype=bool)
+        kept[drop] = False
+        kept_points, kept_flags, kept_run_ends = kept_points[kept], kept_flags[kept], kept_run_ends[kept]
+
+    # split each segment between kept points into pieces no longer than max_step
+    kept_lengths = np.linalg.norm(np.diff(kept_points, axis=0), axis=1)
+    pieces = np.maximum(np.ceil(kept_lengths / max_step - 1e-9), 1).astype(int)
+    if not split_travel:
+        pieces[(kept_flags[:-1] != PEN_DOWN) | (kept_flags[1:] != PEN_DOWN)] = 1
+    segment = np.repeat(np.arange(len(pieces)), pieces)
+    t = (np.arange(segment.size) - np.repeat(np.cumsum(pieces) - pieces, pieces)) / pieces[segment]
+    resampled_points = np.vstack((kept_points[segment] + t[:, np.newaxis]*(kept_points[segment + 1] - kept_points[segment]),
+                                  kept_points[-1:]))
+
+    # added points are drawn only if both ends of their segment are on the paper
+    pen_down_segments = (kept_flags[:-1] == PEN_DOWN) & (kept_flags[1:] == PEN_DOWN)
+    resampled_flags = np.append(np.where(pen_down_segments[segment], PEN_DOWN, TRAVEL), kept_flags[-1]).astype(np.uint8)
+    resampled_flags[np.cumsum(pieces) - pieces] = kept_flags[:-1]
+    return Toolpath(resampled_points, flags=resampled_flags)
+
+
+def add_pen_lifts(toolpath: Toolpath) -> Toolpath:
+    """join the strokes of a scaled 2D toolpath into one 3D path with the pen lifted between them.
 
+    parameters:
+        toolpath: a Toolpath, or a list of 2D arrays of the x, y coordinates of the pen tip in mm
+            in the base coordinate frame. ex: [[[x1, y1], [x2, y2]], [[x3, y3], [x4, y4]]]
 
-def generate_cartesian_toolpath(toolpath: np.array)-> np.array:
+    returns:
+        a Toolpath of one continuous path of the x, y, z coordinates of the pen tip in mm
+        in the base coordinate frame that starts and ends at the home position, where the
+        points of the strokes are PEN_DOWN and the points between them are TRAVEL.
+    """
+    toolpath = Toolpath.from_strokes(toolpath)
+    points, offsets = toolpath.points, toolpath.offsets
+    strokes = np.arange(len(toolpath))
+
+    # the 3d toolpath starts at the home position, then each stroke has a point where the pen
+    # is lifted off the paper before and after it, then it ends at the home position
+    toolpath_3d = np.empty((len(points) + 2*len(toolpath) + 2, 3))
+    flags = np.full(len(toolpath_3d), TRAVEL, dtype=np.uint8)
+    toolpath_3d[0] = toolpath_3d[-1] = HOME_POSITION_CARTESIAN
+
+    # add z coordinates to each path
+    stroke_rows = np.arange(len(points)) + 2*toolpath.stroke_index() + 2
+    toolpath_3d[stroke_rows, :2] = points
+    toolpath_3d[stroke_rows, 2] = TABLE_HEIGHT_MM
+    flags[stroke_rows] = PEN_DOWN
+
+    # add points before & after the path where the pen is lifted off the paper
+    before_rows = offsets[:-1] + 2*strokes + 1
+    after_rows = offsets[1:] + 2*strokes + 2
+    toolpath_3d[before_rows, :2] = toolpath.firsts()
+    toolpath_3d[after_rows, :2] = toolpath.lasts()
+    toolpath_3d[before_rows, 2] = toolpath_3d[after_rows, 2] = TABLE_HEIGHT_MM + PEN_LIFT_MM
+    return Toolpath(toolpath_3d, flags=flags)
+
+
+def generate_cartesian_toolpath(toolpath: Toolpath, split_travel: bool = True)-> Toolpath:
     """generate a 3D cartesian toolpath from a scaled 2D toolpath.
     
     parameters:
-        toolpath: a list of 2D arrays of the x, y coordinates of the pen tip in mm 
+        toolpath: a Toolpath, or a list of 2D arrays of the x, y coordinates of the pen tip in mm
             in the base coordinate frame. ex: [[[x1, y1], [x2, y2]], [[x3, y3], [x4, y4]]]
+        split_travel: if False, the moves between two lifted points are left as single
+            segments, for a trajectory that makes them in joint space.
+            (see trajectory.generate_angular_trajectory)
     
     returns:
-        a 3D numpy array of the x, y, z coordinates of the pen tip in mm 
-        in the base coordinate frame. ex: [[x1, y1, z1], [x2, y2, z2]], [x3, y3, z3], [x4, y4, z4]]
+        a Toolpath of one continuous path of the x, y, z coordinates of the pen tip in mm
+        in the base coordinate frame with at most MAX_STEP_MM between points, where the points
+        of the strokes are PEN_DOWN and the moves between them are TRAVEL.
     """
-
-    # initialize empty array for 3d toolpath
-    toolpath_3d = np.array(HOME_POSITION_CARTESIAN, dtype=float) # start at home position
-
-    # add in z coordinates and the movement between drawing positions
-    for path in tqdm(toolpath):
-        # add z coordinates to each path
-        zeros_column = np.zeros((path.shape[0], 1)) + TABLE_HEIGHT_MM
-        path_3d = np.hstack((path, zeros_column))
-
-
-        # add points before & after the path where the pen is lifted off the paper
-        point_before = path_3d[0,:] + [0, 0, PEN_LIFT_MM]
-        point_after = path_3d[-1,:] + [0, 0, PEN_LIFT_MM]
-        path_3d = np.vstack((point_before, path_3d, point_after))
-        
-        # append the 3d path to the 3d toolpath
-        toolpath_3d = np.vstack((toolpath_3d, path_3d))
-
-    
-    # end at home position
-    toolpath_3d = np.vstack((toolpath_3d, HOME_POSITION_CARTESIAN))
+    toolpath_3d = add_pen_lifts(toolpath)
 
     # interpolate between points/cut out points that are too close together
-    interpolated_toolpath = interpolate_toolpath(toolpath_3d)
-    return interpolated_toolpath
-
-def generate_angular_toolpath(cartesian_toolpath: np.array):
-    """
-    Outputs an array of link angles of the robot given a target pen tip position.
-    
-    parameters:
-        cartesian_toolpath: a 2D array of the x, y, z coordinates of the pen tip in mm 
-            in the base coordinate frame.
-    """
-    angular_toolpath = np.zeros((len(cartesian_toolpath), 4))
-    for i, position in enumerate(cartesian_toolpath):
-        angular_toolpath[i] = generate_link_angles(position)
-    return angular_toolpath
-
+    return resample_toolpath(toolpath_3d, split_travel=split_travel)
 
 if __name__ == "__main__":
     toolpath = np.array([[[0, 0], [100, 100], [100, 200], [200, 200]]], dtype=float)
     scaled_toolpath = fit_path(toolpath, DRAWING_BOUNDS)
-    interpolated_toolpath = generate_cartesian_toolpath(toolpath)
+    interpolated_toolpath = generate_cartesian_toolpath(toolpath).points
+    consolidated_toolpath = np.concatenate(toolpath)
 
     # plot the original and interploated toolpath in 3D using plotly
     import plotly.graph_objects as go
+    from decimate import decimate_path
+    interpolated_toolpath = decimate_path(interpolated_toolpath)
 
     fig = go.Figure()
     fig.add_trace(go.Scatter3d(x=interpolated_toolpath[:,0], y=interpolated_toolpath[:,1], z=interpolated_toolpath[:,2], mode='markers', name = 'Interpolated Toolpath', marker=dict(color="blue", size=2)))
-    fig.add_trace(go.Scatter3d(x=toolpath[:,0], y=toolpath[:,1], z=np.zeros(toolpath.shape[0]), mode='markers', name = 'Original Toolpath'))
+    fig.add_trace(go.Scatter3d(x=consolidated_toolpath[:,0], y=consolidated_toolpath[:,1], z=np.zeros(consolidated_toolpath.shape[0]), mode='markers', name = 'Original Toolpath'))
     fig.show()
 
     # test generate angular toolpath function
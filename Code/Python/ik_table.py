@@ -0,0 +1,202 @@
+"""
+This file contains a lookup table of the inverse kinematics of the drawing plane.
+
+Nearly every point the arm goes to is on the paper or lifted PEN_LIFT_MM above it, inside
+DRAWING_BOUNDS. The table solves the joint angles once on a fine (x, y) grid at those two
+heights and saves them in the pipeline cache under a hash of the robot's constants, so later
+points are found by bilinear interpolation between the four surrounding grid points. Points
+anywhere else are solved analytically.
+"""
+import numpy as np
+from constants import *
+from inverse_kinematics import generate_link_angles, generate_angular_toolpath
+from forward_kinematics import pen_tip_positions
+
+IK_TABLE_SPACING_MM = 0.5       # distance between grid points, 0.5 mm keeps the error around 0.004 degrees
+
+
+class IKTable:
+    """Class for solving inverse kinematics by interpolating a grid of precomputed joint angles"""
+    def __init__(self, bounds: np.array = DRAWING_BOUNDS, heights: tuple = (TABLE_HEIGHT_MM, TABLE_HEIGHT_MM + PEN_LIFT_MM),
+                 spacing: float = IK_TABLE_SPACING_MM, cache=None, verbose: bool = False) -> None:
+        """
+        Initialize the table, loading it from the cache or building and saving it
+        parameters:
+            bounds: two opposite corners of the area the grid covers, in mm in the base
+                coordinate frame. The grid reaches one spacing past them.
+            heights: the z coordinates in mm of the planes the grid is solved on.
+            spacing: the distance in mm between grid points.
+            cache: the PipelineCache the table is saved in, None to use the default one or False
+                to build it without saving it.
+            verbose: print whether the table was built and how accurate it is.
+        """
+        if cache is None:
+            from pipeline_cache import PipelineCache
+            cache = PipelineCache()
+        self.heights = np.asarray(heights, dtype=float)
+        self.spacing = spacing
+        self.origin = np.min(bounds, axis=0) - spacing
+        self.shape = np.ceil((np.max(bounds, axis=0) + spacing - self.origin)/spacing).astype(int) + 1
+
+        if cache is not False:
+            key = cache.key('ik_table', self.heights, spacing, self.origin, self.shape, L0, L2, L3, L4, L5, THETA_5,
+                            THETA_1_MIN, THETA_1_MAX, THETA_2_MIN, THETA_2_MAX, THETA_3_MIN, THETA_3_MAX, THETA_4_MIN, THETA_4_MAX)
+            arrays, from_cache = cache.cached(key, self.build, lambda arrays: arrays, lambda arrays: arrays)
+        else:
+            arrays, from_cache = self.build(), False
+        self.angles = arrays['angles']
+        self.rows = np.ascontiguousarray(self.angles.reshape(-1, 4).T, dtype=np.float32)
+        self.max_angle_error, self.max_position_error = float(arrays['max_angle_error']), float(arrays['max_position_error'])
+        if verbose:
+            print(f"{'Loaded' if from_cache else 'Built'} IK table of {self.angles.shape[1]}x{self.angles.shape[2]} points "
+                  f"at {len(self.heights)} heights, max error {self.max_angle_error:.4f} degrees "
+                  f"({self.max_position_error:.4f} mm).")
+
+    def grid_points(self, offset: float = 0) -> np.array:
+        """the (heights, x, y, 3) coordinates of the grid points, or of the middle of each cell
+        with an offset of half a spacing."""
+        x = self.origin[0] + offset + np.arange(self.shape[0] - (offset > 0))*self.spacing
+        y = self.origin[1] + offset + np.arange(self.shape[1] - (offset > 0))*self.spacing
+        z, x, y = np.meshgrid(self.heights, x, y, indexing='ij')
+        return np.stack((x, y, z), axis=-1)
+
+    def build(self) -> dict:
+        """solve the joint angles at every grid point and measure the largest interpolation error.
+
+        returns:
+            a dict of the (heights, x, y, 4) array of angles, NaN at grid points out of reach, and
+            the largest error in degrees and in mm of the pen tip, measured in the middle of every
+            cell the table is used in, where it is largest.
+        """
+        grid = self.grid_points()
+        # grid points out of reach are left as NaN, so the cells around them fall back to the analytic solution
+        self.angles = generate_angular_toolpath(grid.reshape(-1, 3), strict=False).reshape(grid.shape[:-1] + (4,)).astype(np.float32)
+        self.rows = np.ascontiguousarray(self.angles.reshape(-1, 4).T, dtype=np.float32)
+        middles = self.grid_points(self.spacing/2).reshape(-1, 3)
+        interpolated, on_grid = self.interpolate(middles)
+        exact = generate_angular_toolpath(middles[on_grid])
+        return {'angles': self.angles,
+                'max_angle_error': np.abs(interpolated - exact).max(initial=0),
+                'max_position_error': np.linalg.norm(pen_tip_positions(interpolated) - pen_tip_positions(exact), axis=1).max(initial=0)}
+
+    def interpolate(self, positions: np.array) -> tuple:
+        """bilinearly interpolate the joint angles of the points that are on the grid.
+
+        parameters:
+            positions: a (N, 3) array of pen tip positions.
+
+        returns:
+            a (M, 4) array of the angles of the M points on the grid and a boolean array that is
+            True for each of the N points on the grid.
+        """
+        x, y, z = positions.T
+        level = np.full(len(positions), -1)
+        for index, height in enumerate(self.heights):
+            level[np.abs(z - height) < 1e-9] = index
+        grid_x = (x - self.origin[0])/self.spacing
+        grid_y = (y - self.origin[1])/self.spacing
+        on_grid = (level >= 0) & (grid_x >= 0) & (grid_x <= self.shape[0] - 1) & (grid_y >= 0) & (grid_y <= self.shape[1] - 1)
+        if not on_grid.all():
+            level, grid_x, grid_y = level[on_grid], grid_x[on_grid], grid_y[on_grid]
+
+        # the corner of the cell each point is in, points on the far edge of the grid use the last cell
+        i = np.minimum(grid_x.astype(int), self.shape[0] - 2)
+        j = np.minimum(grid_y.astype(int), self.shape[1] - 2)
+        fx, fy = (grid_x - i).astype(np.float32), (grid_y - j).astype(np.float32)
+
+        # interpolate between the four grid points around each point, with the angles of each
+        # joint in one row of the flattened table so every step works in place on contiguous rows
+        index = (level*self.shape[0] + i)*self.shape[1] + j
+        low_y = np.take(self.rows, index, axis=1)
+        step = np.take(self.rows, index + self.shape[1], axis=1)
+        step -= low_y
+        step *= fx
+        low_y += step
+        high_y = np.take(self.rows, index + 1, axis=1)
+        step = np.take(self.rows, index + self.shape[1] + 1, axis=1, out=step)
+        step -= high_y
+        step *= fx
+        high_y += step
+        high_y -= low_y
+        high_y *= fy
+        low_y += high_y
+        angles = low_y.T
+
+        # cells next to a grid point the arm can't reach are left to the analytic solution
+        solved = ~np.isnan(angles).any(axis=1)
+        if not solved.all():
+            on_grid[np.flatnonzero(on_grid)[~solved]] = False
+            angles = angles[solved]
+        return angles, on_grid
+
+    def generate_link_angles(self, pen_position: np.array) -> list:
+        """
+        Outputs the link angles of the robot for one pen tip position, for streaming points one
+        at a time where the batch overhead of the analytic solution dominates.
+        (see inverse_kinematics.generate_link_angles)
+
+        parameters:
+            pen_position: the x, y, z coordinates of the pen tip in mm in the base coordinate frame.
+        """
+        x, y, z = pen_position
+        grid_x = (x - self.origin[0])/self.spacing
+        grid_y = (y - self.origin[1])/self.spacing
+        levels = [index for index, height in enumerate(self.heights.tolist()) if abs(z - height) < 1e-9]
+        if not levels or not (0 <= grid_x <= self.shape[0] - 1 and 0 <= grid_y <= self.shape[1] - 1):
+            return generate_link_angles(pen_position)
+        i = min(int(grid_x), self.shape[0] - 2)
+        j = min(int(grid_y), self.shape[1] - 2)
+        fx, fy = grid_x - i, grid_y - j
+        weights = ((1 - fx)*(1 - fy), (1 - fx)*fy, fx*(1 - fy), fx*fy)
+        angles = np.dot(weights, self.angles[levels[0], i:i + 2, j:j + 2].reshape(4, 4)).tolist()
+        if any(angle != angle for angle in angles):
+            return generate_link_angles(pen_position)
+        return angles
+
+    def generate_angular_toolpath(self, cartesian_toolpath: np.array, out: np.array = None) -> np.array:
+        """
+        Outputs an array of link angles of the robot for every pen tip position of a toolpath,
+        interpolated from the table for points on the grid. (see inverse_kinematics.generate_angular_toolpath)
+
+        parameters:
+            cartesian_toolpath: a (N, 3) array of the x, y, z coordinates of the pen tip in mm
+                in the base coordinate frame, or a Toolpath of them.
+            out: an optional (N, 4) array the angles are written into instead of a new array.
+
+        returns:
+            a (N, 4) array of the angles of joints 1 to 4 in degrees.
+        """
+        positions = np.asarray(cartesian_toolpath, dtype=float).reshape(-1, 3)
+        if out is None:
+            out = np.empty((len(positions), 4))
+        angles, on_grid = self.interpolate(positions)
+        if on_grid.all():
+            out[:] = angles
+        else:
+            out[on_grid] = angles
+            out[~on_grid] = generate_angular_toolpath(positions[~on_grid])
+        return out
+
+
+if __name__ == "__main__":
+    import time
+    table = IKTable(verbose=True)
+
+    rng = np.random.default_rng(0)
+    positions = np.column_stack((rng.uniform(*DRAWING_BOUNDS[::-1, 0], 1000000), rng.uniform(*DRAWING_BOUNDS[::-1, 1], 1000000),
+                                 np.full(1000000, TABLE_HEIGHT_MM)))
+    start_time = time.perf_counter()
+    exact = generate_angular_toolpath(positions)
+    print(f"analytic: {time.perf_counter() - start_time:.3f} s")
+    start_time = time.perf_counter()
+    interpolated = table.generate_angular_toolpath(positions)
+    print(f"table:    {time.perf_counter() - start_time:.3f} s, max error {np.abs(interpolated - exact).max():.4f} degrees")
+
+    start_time = time.perf_counter()
+    for position in positions[:10000]:
+        generate_link_angles(position)
+    print(f"analytic, one point at a time: {(time.perf_counter() - start_time)/10000*1e6:.1f} us per point")
+    start_time = time.perf_counter()
+    for position in positions[:10000]:
+        table.generate_link_angles(position)
+    print(f"table, one point at a time:    {(time.perf_counter() - start_time)/10000*1e6:.1f} us per point")
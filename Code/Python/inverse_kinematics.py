@@ -1,7 +1,10 @@
 import numpy as np
 from constants import *
-from animate_arm import animate_arm
-from tqdm import tqdm
+
+# the pen is held at a fixed angle, so these only need working out once
+SIN_THETA_5 = np.sin(np.radians(THETA_5))
+COS_THETA_5 = np.cos(np.radians(THETA_5))
+
 
 def generate_link_angles(pen_position: np.array):
     """
@@ -11,86 +14,73 @@ def generate_link_angles(pen_position: np.array):
         pen_position: a 1D array of the x, y, z coordinates of the pen tip in mm 
             in the base coordinate frame.
     """
-    x, y, z = pen_position
-    
-    # Calculate theta1
-    theta1 = np.degrees(np.arctan2(y, x))
+    return list(generate_angular_toolpath(np.reshape(pen_position, (1, 3)))[0])
 
-    # If theta1 goes out of bounds clip it at the limit
-    if theta1 > THETA_1_MAX:
-        theta1 = THETA_1_MAX
-    elif theta1 < THETA_1_MIN:
-        theta1 = THETA_1_MIN
 
-    # determine location of x5, y5, z5
-    # These calculations assume the pen is normal to a flat surface on the same plane as the base of the robot
-    x5 = x
-    y5 = y
-    z5 = z + L5
+def generate_angular_toolpath(cartesian_toolpath: np.array, out: np.array = None, clip: bool = True, strict: bool = True):
+    """
+    Outputs an array of link angles of the robot for every pen tip position of a toolpath at once.
 
-    # determine location of x4, y4, z4
-    x4 = x5 + np.cos(np.radians(theta1))*np.sin(np.radians(-THETA_5))*L4
-    y4 = y5 + np.sin(np.radians(theta1))*np.sin(np.radians(-THETA_5))*L4
-    z4 = z5 + np.cos(np.radians(-THETA_5))*L4
+    parameters:
+        cartesian_toolpath: a (N, 3) array of the x, y, z coordinates of the pen tip in mm
+            in the base coordinate frame, or a Toolpath of them.
+        out: an optional (N, 4) array the angles are written into instead of a new array.
+        clip: if False, angles past the joint limits are left as they are. (see validate_toolpath)
+        strict: if False, points out of reach get NaN angles instead of raising a ValueError.
+
+    returns:
+        a (N, 4) array of the angles of joints 1 to 4 in degrees, each clipped to its limits.
+    """
+    def limit(angles, low, high, out):
+        return np.clip(angles, low, high, out=out) if clip else np.copyto(out, angles)
+
+    x, y, z = np.asarray(cartesian_toolpath, dtype=float).reshape(-1, 3).T
+    if out is None:
+        out = np.empty((len(x), 4))
+    theta1, theta2, theta3, theta4 = out.T
 
+    # Calculate theta1, clipped at its limits
+    limit(np.degrees(np.arctan2(y, x)), THETA_1_MIN, THETA_1_MAX, out=theta1)
+
+    # determine location of x4, y4, z4
+    # These calculations assume the pen is normal to a flat surface on the same plane as the base of the robot
+    base_angle = np.radians(theta1)
+    x4 = x - np.cos(base_angle)*SIN_THETA_5*L4
+    y4 = y - np.sin(base_angle)*SIN_THETA_5*L4
+    z4 = z + L5 + COS_THETA_5*L4
 
     # Calculate theta 3
     # This calculation is derived geometrically from the 3R 3D robot arm inverse kinematic example in the textbook
-    r2 = np.sqrt(x4**2 + y4**2 + (z4 - L0)**2)
+    horizontal = np.hypot(x4, y4)
+    r2 = np.hypot(horizontal, z4 - L0)
 
-    # check to see if our point is too far away for the robot to reach TODO: make this acurate
-    if r2 >= L2 + L3:
-        raise ValueError("Target point is too far away for the robot to reach.")
+    # check to see if our points are too far away for the robot to reach TODO: make this acurate
+    too_far = np.flatnonzero(r2 >= L2 + L3)
+    if len(too_far) and strict:
+        raise ValueError(f"Target point {too_far[0]} is too far away for the robot to reach "
+                         f"({len(too_far)} points out of reach).")
 
     c3 = (r2**2 - L2**2 - L3**2) / (2 * L2 * L3)
-    s3 = np.sqrt(1 - c3**2)
-    theta3 = np.degrees(np.arctan2(s3, c3)) #this assumes that the triangle formed by link 2 and 3 has an obtuse side pointed up
-
-    # make sure theta3 is within the limits of the robot
-    if theta3 < THETA_3_MIN:
-        theta3 = THETA_3_MIN
-    elif theta3 > THETA_3_MAX:
-        theta3 = THETA_3_MAX
+    with np.errstate(invalid='ignore'):
+        s3 = np.sqrt(1 - c3**2)
+    limit(np.degrees(np.arctan2(s3, c3)), THETA_3_MIN, THETA_3_MAX, out=theta3) #this assumes that the triangle formed by link 2 and 3 has an obtuse side pointed up
 
     # Calculate theta 2
-    alpha = np.degrees(np.arctan2(z4 - L0, np.sqrt(x4**2 + y4**2)))
+    alpha = np.degrees(np.arctan2(z4 - L0, horizontal))
     cbeta = (L2**2 + r2**2 - L3**2) / (2 * L2 * r2)
-    sbeta = np.sqrt(1 - cbeta**2)
+    with np.errstate(invalid='ignore'):
+        sbeta = np.sqrt(1 - cbeta**2)
     beta = np.degrees(np.arctan2(sbeta, cbeta)) #this assumes that the triangle formed by link 2 and 3 has an obtuse side pointed up
-    theta2 = 90 - alpha - beta
-
-    # make sure theta2 is within the limits of the robot
-    if theta2 < THETA_2_MIN:
-        theta2 = THETA_2_MIN
-    elif theta2 > THETA_2_MAX:
-        theta2 = THETA_2_MAX
+    limit(90 - alpha - beta, THETA_2_MIN, THETA_2_MAX, out=theta2)
 
     # Calculate theta 4
-    theta4 = 180 - (theta2 + theta3 + THETA_5)
-
-    # make sure theta4 is within the limits of the robot
-    if theta4 < THETA_4_MIN:
-        theta4 = THETA_4_MIN
-    elif theta4 > THETA_4_MAX:
-        theta4 = THETA_4_MAX
-
-    return [theta1, theta2, theta3, theta4]
-
-def generate_angular_toolpath(cartesian_toolpath: np.array):
-    """
-    Outputs an array of link angles of the robot given a target pen tip position.
-    
-    parameters:
-        cartesian_toolpath: a 2D array of the x, y, z coordinates of the pen tip in mm 
-            in the base coordinate frame.
-    """
-    angular_toolpath = np.zeros((len(cartesian_toolpath), 4))
-    for i, position in enumerate(cartesian_toolpath):
+    limit(180 - (theta2 + theta3 + THETA_5), THETA_4_MIN, THETA_4_MAX, out=theta4)
+    out[too_far] = np.nan
+    return out
 
-        angular_toolpath[i] = generate_link_angles(position)
-    return angular_toolpath
 
 if __name__ == "__main__":
+    from animate_arm import animate_arm
     home_cartesian = [115, 0, 54]
     home_degrees = generate_link_angles(home_cartesian)
     print(home_degrees)
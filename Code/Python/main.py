@@ -1,48 +1,70 @@
-from SVG_to_coords import *
-from coords_to_toolpath import *
-from generate_toolpath import *
-from fit_path import *
-from animate_arm import *
-import plotly.graph_objects as go
-from constants import *
-from motor_controller import MotorController, bits_to_degrees, degrees_to_bits, getch
+"""
+Command line entry point for drawing an svg with the robowriter.
+
+usage:
+    python main.py --svg hello_world --port COM5 [--show-toolpaths] [--animate] [--review]
+    python main.py          (asks for the svg and each option like before)
+
+Plotting and animation modules are only imported when they are asked for, so a headless run
+only loads what it needs to generate the toolpath and drive the motors.
+"""
+import argparse
+import os
 import time
-from forward_kinematics import *
-
-# Get svg to use.
-current_working_directory = os.getcwd()
-file_name = input("Input svg name you wish to use. It must be in the svg directory\n")
-svg_path = "\\Code\\Python\\svgs\\"
-cwd_split = current_working_directory.split('\\')
-if cwd_split[len(cwd_split)-1] == "robowriter":
-    file_path = current_working_directory + svg_path + file_name + '.svg'
-else:
-    file_path = current_working_directory + '\\robowriter' + svg_path + file_name + '.svg'
-
-# Convert svg to 2d toolpath.
-print("Converting svg to 2d toolpath...")
-coords = parse_svg(file_path)
-toolpath = read_path(coords)
-# for i in range(0, len(toolpath)):
-#     for j in range(0, len(toolpath[i])):
-#         toolpath[i][j][0] = float(toolpath[i][j][0])
-#         toolpath[i][j][1] = float(toolpath[i][j][1])
-
-# Scale toolpath to fit in bounds.
-print("Scaling toolpath...")
-fitted_toolpath = fit_path(toolpath, DRAWING_BOUNDS)
-consolidated_toolpath = np.concatenate(toolpath)
-consolidated_fitted_toolpath = np.concatenate(fitted_toolpath)
-
-# Generate 3d toolpath.
-print("Generating 3d toolpath...")
-cartesian_toolpath = generate_cartesian_toolpath(fitted_toolpath)
-
-
-# Plot 3d toolpath.
-# ask whether or not to show the toolpaths:
-print("Do you want to see the toolpaths? (y)")
-if input() == "y":
+import numpy as np
+from constants import *
+from pipeline_cache import generate_toolpaths
+
+PYTHON_DIRECTORY = os.path.dirname(os.path.abspath(__file__))
+SVG_DIRECTORY = os.path.join(PYTHON_DIRECTORY, 'svgs')
+DATA_DIRECTORY = os.path.join(PYTHON_DIRECTORY, 'data')
+ANIMATION_MAX_STEPS = 50000
+
+
+def parse_arguments():
+    """read the command line options, any option left out is asked for interactively when no
+    svg is given."""
+    parser = argparse.ArgumentParser(description="Draw an svg with the robowriter.")
+    parser.add_argument('--svg', help="name of an svg in the svgs directory, or a path to an svg file")
+    parser.add_argument('--port', default='COM5', help="serial port of the dynamixel motors (default: COM5)")
+    parser.add_argument('--speed', type=float, default=1, help="multiply the drawing and travel feeds, within the acceleration and joint limits (default: 1)")
+    parser.add_argument('--workers', type=int, default=1, help="processes used to read large svgs")
+    parser.add_argument('--no-cache', action='store_true', help="rerun every stage instead of using the pipeline cache")
+    parser.add_argument('--ik-table', action='store_true', help="interpolate joint angles from a precomputed table of the drawing plane")
+    parser.add_argument('--show-toolpaths', action='store_true', help="plot the scaled and 3d toolpaths")
+    parser.add_argument('--animate', action='store_true', help="play an animation of the arm before drawing")
+    parser.add_argument('--export-video', metavar='FILE', help="render the arm drawing the toolpath into an .mp4 or .gif, needs imageio")
+    parser.add_argument('--video-speed', type=float, default=10, help="how many times faster than the arm the exported video plays (default: 10)")
+    parser.add_argument('--review', action='store_true', help="plot the recorded toolpath and angles after drawing")
+    parser.add_argument('--preview', action='store_true', help="save a png of the drawing to the data directory, and one of the recorded drawing over it after running")
+    parser.add_argument('--save-input', action='store_true', help="save the 3d toolpath to the data directory")
+    parser.add_argument('--save-output', metavar='NAME', help="save the input and recorded toolpaths as NAME in the data directory")
+    parser.add_argument('--dry-run', action='store_true', help="generate the toolpath without connecting to the motors")
+    parser.add_argument('--yes', action='store_true', help="start drawing without waiting for a key press")
+    return parser.parse_args()
+
+
+def ask(question: str) -> bool:
+    """ask a yes/no question on the command line."""
+    return input(question + " (y)\n") == "y"
+
+
+def find_svg(name: str) -> str:
+    """find the file path of an svg from its name in the svg directory or its path."""
+    if os.path.isfile(name):
+        return name
+    return os.path.join(SVG_DIRECTORY, name + '.svg')
+
+
+def show_toolpaths(toolpath, fitted_toolpath, cartesian_toolpath) -> None:
+    """plot the original and scaled 2d toolpaths and the 3d toolpath, each decimated to
+    decimate.PLOT_MAX_POINTS points."""
+    import plotly.graph_objects as go
+    from decimate import decimate_path
+    consolidated_toolpath = decimate_path(toolpath.points)
+    consolidated_fitted_toolpath = decimate_path(fitted_toolpath.points)
+    cartesian_toolpath = decimate_path(cartesian_toolpath)
+
     print("Displaying scaled toolpath...")
     # Create figure
     scaled_toolpaths = go.Figure()
@@ -67,146 +89,193 @@ if input() == "y":
     toolpath_3d_fig.add_trace(go.Scatter3d(x=cartesian_toolpath[:,0], y=cartesian_toolpath[:,1], z=cartesian_toolpath[:,2], mode='markers', name = 'Interpolated Toolpath', marker=dict(color="blue", size=2)))
     toolpath_3d_fig.show()
 
-#Enter filename to save
-answer = input("Do you want to save the toolpath data to a file? (y)")
-if answer == "y":
-    print("Saving data... ")
-    np.savetxt("./Code/Python/data/"+file_name+"_input_toolpath.txt", cartesian_toolpath, fmt = '%d')
-    print("files saved")
-
-# Generate angular toolpath.
-print("Generating angular toolpath...")
-angular_toolpath_model = generate_angular_toolpath(cartesian_toolpath)
 
-# ask whether or not to play animation:
-print("Do you want to play the animation? (y)")
-if input() == "y":
+def play_animation(angular_toolpath, cartesian_toolpath) -> None:
+    """animate the arm following the toolpath, downsampled to ANIMATION_MAX_STEPS steps."""
+    from animate_arm import animate_arm
     print("Generating animation...")
-    # downsample the toolpath to make the animation run faster
-    angular_toolpath_length = angular_toolpath_model.shape[0]
-    max_steps = 500
-    if angular_toolpath_length > max_steps:
-        angular_tool_path_animation = angular_toolpath_model[::int(angular_toolpath_length/max_steps)]
-        cartesian_toolpath_animation = cartesian_toolpath[::int(angular_toolpath_length/max_steps)]
-        animate_arm(angular_tool_path_animation, cartesian_toolpath_animation)
+    # downsample the arm's steps of very long toolpaths, the desired toolpath is only drawn once
+    # so all of it is shown
+    angular_toolpath_length = angular_toolpath.shape[0]
+    if angular_toolpath_length > ANIMATION_MAX_STEPS:
+        step = int(np.ceil(angular_toolpath_length/ANIMATION_MAX_STEPS))
+        animate_arm(angular_toolpath[::step], cartesian_toolpath.T)
     else:
-        animate_arm(angular_toolpath_model, cartesian_toolpath)
-else:
-    print("Skipping animation...")
-
-
-# Apply transformations to convert model angles into physical bit commands.
-print("Converting model angles into bit commands...")
-angular_toolpath_physical = angular_toolpath_model*ANGLE_SCALING + ANGLE_OFFSET
-bit_commands = degrees_to_bits(angular_toolpath_physical)
-
-
-# Initialize dynamixel motors
-
-SPEED = 1
-
-print("Press any key to continue to path execution or ESC to cancel")
-if ord(getch()) == ESC_CH:
-    exit()
-print("Initializing motors...")
-COM_PORT = 'COM5'
-controller = MotorController(COM_PORT, MOTOR_IDS, GAINS)
-controller.connect_dynamixel()
-controller.enable_all_torque()
-time.sleep(1)
-
-# command motor from current position to home position
-# get current position
-# print("Moving to home position...")
-# positions_bits = controller.get_motor_positions()
-# positions_degrees_physical = bits_to_degrees(positions_bits)
-# positions_degrees_theoretical = ANGLE_SCALING * (positions_degrees_physical - ANGLE_OFFSET)
-# end_deffector_coords = forward_kinematics(positions_degrees_theoretical[0], positions_degrees_theoretical[1], positions_degrees_theoretical[2], positions_degrees_theoretical[3])[5][0:3, 3]
-
-# # create angular toolpath with this position and home position
-# homing_toolpath = np.vstack((end_deffector_coords, end_deffector_coords, np.array(HOME_POSITION_CARTESIAN)))
-# homing_toolpath = interpolate_toolpath(homing_toolpath)
-# homing_angular_toolpath = generate_angular_toolpath(homing_toolpath)
-# homing_bits_toolpath = degrees_to_bits(homing_angular_toolpath*ANGLE_SCALING + ANGLE_OFFSET)
-
-# # run homing toolpath
-# for i, commands in enumerate(homing_bits_toolpath):
-#     if i % SPEED == 0:
-#         print(commands)
-#         controller.write_motor_positions(commands)
-#         time.sleep(0.1)
-
-
-
-# Run profile
-print("Running profile...")
-
-
-
-
-# information to save
-positions_bits = controller.get_motor_positions()
-positions_degrees_physical = bits_to_degrees(positions_bits)
-positions_degrees_theoretical = ANGLE_SCALING * (positions_degrees_physical - ANGLE_OFFSET)
-end_deffector_coords = forward_kinematics(positions_degrees_theoretical[0], positions_degrees_theoretical[1], positions_degrees_theoretical[2], positions_degrees_theoretical[3])[5][0:3, 3]
-output_toolpath = end_deffector_coords
-output_angles = positions_degrees_theoretical
-
-
-
-for i, commands in enumerate(bit_commands):
-    if i % SPEED == 0:
+        animate_arm(angular_toolpath, cartesian_toolpath.T)
+
+
+def run_profile(port: str, bit_commands):
+    """send the bit commands to the motors, one every CONTROL_PERIOD_S, and record where the arm
+    actually went.
+
+    returns:
+        the recorded pen tip positions and model angles after each command.
+    """
+    from motor_controller import MotorController, bits_to_degrees
+    from forward_kinematics import batch_forward_kinematics
+
+    print("Initializing motors...")
+    controller = MotorController(port, MOTOR_IDS, GAINS)
+    controller.connect_dynamixel()
+    controller.enable_all_torque()
+    time.sleep(1)
+
+    # Run profile
+    print("Running profile...")
+
+    # information to save
+    positions_bits = controller.get_motor_positions()
+    positions_degrees_physical = bits_to_degrees(positions_bits)
+    positions_degrees_theoretical = ANGLE_SCALING * (positions_degrees_physical - ANGLE_OFFSET)
+    output_angles = [positions_degrees_theoretical]
+
+    late_commands = 0
+    next_time = time.perf_counter()
+    for commands in bit_commands:
+        # wait for the next control period so the pen follows the trajectory's timing, if the
+        # bus fell behind carry on from now instead of rushing to catch up
+        delay = next_time - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+        else:
+            late_commands += 1
+            next_time = time.perf_counter()
+        next_time += CONTROL_PERIOD_S
         controller.write_motor_positions(commands)
         positions_bits = controller.get_motor_positions()
         positions_degrees_physical = bits_to_degrees(positions_bits)
         positions_degrees_theoretical = ANGLE_SCALING * (positions_degrees_physical - ANGLE_OFFSET)
-        end_deffector_coord = forward_kinematics(positions_degrees_theoretical[0], positions_degrees_theoretical[1], positions_degrees_theoretical[2], positions_degrees_theoretical[3])[5][0:3, 3]
-        output_toolpath = np.vstack((output_toolpath, end_deffector_coord))
-        output_angles = np.vstack((output_angles, positions_degrees_theoretical))
+        output_angles.append(positions_degrees_theoretical)
+
+    if late_commands:
+        print(f"{late_commands} commands were sent late, CONTROL_PERIOD_S is shorter than the bus round trip.")
 
+    # Disconnect motors
+    print("Disconnecting motors...")
+    controller.disconnect()
 
-# Disconnect motors
-print("Disconnecting motors...")
-controller.disconnect()
+    # work out where the pen went once the drawing is done so the loop only talks to the motors
+    output_angles = np.array(output_angles)
+    output_toolpath = batch_forward_kinematics(output_angles)
+    return output_toolpath, output_angles
 
 
-post_review_3d = go.Figure()
+def show_post_review(cartesian_toolpath, output_toolpath, angular_toolpath, output_angles) -> None:
+    """plot the input toolpath against the recorded toolpath and the commanded angles against
+    the recorded angles, each decimated to decimate.PLOT_MAX_POINTS points."""
+    import plotly.graph_objects as go
+    from decimate import decimate_path, decimate_series
 
-# Plot original toolpath
-post_review_3d.add_trace(go.Scatter3d(x=cartesian_toolpath[:,0], y=cartesian_toolpath[:,1], z=cartesian_toolpath[:,2], mode='lines', name='Input Toolpath'))
+    post_review_3d = go.Figure()
 
-# Plot scaled toolpath
-post_review_3d.add_trace(go.Scatter3d(x=output_toolpath[:,0], y=output_toolpath[:,1], z = output_toolpath[:,2] ,mode='lines', name='Recorded Toolpath'))
+    # Plot original toolpath
+    input_toolpath = decimate_path(cartesian_toolpath)
+    post_review_3d.add_trace(go.Scatter3d(x=input_toolpath[:,0], y=input_toolpath[:,1], z=input_toolpath[:,2], mode='lines', name='Input Toolpath'))
+
+    # Plot scaled toolpath
+    recorded_toolpath = decimate_path(output_toolpath)
+    post_review_3d.add_trace(go.Scatter3d(x=recorded_toolpath[:,0], y=recorded_toolpath[:,1], z = recorded_toolpath[:,2] ,mode='lines', name='Recorded Toolpath'))
+
+    # Set layout
+    post_review_3d.update_layout(title='Post Review',
+                        showlegend=True)
 
-# Set layout
-post_review_3d.update_layout(title='Post Review',
-                    showlegend=True)
+    post_review_3d.show()
 
-post_review_3d.show()
+    # Add figure of angle commands
+    post_review_angles = go.Figure()
 
-# Add figure of angle commands
-post_review_angles = go.Figure()
+    x_output = np.linspace(0, output_angles.shape[0], output_angles.shape[0])
+    x_input = np.linspace(0, angular_toolpath.shape[0], angular_toolpath.shape[0])
+    for joint in range(4):
+        x_in, y_in = decimate_series(x_input, angular_toolpath[:,joint])
+        x_out, y_out = decimate_series(x_output, output_angles[:,joint])
+        post_review_angles.add_trace(go.Scatter(x = x_in,  y = y_in, name=f"Theta_{joint+1}_in"))
+        post_review_angles.add_trace(go.Scatter(x = x_out,  y = y_out, name=f"Theta_{joint+1}_out"))
 
-x_output = np.linspace(0, output_angles.shape[0], output_angles.shape[0])*SPEED
-x_input = np.linspace(0, angular_toolpath_model.shape[0], angular_toolpath_model.shape[0])
-post_review_angles.add_trace(go.Scatter(x = x_input,  y = angular_toolpath_model[:,0], name="Theta_1_in"))
-post_review_angles.add_trace(go.Scatter(x = x_output,  y = output_angles[:,0], name="Theta_1_out"))
-post_review_angles.add_trace(go.Scatter(x = x_input,  y = angular_toolpath_model[:,1], name="Theta_2_in"))
-post_review_angles.add_trace(go.Scatter(x = x_output,  y = output_angles[:,1], name="Theta_2_out"))
-post_review_angles.add_trace(go.Scatter(x = x_input,  y = angular_toolpath_model[:,2], name="Theta_3_in"))
-post_review_angles.add_trace(go.Scatter(x = x_output,  y = output_angles[:,2], name="Theta_3_out"))
-post_review_angles.add_trace(go.Scatter(x = x_input,  y = angular_toolpath_model[:,3], name="Theta_4_in"))
-post_review_angles.add_trace(go.Scatter(x = x_output,  y = output_angles[:,3], name="Theta_4_out"))
+    post_review_angles.update_layout(title='Post Review Angles')
+    post_review_angles.show()
 
-post_review_angles.update_layout(title='Post Review Angles')
-post_review_angles.show()
 
+def main():
+    arguments = parse_arguments()
+    interactive = arguments.svg is None
 
-#Enter filename to save
-answer = input("Do you want to save the output data to a file? (y)")
-if answer == "y":
-    filename = input("Enter file name\n")
-    print("Saving data... ")
-    np.savetxt("./Code/Python/data/"+filename+"_input_toolpath.txt", cartesian_toolpath, fmt = '%d')
-    np.savetxt("./Code/Python/data/"+filename+"_output_toolpath.txt", output_toolpath, fmt = '%d')
-    print("files saved")
\ No newline at end of file
+    # Get svg to use.
+    if interactive:
+        file_name = input("Input svg name you wish to use. It must be in the svg directory\n")
+    else:
+        file_name = arguments.svg
+    file_path = find_svg(file_name)
+    file_name = os.path.splitext(os.path.basename(file_path))[0]
+
+    # Run the preprocessing stages, reusing any outputs cached from an earlier run.
+    outputs = generate_toolpaths(file_path, use_cache=not arguments.no_cache, workers=arguments.workers,
+                                 ik_table=arguments.ik_table, speed=arguments.speed)
+    cartesian_toolpath = outputs['cartesian_toolpath'].points
+    angular_toolpath_model = outputs['angular_toolpath']
+    bit_commands = outputs['bit_commands']
+
+    # Plot 3d toolpath.
+    if arguments.show_toolpaths or (interactive and ask("Do you want to see the toolpaths?")):
+        show_toolpaths(outputs['toolpath'], outputs['fitted_toolpath'], cartesian_toolpath)
+
+    if arguments.preview:
+        from preview import save_preview
+        preview_path = os.path.join(DATA_DIRECTORY, file_name+"_preview.png")
+        save_preview(preview_path, outputs['cartesian_toolpath'])
+        print(f"Saved preview to {preview_path}")
+
+    if arguments.save_input or (interactive and ask("Do you want to save the toolpath data to a file?")):
+        print("Saving data... ")
+        np.savetxt(os.path.join(DATA_DIRECTORY, file_name+"_input_toolpath.txt"), cartesian_toolpath, fmt = '%d')
+        print("files saved")
+
+    if arguments.animate or (interactive and ask("Do you want to play the animation?")):
+        play_animation(angular_toolpath_model, cartesian_toolpath)
+    else:
+        print("Skipping animation...")
+
+    if arguments.export_video:
+        from export_video import export_video
+        print("Exporting video...")
+        export_video(angular_toolpath_model, arguments.export_video, outputs['cartesian_toolpath'],
+                     speed=arguments.video_speed, workers=arguments.workers, verbose=True)
+
+    clamped = outputs['validation']['clamped_indices']
+    if len(clamped):
+        worst = clamped[np.argmax(outputs['validation']['error_mm'][clamped])]
+        print(f"Warning: {len(clamped)} points are past the joint limits, the worst moves the pen "
+              f"{outputs['validation']['error_mm'][worst]:.2f} mm at point {worst}.")
+
+    if arguments.dry_run:
+        return
+
+    if not arguments.yes:
+        from motor_controller import getch
+        print("Press any key to continue to path execution or ESC to cancel")
+        if ord(getch()) == ESC_CH:
+            return
+    output_toolpath, output_angles = run_profile(arguments.port, bit_commands)
+
+    if arguments.preview:
+        preview_path = os.path.join(DATA_DIRECTORY, file_name+"_recorded_preview.png")
+        save_preview(preview_path, outputs['cartesian_toolpath'], output_toolpath)
+        print(f"Saved preview of the recorded toolpath to {preview_path}")
+
+    if arguments.review or interactive:
+        show_post_review(cartesian_toolpath, output_toolpath, angular_toolpath_model, output_angles)
+
+    #Enter filename to save
+    output_name = arguments.save_output
+    if output_name is None and interactive and ask("Do you want to save the output data to a file?"):
+        output_name = input("Enter file name\n")
+    if output_name is not None:
+        print("Saving data... ")
+        np.savetxt(os.path.join(DATA_DIRECTORY, output_name+"_input_toolpath.txt"), cartesian_toolpath, fmt = '%d')
+        np.savetxt(os.path.join(DATA_DIRECTORY, output_name+"_output_toolpath.txt"), output_toolpath, fmt = '%d')
+        print("files saved")
+
+
+if __name__ == "__main__":
+    main()
@@ -10,9 +10,10 @@ if os.name == 'nt':
         return msvcrt.getch().decode()
 else:
     import sys, tty, termios
-    fd = sys.stdin.fileno()
-    old_settings = termios.tcgetattr(fd)
     def getch():
+        # read the terminal settings when called so importing works without a terminal
+        fd = sys.stdin.fileno()
+        old_settings = termios.tcgetattr(fd)
         try:
             tty.setraw(sys.stdin.fileno())
             ch = sys.stdin.read(1)
@@ -0,0 +1,329 @@
+"""
+This file contains a stage that reorders the strokes of a fitted 2D toolpath and picks the
+direction each stroke is drawn in, so the arm spends less time moving with the pen lifted.
+
+The strokes are first chained by always moving to the nearest free stroke end, found with a
+grid over the drawing, then the order is improved with 2-opt moves between strokes that are
+close together in the order. Closed loops can be started from any of their points, so the start
+point of each loop is picked once the order is known.
+
+Moves are compared with travel_cost, which adds a penalty for turning the base (theta1) to the
+straight line distance because the base is the slowest joint of the arm.
+
+Once ordered, strokes that start where the previous one ended, or close enough that the pen can
+be dragged across the gap, are joined by merge_strokes so the pen is not lifted between them.
+"""
+import numpy as np
+from constants import *
+from toolpath import Toolpath
+
+TWO_OPT_WINDOW = 50                 # furthest apart two strokes in the order can be to be swapped
+TWO_OPT_PASSES = 5                  # maximum number of 2-opt passes over the whole order
+LOOP_CANDIDATES = 16                # points of each closed loop the nearest neighbour pass can enter at
+CLOSED_LOOP_TOLERANCE_MM = 1e-3     # distance between the ends of a stroke for it to count as a loop
+
+
+def base_angles(points: np.array) -> np.array:
+    """the angle of the base (theta1) in degrees needed to reach each x, y point."""
+    return np.degrees(np.arctan2(points[..., 1], points[..., 0]))
+
+
+def travel_cost(start: np.array, end: np.array) -> np.array:
+    """the cost of pen-up moves between points.
+
+    parameters:
+        start: a (..., 2) array of the x, y coordinates the moves start at.
+        end: a (..., 2) array of the x, y coordinates the moves end at.
+
+    returns:
+        the length of each move in mm plus BASE_ROTATION_COST_MM for every degree the base turns.
+    """
+    return (np.linalg.norm(end - start, axis=-1)
+            + BASE_ROTATION_COST_MM*np.abs(base_angles(end) - base_angles(start)))
+
+
+def pen_up_moves(toolpath: Toolpath, start: np.array) -> tuple:
+    """the start and end points of every pen-up move from start, through each stroke in order
+    and back to start."""
+    toolpath = Toolpath.from_strokes(toolpath)
+    start = np.asarray(start, dtype=float)[:2]
+    return np.vstack((start, toolpath.lasts())), np.vstack((toolpath.firsts(), start))
+
+
+def travel_distance(toolpath: Toolpath, start: np.array = HOME_POSITION_CARTESIAN) -> float:
+    """the total distance in mm the pen moves while lifted to draw the strokes in order.
+
+    parameters:
+        toolpath: a Toolpath or a list of 2D arrays of the x, y coordinates of each stroke.
+        start: the position the arm starts and ends at.
+    """
+    move_starts, move_ends = pen_up_moves(toolpath, start)
+    return float(np.linalg.norm(move_ends - move_starts, axis=1).sum())
+
+
+def closed_strokes(toolpath: Toolpath) -> np.array:
+    """whether each stroke ends where it starts, so it can be drawn starting from any of its points."""
+    return (toolpath.stroke_lengths() > 2) & (np.linalg.norm(toolpath.lasts() - toolpath.firsts(), axis=1) <= CLOSED_LOOP_TOLERANCE_MM)
+
+
+def nearest_neighbour_order(toolpath: Toolpath, closed: np.array, start: np.array) -> tuple:
+    """chain the strokes by always moving to the nearest end of a stroke that is not drawn yet.
+
+    Every point a stroke can be entered at (both ends of an open stroke, up to LOOP_CANDIDATES
+    points of a closed loop) is put in a grid, and the grid is searched in growing rings around
+    the current position until no closer point can be left.
+
+    returns:
+        the stroke indices in drawing order and the index of the point each stroke is entered at.
+    """
+    # the points each stroke can be entered at, and where the pen leaves the stroke from each
+    candidate_strokes, candidate_entries, candidate_exits = [], [], []
+    for stroke, length in enumerate(toolpath.stroke_lengths()):
+        last = length - 1
+        if closed[stroke]:
+            entries = np.unique(np.linspace(0, last - 1, min(LOOP_CANDIDATES, last)).astype(int))
+            exits = entries
+        elif last > 0:
+            entries, exits = [0, last], [last, 0]
+        else:
+            entries, exits = [0], [0]
+        candidate_strokes.extend([stroke]*len(entries))
+        candidate_entries.extend(entries)
+        candidate_exits.extend(exits)
+    candidate_strokes = np.array(candidate_strokes)
+    candidate_entries = np.array(candidate_entries)
+    candidate_exits = np.array(candidate_exits)
+    candidate_points = toolpath.points[toolpath.offsets[candidate_strokes] + candidate_entries]
+
+    # grid with about two candidates per cell
+    origin = candidate_points.min(axis=0)
+    size = np.ptp(candidate_points, axis=0) + 1e-9
+    cell_size = max(np.sqrt(size[0]*size[1] * 2 / len(candidate_points)), size.max() / 1000, 1e-6)
+    cells = np.floor((candidate_points - origin) / cell_size).astype(int)
+    grid = {}
+    for candidate, cell in enumerate(map(tuple, cells)):
+        grid.setdefault(cell, []).append(candidate)
+    grid_extent = cells.max() + 1
+
+    drawn = np.zeros(len(toolpath), dtype=bool)
+    stroke_candidates = np.bincount(candidate_strokes, minlength=len(toolpath))
+    remaining = len(candidate_points)
+    order, entry_points = [], []
+    position = np.asarray(start, dtype=float)[:2]
+    while len(order) < len(toolpath):
+        center = np.floor((position - origin) / cell_size).astype(int)
+        best, best_cost = None, np.inf
+        ring = 0
+        while True:
+            if (2*ring + 1)**2 > remaining or ring > grid_extent + abs(center).max():
+                # the ring has more cells than there are candidates left, check them all
+                candidates = np.flatnonzero(~drawn[candidate_strokes])
+            else:
+                candidates = []
+                for dx in range(-ring, ring + 1):
+                    step = 1 if abs(dx) == ring else 2*ring
+                    for dy in range(-ring, ring + 1, max(step, 1)):
+                        cell = (center[0] + dx, center[1] + dy)
+                        if cell in grid:
+                            # drop candidates of strokes that were drawn since the cell was last searched
+                            grid[cell] = [candidate for candidate in grid[cell] if not drawn[candidate_strokes[candidate]]]
+                            candidates.extend(grid[cell])
+                candidates = np.array(candidates, dtype=int)
+            if len(candidates):
+                costs = travel_cost(position, candidate_points[candidates])
+                nearest = np.argmin(costs)
+                if costs[nearest] < best_cost:
+                    best, best_cost = candidates[nearest], costs[nearest]
+            # every cell past this ring is at least ring*cell_size away, which is a lower bound on cost
+            if (2*ring + 1)**2 > remaining or ring > grid_extent + abs(center).max() or best_cost <= ring*cell_size:
+                break
+            ring += 1
+
+        stroke = candidate_strokes[best]
+        drawn[stroke] = True
+        remaining -= stroke_candidates[stroke]
+        order.append(stroke)
+        entry_points.append(candidate_entries[best])
+        position = toolpath.points[toolpath.offsets[stroke] + candidate_exits[best]]
+    return np.array(order), np.array(entry_points)
+
+
+def with_base_angles(points: np.array) -> np.array:
+    """add the cost of turning the base to each x, y point as a third coordinate, so the travel
+    cost between two such points is their x, y distance plus their third coordinate distance."""
+    return np.column_stack((points, BASE_ROTATION_COST_MM*base_angles(points)))
+
+
+def weighted_cost(start: np.array, end: np.array) -> np.array:
+    """travel_cost between points that already have their base angle cost. (see with_base_angles)"""
+    difference = end - start
+    return np.hypot(difference[..., 0], difference[..., 1]) + np.abs(difference[..., 2])
+
+
+def two_opt(entries: np.array, exits: np.array, closed: np.array, entry_points: np.array,
+            exit_points: np.array, order: np.array) -> None:
+    """improve a stroke order in place by reversing runs of strokes whenever that lowers the cost.
+
+    Reversing the strokes at positions i to j in the order also swaps the ends each of them is
+    drawn from, so only the moves into position i and out of position j change. Only runs up
+    to TWO_OPT_WINDOW strokes long are tried, for at most TWO_OPT_PASSES passes.
+
+    parameters:
+        entries, exits: (n+2, 3) arrays of the point each stroke is entered and left at with
+            their base angle cost (see with_base_angles), with the start position as the exit
+            of the first row and the entry of the last row.
+        closed: whether the stroke at each position is a closed loop.
+        entry_points, exit_points, order: the point indices and stroke index at each position.
+    """
+    strokes = len(order)
+    # cost of the move out of each position, the cost is symmetric so reversing a run of
+    # strokes only reverses the moves inside it
+    moves = weighted_cost(exits[:-1], entries[1:])
+    for _ in range(TWO_OPT_PASSES):
+        improved = False
+        for i in range(1, strokes + 1):
+            j = np.arange(i, min(i + TWO_OPT_WINDOW, strokes + 1))
+            new = weighted_cost(exits[i-1], exits[j]) + weighted_cost(entries[i], entries[j+1])
+            change = new - moves[i-1] - moves[j]
+            best = np.argmin(change)
+            if change[best] < -1e-9:
+                j = j[best]
+                entries[i:j+1], exits[i:j+1] = exits[i:j+1][::-1].copy(), entries[i:j+1][::-1].copy()
+                entry_points[i-1:j], exit_points[i-1:j] = exit_points[i-1:j][::-1].copy(), entry_points[i-1:j][::-1].copy()
+                closed[i-1:j] = closed[i-1:j][::-1].copy()
+                order[i-1:j] = order[i-1:j][::-1].copy()
+                moves[i:j] = moves[i:j][::-1].copy()
+                moves[i-1], moves[j] = weighted_cost(exits[i-1], entries[i]), weighted_cost(exits[j], entries[j+1])
+                improved = True
+        if not improved:
+            break
+
+
+def order_strokes(toolpath: Toolpath, start: np.array = HOME_POSITION_CARTESIAN, verbose: bool = False) -> Toolpath:
+    """reorder the strokes of a toolpath and choose the direction and start point of each stroke
+    to reduce the pen-up travel between them.
+
+    parameters:
+        toolpath: a Toolpath, or a list of 2D arrays of the x, y coordinates of the pen tip in mm
+            in the base coordinate frame. ex: [[[x1, y1], [x2, y2]], [[x3, y3], [x4, y4]]]
+        start: the position the arm starts and ends at, only x and y are used.
+        verbose: print the pen-up travel before and after ordering.
+
+    returns:
+        a new Toolpath of the same strokes in drawing order, reversed or rotated to start at
+        the point the pen goes down at. The input toolpath is not changed.
+    """
+    toolpath = Toolpath.from_strokes(toolpath)
+    if len(toolpath) == 0:
+        return toolpath.copy()
+    start = np.asarray(start, dtype=float)[:2]
+    closed = closed_strokes(toolpath)
+    lengths = toolpath.stroke_lengths()
+
+    order, entry_points = nearest_neighbour_order(toolpath, closed, start)
+    closed = closed[order]
+    exit_points = np.where(closed, entry_points, lengths[order] - 1 - entry_points)
+    entries = with_base_angles(np.vstack(([start], toolpath.points[toolpath.offsets[order] + entry_points], [start])))
+    exits = with_base_angles(np.vstack(([start], toolpath.points[toolpath.offsets[order] + exit_points], [start])))
+    two_opt(entries, exits, closed, entry_points, exit_points, order)
+
+    # start each closed loop at whichever of its points is cheapest to get to and leave from
+    for position in np.flatnonzero(closed) + 1:
+        loop = with_base_angles(toolpath[order[position-1]][:-1])
+        costs = weighted_cost(exits[position-1], loop) + weighted_cost(loop, entries[position+1])
+        entry_points[position-1] = exit_points[position-1] = np.argmin(costs)
+        entries[position] = exits[position] = loop[entry_points[position-1]]
+
+    # gather the points of each stroke from its entry point, a loop wraps around past its last
+    # point (the copy of its first point) and ends on its entry point again
+    ordered_lengths = lengths[order]
+    new_offsets = np.append(0, np.cumsum(ordered_lengths))
+    position = np.repeat(np.arange(len(order)), ordered_lengths)
+    step = np.arange(new_offsets[-1]) - new_offsets[position]
+    loop_step = (entry_points[position] + step) % np.maximum(ordered_lengths[position] - 1, 1)
+    reversed_step = np.where(entry_points[position] == 0, step, ordered_lengths[position] - 1 - step)
+    indices = toolpath.offsets[order][position] + np.where(closed[position], loop_step, reversed_step)
+    ordered_toolpath = Toolpath(toolpath.points[indices], new_offsets, toolpath.flags[indices])
+
+    # keep the original order if it was already cheaper
+    original_cost = travel_cost(*pen_up_moves(toolpath, start)).sum()
+    ordered_cost = travel_cost(*pen_up_moves(ordered_toolpath, start)).sum()
+    if original_cost <= ordered_cost:
+        ordered_toolpath = toolpath.copy()
+
+    if verbose:
+        before = travel_distance(toolpath, start)
+        after = travel_distance(ordered_toolpath, start)
+        print(f"Pen-up travel for {len(toolpath)} strokes: {before:.0f} mm before ordering, {after:.0f} mm after "
+              f"({100*(1 - after/before) if before else 0:.0f}% less).")
+    return ordered_toolpath
+
+
+def merge_strokes(toolpath: Toolpath, tolerance: float = MERGE_TOLERANCE_MM, max_gap: float = PEN_DOWN_GAP_MM,
+                  verbose: bool = False) -> Toolpath:
+    """join strokes that follow each other in drawing order when the pen does not need to be
+    lifted between them.
+
+    A stroke that starts within tolerance of where the previous one ended is joined without its
+    first point. A stroke that starts within max_gap of the previous end is joined as is, so
+    the pen is dragged across the gap instead of lifted. Run after order_strokes, which puts
+    strokes with coinciding ends next to each other.
+
+    parameters:
+        toolpath: a Toolpath or a list of 2D arrays of the x, y coordinates of each stroke in
+            drawing order.
+        tolerance: the distance in mm between two ends for them to count as the same point.
+        max_gap: the longest gap in mm the pen stays down across.
+        verbose: print how many strokes were joined.
+
+    returns:
+        a new Toolpath of the joined strokes.
+    """
+    toolpath = Toolpath.from_strokes(toolpath)
+    if len(toolpath) < 2:
+        return toolpath.copy()
+    gaps = np.linalg.norm(toolpath.firsts()[1:] - toolpath.lasts()[:-1], axis=1)
+    joined = gaps <= max(max_gap, tolerance)
+
+    # drop the first point of strokes that start on the end of the stroke they are joined to
+    keep = np.ones(len(toolpath.points), dtype=bool)
+    keep[toolpath.offsets[1:-1][gaps <= tolerance]] = False
+
+    # a joined stroke's points stay in the stroke before it, so only the first points of
+    # strokes that are not joined start a new stroke
+    removed_before = np.append(0, np.cumsum(~keep))
+    first_points = np.concatenate(([0], toolpath.offsets[1:-1][~joined], [len(keep)]))
+    merged_toolpath = Toolpath(toolpath.points[keep], first_points - removed_before[first_points], toolpath.flags[keep])
+
+    if verbose:
+        print(f"Joined {len(toolpath)} strokes into {len(merged_toolpath)}, "
+              f"{np.count_nonzero(joined & (gaps > tolerance))} with the pen kept down across a gap.")
+    return merged_toolpath
+
+
+if __name__ == "__main__":
+    import os
+    import time
+    from SVG_to_coords import parse_svg
+    from coords_to_toolpath import read_path
+    from fit_path import fit_path
+
+    file_name = 'hong3'
+    svg_file = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'svgs', file_name + '.svg')
+    toolpath = fit_path(read_path(parse_svg(svg_file), CURVE_TOLERANCE_MM), DRAWING_BOUNDS)
+
+    start_time = time.perf_counter()
+    ordered_toolpath = order_strokes(toolpath, verbose=True)
+    print(f"ordered in {time.perf_counter() - start_time:.2f} s")
+    merged_toolpath = merge_strokes(ordered_toolpath, verbose=True)
+
+    import plotly.graph_objects as go
+    fig = go.Figure()
+    for name, paths in (('Original', toolpath), ('Ordered', ordered_toolpath)):
+        move_starts, move_ends = pen_up_moves(paths, HOME_POSITION_CARTESIAN)
+        moves = np.stack((move_starts, move_ends, np.full_like(move_starts, np.nan)), axis=1).reshape(-1, 2)
+        fig.add_trace(go.Scatter(x=moves[:,0], y=moves[:,1], mode='lines', name=f'{name} pen-up moves'))
+    drawing = np.vstack([np.vstack((path, [np.nan, np.nan])) for path in toolpath])
+    fig.add_trace(go.Scatter(x=drawing[:,0], y=drawing[:,1], mode='lines', name='Strokes'))
+    fig.update_layout(title='Stroke Ordering', showlegend=True)
+    fig.show()
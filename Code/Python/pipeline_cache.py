@@ -0,0 +1,263 @@
+"""
+This file contains a disk cache for the output of each stage of the drawing pipeline
+(svg -> 2d toolpath -> fitted toolpath -> simplified toolpath ->
+deduplicated toolpath -> ordered toolpath -> merged toolpath -> 3d toolpath -> trajectory -> model angles ->
+motor bits).
+
+Each stage's output is saved as an .npz of .npy arrays named after a hash of the stage's input
+and the constants it depends on, so redrawing an svg with the same constants skips straight to
+execution and changing a later constant only reruns the stages after it. The least recently
+used entries are deleted once the cache grows past its size limit.
+"""
+import os
+import hashlib
+import numpy as np
+from constants import *
+from SVG_to_coords import iter_svg_paths
+from coords_to_toolpath import read_path
+from fit_path import fit_path
+from simplify_path import simplify_path, SIMPLIFY_PIECE_POINTS
+from remove_duplicates import remove_duplicates, DUPLICATE_MIN_LENGTH_MM
+from order_strokes import order_strokes, merge_strokes, TWO_OPT_WINDOW, TWO_OPT_PASSES, LOOP_CANDIDATES, CLOSED_LOOP_TOLERANCE_MM
+from generate_toolpath import generate_cartesian_toolpath
+from inverse_kinematics import generate_angular_toolpath
+from trajectory import generate_trajectory, generate_angular_trajectory, JOINT_MOVE_CHECKS, JOINT_MOVE_SPLITS
+from motor_controller import degrees_to_bits
+from ik_table import IKTable, IK_TABLE_SPACING_MM
+from validate_toolpath import validate_toolpath, ReachabilityMap
+from toolpath import Toolpath
+
+CACHE_DIRECTORY = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'cache')
+CACHE_MAX_BYTES = 500 * 2**20       # 500 MB
+CACHE_VERSION = 6                   # bump when a stage's code changes its output
+
+
+class PipelineCache:
+    """Class for saving and loading pipeline stage outputs keyed by a hash of their inputs"""
+    def __init__(self, directory: str = CACHE_DIRECTORY, max_bytes: int = CACHE_MAX_BYTES) -> None:
+        """
+        Initialize the cache
+        parameters:
+            directory: the directory the cache entries are saved in, created if needed.
+            max_bytes: the total size the entries are trimmed to after each save.
+        """
+        self.directory = directory
+        self.max_bytes = max_bytes
+        os.makedirs(directory, exist_ok=True)
+
+    def key(self, stage: str, *inputs) -> str:
+        """hash the name of a stage together with everything its output depends on.
+
+        parameters:
+            stage: the name of the stage.
+            inputs: the key of the previous stage and any constants or arrays the stage uses.
+
+        returns:
+            the hex digest used as the entry's file name.
+        """
+        digest = hashlib.blake2b(f"{CACHE_VERSION}:{stage}".encode(), digest_size=20)
+        for value in inputs:
+            array = np.asarray(value)
+            digest.update(f"{array.dtype}{array.shape}".encode())
+            digest.update(array.tobytes())
+        return digest.hexdigest()
+
+    def file_key(self, file_path: str) -> str:
+        """hash the contents of a file."""
+        digest = hashlib.blake2b(digest_size=20)
+        with open(file_path, 'rb') as file:
+            for block in iter(lambda: file.read(2**20), b''):
+                digest.update(block)
+        return digest.hexdigest()
+
+    def path(self, key: str) -> str:
+        """the file path of the entry with the given key."""
+        return os.path.join(self.directory, key + '.npz')
+
+    def load(self, key: str) -> dict:
+        """load the arrays saved under a key and mark the entry as recently used.
+
+        returns:
+            a dict of the saved arrays, or None if there is no entry for the key.
+        """
+        path = self.path(key)
+        if not os.path.exists(path):
+            return None
+        with np.load(path) as entry:
+            arrays = dict(entry)
+        os.utime(path)
+        return arrays
+
+    def save(self, key: str, arrays: dict) -> None:
+        """save a dict of arrays under a key, then evict old entries if the cache is too big."""
+        temporary_path = self.path(key) + '.tmp.npz'
+        np.savez(temporary_path, **arrays)
+        os.replace(temporary_path, self.path(key))
+        self.evict()
+
+    def evict(self) -> None:
+        """delete the least recently used entries until the cache fits in max_bytes."""
+        entries = []
+        for name in os.listdir(self.directory):
+            if name.endswith('.npz'):
+                stat = os.stat(os.path.join(self.directory, name))
+                entries.append((stat.st_mtime, stat.st_size, name))
+        total_bytes = sum(size for _, size, _ in entries)
+        for _, size, name in sorted(entries):
+            if total_bytes <= self.max_bytes:
+                break
+            os.remove(os.path.join(self.directory, name))
+            total_bytes -= size
+
+    def cached(self, key: str, function, pack=None, unpack=None):
+        """load a stage's output from the cache or run the stage and save its output.
+
+        parameters:
+            key: the key of the stage. (see PipelineCache.key)
+            function: a function with no arguments that runs the stage.
+            pack: converts the stage output into a dict of arrays, by default {'array': output}
+            unpack: inverse of pack.
+
+        returns:
+            the stage output and whether it was loaded from the cache.
+        """
+        arrays = self.load(key)
+        if arrays is not None:
+            return (unpack(arrays) if unpack else arrays['array']), True
+        output = function()
+        self.save(key, pack(output) if pack else {'array': output})
+        return output, False
+
+
+def generate_toolpaths(svg_file: str, cache: PipelineCache = None, verbose: bool = True, use_cache: bool = True,
+                       workers: int = 1, ik_table: bool = False, speed: float = 1) -> dict:
+    """run every preprocessing stage on an svg file, reusing cached stage outputs.
+
+    parameters:
+        svg_file: path to the svg file to draw.
+        cache: the cache to use, or None to use one in CACHE_DIRECTORY.
+        verbose: print each stage and whether it was loaded from the cache.
+        use_cache: if False every stage is run and nothing is saved.
+        workers: number of processes used to read the svg. (see coords_to_toolpath.read_path)
+        ik_table: interpolate the joint angles from a table of the drawing plane instead of
+            solving each point. (see ik_table.IKTable)
+        speed: how many times DRAW_FEED_MM_S and TRAVEL_FEED_MM_S the pen moves at. The
+            acceleration and joint limits still hold, so short strokes speed up less.
+
+    returns:
+        a dict of the output of each stage, the toolpaths are Toolpath objects:
+            toolpath: the 2d toolpath in svg units (see coords_to_toolpath.read_path)
+            fitted_toolpath: the 2d toolpath fitted to DRAWING_BOUNDS
+            simplified_toolpath: the fitted strokes with points within SIMPLIFY_TOLERANCE_MM removed
+            deduplicated_toolpath: the simplified strokes without lines that retrace earlier strokes
+            ordered_toolpath: the deduplicated strokes reordered to reduce pen-up travel
+            merged_toolpath: the ordered strokes joined wherever the pen can stay down
+            cartesian_toolpath: the interpolated 3d toolpath with PEN_DOWN and TRAVEL flags
+            trajectory: the 3d toolpath sampled every CONTROL_PERIOD_S, one stroke between each
+                pen-up move (see trajectory.generate_trajectory)
+            validation: the points of the trajectory that are out of reach or past the joint
+                limits (see validate_toolpath.validate_toolpath)
+            angular_toolpath: the link angles of the model every CONTROL_PERIOD_S, including the
+                joint-space moves between the strokes of the trajectory
+            bit_commands: the motor commands for each point of the trajectory
+    """
+    if cache is None:
+        cache = PipelineCache()
+    outputs = {}
+
+    def run_stage(name, description, key, function, pack=None, unpack=None):
+        if verbose:
+            print(description)
+        if not use_cache:
+            outputs[name] = function()
+            return key
+        outputs[name], from_cache = cache.cached(key, function, pack, unpack)
+        if verbose and from_cache:
+            print("    loaded from cache")
+        return key
+
+    # the curve tolerance is converted with the size of the drawing bounds, but not their position
+    key = cache.key('toolpath', cache.file_key(svg_file), POINTS_IN_CURVE, CURVE_TOLERANCE_MM, np.ptp(DRAWING_BOUNDS, axis=0))
+    key = run_stage('toolpath', "Converting svg to 2d toolpath...", key,
+                    lambda: read_path(iter_svg_paths(svg_file), CURVE_TOLERANCE_MM, DRAWING_BOUNDS, verbose, workers),
+                    Toolpath.to_arrays, Toolpath.from_arrays)
+
+    key = cache.key('fitted_toolpath', key, DRAWING_BOUNDS)
+    key = run_stage('fitted_toolpath', "Scaling toolpath...", key,
+                    lambda: fit_path(outputs['toolpath'].copy(), DRAWING_BOUNDS),
+                    Toolpath.to_arrays, Toolpath.from_arrays)
+
+    key = cache.key('simplified_toolpath', key, SIMPLIFY_TOLERANCE_MM, SIMPLIFY_PIECE_POINTS)
+    key = run_stage('simplified_toolpath', "Simplifying toolpath...", key,
+                    lambda: simplify_path(outputs['fitted_toolpath'], SIMPLIFY_TOLERANCE_MM, verbose),
+                    Toolpath.to_arrays, Toolpath.from_arrays)
+
+    key = cache.key('deduplicated_toolpath', key, DUPLICATE_TOLERANCE_MM, DUPLICATE_MIN_LENGTH_MM)
+    key = run_stage('deduplicated_toolpath', "Removing duplicate lines...", key,
+                    lambda: remove_duplicates(outputs['simplified_toolpath'], DUPLICATE_TOLERANCE_MM, DUPLICATE_MIN_LENGTH_MM, verbose),
+                    Toolpath.to_arrays, Toolpath.from_arrays)
+
+    key = cache.key('ordered_toolpath', key, HOME_POSITION_CARTESIAN, BASE_ROTATION_COST_MM, TWO_OPT_WINDOW,
+                    TWO_OPT_PASSES, LOOP_CANDIDATES, CLOSED_LOOP_TOLERANCE_MM)
+    key = run_stage('ordered_toolpath', "Ordering strokes...", key,
+                    lambda: order_strokes(outputs['deduplicated_toolpath'], HOME_POSITION_CARTESIAN, verbose),
+                    Toolpath.to_arrays, Toolpath.from_arrays)
+
+    key = cache.key('merged_toolpath', key, MERGE_TOLERANCE_MM, PEN_DOWN_GAP_MM)
+    key = run_stage('merged_toolpath', "Joining strokes...", key,
+                    lambda: merge_strokes(outputs['ordered_toolpath'], MERGE_TOLERANCE_MM, PEN_DOWN_GAP_MM, verbose),
+                    Toolpath.to_arrays, Toolpath.from_arrays)
+
+    key = cache.key('cartesian_toolpath', key, MAX_STEP_MM, MIN_STEP_MM, PEN_LIFT_MM, TABLE_HEIGHT_MM, HOME_POSITION_CARTESIAN)
+    key = run_stage('cartesian_toolpath', "Generating 3d toolpath...", key,
+                    lambda: generate_cartesian_toolpath(outputs['merged_toolpath'], split_travel=False),
+                    Toolpath.to_arrays, Toolpath.from_arrays)
+
+    draw_feed, travel_feed = DRAW_FEED_MM_S*speed, TRAVEL_FEED_MM_S*speed
+    key = cache.key('trajectory', key, draw_feed, travel_feed, ACCELERATION_MM_S2, CONTROL_PERIOD_S,
+                    JUNCTION_DEVIATION_MM)
+    key = run_stage('trajectory', "Generating trajectory...", key,
+                    lambda: generate_trajectory(outputs['cartesian_toolpath'], draw_feed, travel_feed, ACCELERATION_MM_S2,
+                                                CONTROL_PERIOD_S, JUNCTION_DEVIATION_MM, True, verbose),
+                    Toolpath.to_arrays, Toolpath.from_arrays)
+
+    key = cache.key('angular_toolpath', key, L0, L2, L3, L4, L5, THETA_5,
+                    THETA_1_MIN, THETA_1_MAX, THETA_2_MIN, THETA_2_MAX, THETA_3_MIN, THETA_3_MAX, THETA_4_MIN, THETA_4_MAX,
+                    JOINT_SPEED_DEG_S, JOINT_ACCELERATION_DEG_S2, TRAVEL_CLEARANCE_MM, TABLE_HEIGHT_MM, JOINT_MOVE_CHECKS,
+                    JOINT_MOVE_SPLITS, ik_table, IK_TABLE_SPACING_MM if ik_table else 0)
+
+    # check every point before solving any of them, so a job doesn't fail partway through
+    if verbose:
+        print("Checking reach and joint limits...")
+    reachability_map = ReachabilityMap(cache=cache if use_cache else False)
+    outputs['validation'] = validate_toolpath(outputs['trajectory'], reachability_map, verbose)
+    unreachable = outputs['validation']['unreachable_indices']
+    if len(unreachable):
+        raise ValueError(f"{len(unreachable)} points of the trajectory are out of reach, the first is point "
+                         f"{unreachable[0]} at {np.round(outputs['trajectory'].points[unreachable[0]], 1)} mm.")
+
+    def angular_stage():
+        # the table is only loaded or built when the stage has to run
+        solver = generate_angular_toolpath
+        if ik_table:
+            solver = IKTable(cache=cache if use_cache else False, verbose=verbose).generate_angular_toolpath
+        return generate_angular_trajectory(outputs['trajectory'], JOINT_SPEED_DEG_S, JOINT_ACCELERATION_DEG_S2,
+                                           CONTROL_PERIOD_S, solver, verbose)
+
+    key = run_stage('angular_toolpath', "Generating angular toolpath...", key, angular_stage)
+
+    key = cache.key('bit_commands', key, ANGLE_OFFSET, ANGLE_SCALING, DEGREES_TO_BITS)
+    run_stage('bit_commands', "Converting model angles into bit commands...", key,
+              lambda: degrees_to_bits(outputs['angular_toolpath']*ANGLE_SCALING + ANGLE_OFFSET))
+    return outputs
+
+
+if __name__ == "__main__":
+    import sys
+    import time
+    file_name = sys.argv[1] if len(sys.argv) > 1 else "hello_world"
+    svg_file = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'svgs', file_name + '.svg')
+    for run in range(2):
+        start = time.perf_counter()
+        outputs = generate_toolpaths(svg_file)
+        print(f"run {run}: {outputs['bit_commands'].shape[0]} commands in {time.perf_counter() - start:.2f} s\n")
@@ -0,0 +1,214 @@
+"""
+This file contains a headless renderer of drawing previews, which rasterizes the pen-down
+segments of a toolpath into a PNG the size of the paper without plotly or a browser.
+
+Every segment is sampled at least twice per pixel along its length, the samples are marked in a
+boolean image all at once, and the lines are thickened to the pen width by shifting the image
+by every pixel offset inside the pen's circle, or for a few short lines by stamping the circle
+on every sample. The PNG is written with zlib and struct.
+
+The image is drawn the same way up as the svg: x in the base frame goes to the right and y,
+which read_path flips to point away from the svg's top, goes up the image.
+"""
+import struct
+import zlib
+import numpy as np
+from constants import *
+from toolpath import Toolpath, PEN_DOWN
+
+PREVIEW_PIXELS_PER_MM = 10      # resolution of the preview, 10 px/mm is 254 dpi
+PREVIEW_PEN_WIDTH_MM = 0.5      # width of the lines in the preview
+PREVIEW_MARGIN_MM = 5           # blank border around the drawing bounds
+PREVIEW_INK = (0, 0, 0)         # colour of the toolpath
+PREVIEW_OVERLAY_INK = (220, 30, 30)  # colour of the recorded toolpath drawn over it
+
+
+def pen_down_segments(toolpath) -> tuple:
+    """find the segments of a toolpath the pen draws.
+
+    parameters:
+        toolpath: a Toolpath, whose segments are drawn where both ends are PEN_DOWN in the same
+            stroke, a (N, 3) array of pen tip positions like a recorded toolpath, drawn where
+            both ends are closer to the table than to the pen lift height, or a (N, 2) array of
+            one stroke.
+
+    returns:
+        two (M, 2) arrays of the x, y coordinates of the start and end of each drawn segment,
+        the same point for lone pen-down points where the pen only dots the paper.
+    """
+    if isinstance(toolpath, Toolpath):
+        points = toolpath.points
+        down = toolpath.flags == PEN_DOWN
+        continues = np.ones(len(points), dtype=bool)
+        continues[toolpath.offsets[1:-1]] = False
+    else:
+        points = np.asarray(toolpath, dtype=float)
+        down = points[:, 2] < TABLE_HEIGHT_MM + PEN_LIFT_MM/2 if points.shape[1] == 3 else np.ones(len(points), dtype=bool)
+        continues = np.ones(len(points), dtype=bool)
+    drawn = down[:-1] & down[1:] & continues[1:]
+
+    # a pen-down point that isn't part of a drawn segment is a dot, drawn as a segment of no length
+    dots = down.copy()
+    dots[:-1] &= ~drawn
+    dots[1:] &= ~drawn
+    segments, dots = np.flatnonzero(drawn), np.flatnonzero(dots)
+    return np.concatenate((points[segments, :2], points[dots, :2])), np.concatenate((points[segments + 1, :2], points[dots, :2]))
+
+
+def segment_pixels(starts: np.array, ends: np.array, shape: tuple, origin: np.array,
+                   pixels_per_mm: float = PREVIEW_PIXELS_PER_MM, pen_width: float = PREVIEW_PEN_WIDTH_MM) -> tuple:
+    """find the pixels of an image the pen covers drawing line segments.
+
+    parameters:
+        starts, ends: (M, 2) arrays of the x, y coordinates in mm of each end of the segments.
+        shape: the (rows, columns) of the image.
+        origin: the x, y coordinates in mm of the top left corner of the image, the smallest x
+            and the largest y drawn, as rows go down the image the opposite way to y.
+        pixels_per_mm: the resolution of the image.
+        pen_width: the width of the lines in mm, at least one pixel wide.
+
+    returns:
+        arrays of the row and column of each pixel covered, some more than once.
+    """
+    if len(starts) == 0:
+        return np.zeros(0, dtype=int), np.zeros(0, dtype=int)
+    # columns count x from the left edge and rows count y down from the top edge
+    starts = (starts - origin)*[pixels_per_mm, -pixels_per_mm]
+    ends = (ends - origin)*[pixels_per_mm, -pixels_per_mm]
+
+    # sample every segment at least twice per pixel, counting its end for its own
+    samples = np.ceil(2*np.abs(ends - starts).max(axis=1)).astype(int) + 1
+    segment = np.repeat(np.arange(len(starts)), samples)
+    t = (np.arange(segment.size) - np.repeat(np.cumsum(samples) - samples, samples))/np.maximum(samples - 1, 1)[segment]
+    columns = np.rint(starts[segment, 0] + t*(ends[segment, 0] - starts[segment, 0])).astype(int)
+    rows = np.rint(starts[segment, 1] + t*(ends[segment, 1] - starts[segment, 1])).astype(int)
+    inside = (rows >= 0) & (rows < shape[0]) & (columns >= 0) & (columns < shape[1])
+    rows, columns = rows[inside], columns[inside]
+
+    # thicken the lines by every offset within the pen's radius
+    radius = max(pen_width*pixels_per_mm/2 - 0.5, 0)
+    reach = int(np.floor(radius))
+    if reach == 0 or len(rows) == 0:
+        return rows, columns
+    dy, dx = np.mgrid[-reach:reach + 1, -reach:reach + 1].reshape(2, -1)
+    disk = dx*dx + dy*dy <= radius*radius
+    dy, dx = dy[disk], dx[disk]
+    top, bottom = max(rows.min() - reach, 0), min(rows.max() + reach + 1, shape[0])
+    left, right = max(columns.min() - reach, 0), min(columns.max() + reach + 1, shape[1])
+
+    if len(rows)*len(dy) < (bottom - top)*(right - left):
+        # few samples, like the links of the arm: stamp the pen's circle on each of them
+        rows = (rows[:, np.newaxis] + dy).ravel()
+        columns = (columns[:, np.newaxis] + dx).ravel()
+        inside = (rows >= 0) & (rows < shape[0]) & (columns >= 0) & (columns < shape[1])
+        return rows[inside], columns[inside]
+
+    # many samples: shift the image of the lines by each offset, only over the rows and columns
+    # that have something drawn in them
+    lines = np.zeros((bottom - top, right - left), dtype=bool)
+    lines[rows - top, columns - left] = True
+    thick = lines.copy()
+    height, width = lines.shape
+    for y, x in zip(dy, dx):
+        if x or y:
+            thick[max(y, 0):height + min(y, 0), max(x, 0):width + min(x, 0)] |= \
+                lines[max(-y, 0):height + min(-y, 0), max(-x, 0):width + min(-x, 0)]
+    rows, columns = np.nonzero(thick)
+    return rows + top, columns + left
+
+
+def rasterize_segments(starts: np.array, ends: np.array, shape: tuple, origin: np.array,
+                       pixels_per_mm: float = PREVIEW_PIXELS_PER_MM, pen_width: float = PREVIEW_PEN_WIDTH_MM) -> np.array:
+    """draw line segments into a boolean image. (see segment_pixels)
+
+    returns:
+        a boolean array of the shape of the image that is True for each pixel the pen covers.
+    """
+    image = np.zeros(shape, dtype=bool)
+    image[segment_pixels(starts, ends, shape, origin, pixels_per_mm, pen_width)] = True
+    return image
+
+
+def render_preview(toolpath, overlay=None, bounds: np.array = DRAWING_BOUNDS, pixels_per_mm: float = PREVIEW_PIXELS_PER_MM,
+                   pen_width: float = PREVIEW_PEN_WIDTH_MM, margin: float = PREVIEW_MARGIN_MM) -> np.array:
+    """draw what a toolpath puts on the paper.
+
+    parameters:
+        toolpath: the toolpath to draw, see pen_down_segments for what it can be.
+        overlay: an optional second toolpath drawn in PREVIEW_OVERLAY_INK on top, like the
+            recorded toolpath of a run.
+        bounds: two opposite corners of the area drawn, in mm in the base coordinate frame.
+        pixels_per_mm: the resolution of the image.
+        pen_width: the width of the lines in mm.
+        margin: the blank border in mm added around the bounds.
+
+    returns:
+        a (rows, columns, 3) uint8 RGB image on a white background.
+    """
+    low, high = np.min(bounds, axis=0) - margin, np.max(bounds, axis=0) + margin
+    origin = np.array([low[0], high[1]])
+    size = high - low
+    shape = (int(np.ceil(size[1]*pixels_per_mm)) + 1, int(np.ceil(size[0]*pixels_per_mm)) + 1)
+    image = np.full(shape + (3,), 255, dtype=np.uint8)
+    for path, ink in ((toolpath, PREVIEW_INK), (overlay, PREVIEW_OVERLAY_INK)):
+        if path is not None:
+            image[rasterize_segments(*pen_down_segments(path), shape, origin, pixels_per_mm, pen_width)] = ink
+    return image
+
+
+def write_png(file_path: str, image: np.array) -> None:
+    """save a (rows, columns) grayscale or (rows, columns, 3) RGB uint8 image as a PNG."""
+    image = np.ascontiguousarray(image, dtype=np.uint8)
+    height, width = image.shape[:2]
+    colour_type = 2 if image.ndim == 3 else 0
+
+    def chunk(kind: bytes, data: bytes) -> bytes:
+        return struct.pack('>I', len(data)) + kind + data + struct.pack('>I', zlib.crc32(kind + data) & 0xffffffff)
+
+    # every row starts with filter type 0, no filtering
+    rows = np.zeros((height, 1 + image[0].size), dtype=np.uint8)
+    rows[:, 1:] = image.reshape(height, -1)
+    with open(file_path, 'wb') as file:
+        file.write(b'\x89PNG\r\n\x1a\n')
+        file.write(chunk(b'IHDR', struct.pack('>IIBBBBB', width, height, 8, colour_type, 0, 0, 0)))
+        file.write(chunk(b'IDAT', zlib.compress(rows.tobytes(), 6)))
+        file.write(chunk(b'IEND', b''))
+
+
+def save_preview(file_path: str, toolpath, overlay=None, **options) -> np.array:
+    """render a preview of a toolpath (see render_preview) and save it as a PNG.
+
+    returns:
+        the image that was saved.
+    """
+    image = render_preview(toolpath, overlay, **options)
+    write_png(file_path, image)
+    return image
+
+
+if __name__ == "__main__":
+    import os
+    import time
+    from pipeline_cache import generate_toolpaths
+
+    file_name = 'hong2'
+    python_directory = os.path.dirname(os.path.abspath(__file__))
+    outputs = generate_toolpaths(os.path.join(python_directory, 'svgs', file_name + '.svg'), verbose=False)
+    cartesian_toolpath = outputs['cartesian_toolpath']
+
+    start_time = time.perf_counter()
+    image = render_preview(cartesian_toolpath)
+    print(f"rendered {len(pen_down_segments(cartesian_toolpath)[0])} segments into a {image.shape[1]}x{image.shape[0]} "
+          f"image in {time.perf_counter() - start_time:.3f} s")
+
+    # a random scribble of a million segments
+    rng = np.random.default_rng(0)
+    scribble = np.cumsum(rng.normal(0, 1, (1000001, 2)), axis=0)
+    scribble = (scribble - scribble.min(axis=0))/np.ptp(scribble, axis=0)*np.ptp(DRAWING_BOUNDS, axis=0) + DRAWING_BOUNDS.min(axis=0)
+    start_time = time.perf_counter()
+    render_preview(scribble)
+    print(f"rendered 1000000 segments in {time.perf_counter() - start_time:.3f} s")
+
+    start_time = time.perf_counter()
+    write_png(os.path.join(python_directory, 'data', file_name + '_preview.png'), image)
+    print(f"saved in {time.perf_counter() - start_time:.3f} s")
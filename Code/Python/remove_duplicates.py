@@ -0,0 +1,173 @@
+"""
+This file contains a stage that removes strokes, or parts of strokes, of a fitted 2D toolpath
+that retrace lines already drawn by an earlier stroke, which happens a lot in exported traces.
+
+Every segment is sampled every DUPLICATE_TOLERANCE_MM and the samples are hashed into a grid of
+cells of that size, remembering the earliest stroke to pass through each cell. A segment whose
+samples are all within DUPLICATE_TOLERANCE_MM of a sample of an earlier stroke, which can only
+be in the same or a neighbouring cell, is already drawn. Sorting the cell keys is the only step
+that is not linear in the number of samples.
+"""
+import numpy as np
+from constants import *
+from toolpath import Toolpath
+
+DUPLICATE_MIN_LENGTH_MM = 1     # shortest run of covered segments removed, so crossings are kept
+
+
+def sample_segments(points: np.array, segment_starts: np.array, spacing: float) -> tuple:
+    """sample the straight segments of a polyline batch at most spacing apart.
+
+    parameters:
+        points: a (N, 2) array of every point of every stroke one after the other.
+        segment_starts: the index in points of the first point of each segment.
+        spacing: the largest distance between two samples of a segment.
+
+    returns:
+        a (M, 2) array of the samples, including both ends of every segment, and the index of
+        the first sample of each segment.
+    """
+    starts, ends = points[segment_starts], points[segment_starts + 1]
+    counts = np.ceil(np.linalg.norm(ends - starts, axis=1) / spacing).astype(int) + 1
+    segment = np.repeat(np.arange(len(segment_starts)), counts)
+    first_sample = np.cumsum(counts) - counts
+    t = (np.arange(segment.size) - first_sample[segment]) / np.maximum(counts[segment] - 1, 1)
+    samples = starts[segment] + t[:, np.newaxis]*(ends[segment] - starts[segment])
+    return samples, first_sample
+
+
+def covered_samples(samples: np.array, strokes: np.array, tolerance: float) -> np.array:
+    """find the samples that are within tolerance of a sample of an earlier stroke.
+
+    Only the samples in the same or a neighbouring cell of a grid of cells of size tolerance
+    can be that close, and they are only measured against samples whose cells have an earlier
+    stroke through them.
+
+    parameters:
+        samples: a (M, 2) array of sample points.
+        strokes: the index of the stroke each sample belongs to.
+        tolerance: the largest distance between a covered sample and a sample of an earlier
+            stroke, and the size of the grid cells.
+
+    returns:
+        a boolean array that is True for each covered sample.
+    """
+    if len(samples) == 0:
+        return np.zeros(0, dtype=bool)
+    cells = np.floor(samples / tolerance).astype(np.int64)
+    cells -= cells.min(axis=0) - 1
+    width = cells[:, 1].max() + 2
+    keys = cells[:, 0]*width + cells[:, 1]
+
+    # earliest stroke through each occupied cell, and the samples in each cell
+    order = np.argsort(keys, kind='stable')
+    cell_keys, cell_starts, cell_counts = np.unique(keys[order], return_index=True, return_counts=True)
+    cell_index = np.repeat(np.arange(len(cell_keys)), cell_counts)
+    first_stroke = np.full(len(cell_keys), np.iinfo(np.int64).max)
+    np.minimum.at(first_stroke, cell_index, strokes[order])
+
+    covered = np.zeros(len(samples), dtype=bool)
+    for dx in (-1, 0, 1):
+        for dy in (-1, 0, 1):
+            neighbours = keys + dx*width + dy
+            found = np.minimum(np.searchsorted(cell_keys, neighbours), len(cell_keys) - 1)
+            candidates = np.flatnonzero((cell_keys[found] == neighbours) & (first_stroke[found] < strokes) & ~covered)
+
+            # measure each candidate against every sample of an earlier stroke in the cell
+            cells = found[candidates]
+            counts = cell_counts[cells]
+            pair_samples = np.repeat(candidates, counts)
+            pair_others = order[np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts - cell_starts[cells], counts)]
+            close = (strokes[pair_others] < strokes[pair_samples]) & \
+                    (np.sum((samples[pair_others] - samples[pair_samples])**2, axis=1) <= tolerance**2)
+            covered[pair_samples[close]] = True
+    return covered
+
+
+def remove_duplicates(flat_toolpath: Toolpath, tolerance: float = DUPLICATE_TOLERANCE_MM,
+                      min_length: float = DUPLICATE_MIN_LENGTH_MM, verbose: bool = False) -> Toolpath:
+    """remove the parts of strokes that retrace earlier strokes in the toolpath.
+
+    parameters:
+        flat_toolpath: a Toolpath, or a list of 2D arrays of the x, y coordinates of the pen tip
+            in mm in the base coordinate frame. ex: [[[x1, y1], [x2, y2]], [[x3, y3], [x4, y4]]]
+        tolerance: how far apart in mm two lines can be and still count as the same line.
+        min_length: the shortest length in mm of a covered part of a stroke that is removed.
+            Shorter parts, like where two strokes cross, are kept unless they are the whole stroke.
+        verbose: print how much of the drawing was removed.
+
+    returns:
+        a new Toolpath, where strokes with a part removed are split in two.
+    """
+    flat_toolpath = Toolpath.from_strokes(flat_toolpath)
+    if len(flat_toolpath) == 0:
+        return flat_toolpath.copy()
+    lengths = flat_toolpath.stroke_lengths()
+    points = flat_toolpath.points
+    stroke_of_point = flat_toolpath.stroke_index()
+
+    # a segment starts at every point except the last point of each stroke
+    is_last = np.zeros(len(points), dtype=bool)
+    is_last[np.cumsum(lengths) - 1] = True
+    segment_starts = np.flatnonzero(~is_last)
+    segment_strokes = stroke_of_point[segment_starts]
+    segment_lengths = np.linalg.norm(points[segment_starts + 1] - points[segment_starts], axis=1)
+
+    # a segment is covered when every one of its samples is, a stroke of a single point is
+    # sampled at that point
+    dots = (np.cumsum(lengths) - 1)[lengths == 1]
+    samples, first_sample = sample_segments(points, segment_starts, tolerance)
+    sample_strokes = np.repeat(segment_strokes, np.diff(np.append(first_sample, len(samples))))
+    covered = covered_samples(np.vstack((samples, points[dots])),
+                              np.concatenate((sample_strokes, stroke_of_point[dots])), tolerance)
+    covered_dots = covered[len(samples):]
+    covered = np.logical_and.reduceat(covered[:len(samples)], first_sample) if len(segment_starts) else covered[:0]
+
+    # runs of segments in the same stroke that are all covered or all not covered
+    new_stroke = np.diff(segment_strokes, prepend=-1) != 0
+    run_starts = np.flatnonzero((np.diff(covered.astype(int), prepend=-1) != 0) | new_stroke)
+    run_lengths = np.add.reduceat(segment_lengths, run_starts) if len(run_starts) else np.zeros(0)
+    run_counts = np.diff(np.append(run_starts, len(segment_starts)))
+    whole_stroke = run_counts == (lengths - 1)[segment_strokes[run_starts]]
+    removed = np.repeat(covered[run_starts] & ((run_lengths >= min_length) | whole_stroke), run_counts)
+
+    # every run of segments that are not removed becomes a stroke, as does every dot not covered
+    is_piece_start = ~removed & (np.concatenate(([True], removed[:-1])) | new_stroke)
+    piece_counts = np.bincount(np.cumsum(is_piece_start)[~removed] - 1, minlength=np.count_nonzero(is_piece_start))
+    piece_starts = np.concatenate((segment_starts[is_piece_start], dots[~covered_dots]))
+    piece_ends = piece_starts + np.concatenate((piece_counts, np.zeros(np.count_nonzero(~covered_dots), dtype=int)))
+    order = np.argsort(piece_starts, kind='stable')
+    piece_starts, piece_ends = piece_starts[order], piece_ends[order]
+    piece_lengths = piece_ends - piece_starts + 1
+    kept_points = np.arange(piece_lengths.sum()) - np.repeat(np.cumsum(piece_lengths) - piece_lengths - piece_starts, piece_lengths)
+    deduplicated_toolpath = Toolpath(points[kept_points], np.append(0, np.cumsum(piece_lengths)), flat_toolpath.flags[kept_points])
+
+    if verbose:
+        print(f"Removed {segment_lengths[removed].sum():.0f} mm of duplicate lines from {len(flat_toolpath)} strokes, "
+              f"leaving {len(deduplicated_toolpath)} strokes.")
+    return deduplicated_toolpath
+
+
+if __name__ == "__main__":
+    import os
+    import time
+    from SVG_to_coords import parse_svg
+    from coords_to_toolpath import read_path
+    from fit_path import fit_path
+
+    # a line retraced half a tolerance away is removed, one 1.5 tolerances away is kept
+    line = np.array([[0, 0], [20, 0]])
+    for distance, strokes_left in ((0.5, 1), (1.5, 2)):
+        parallel = line + [0, distance*DUPLICATE_TOLERANCE_MM]
+        assert len(remove_duplicates([line, parallel])) == strokes_left, distance
+
+    file_name = 'hong2'
+    svg_file = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'svgs', file_name + '.svg')
+    toolpath = fit_path(read_path(parse_svg(svg_file), CURVE_TOLERANCE_MM), DRAWING_BOUNDS)
+
+    # draw the first half of the strokes twice
+    strokes = list(toolpath)
+    doubled_toolpath = Toolpath.from_strokes(strokes + [stroke[::-1] for stroke in strokes[:len(strokes)//2]])
+    start_time = time.perf_counter()
+    deduplicated_toolpath = remove_duplicates(doubled_toolpath, verbose=True)
+    print(f"removed duplicates in {time.perf_counter() - start_time:.3f} s")
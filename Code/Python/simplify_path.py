@@ -0,0 +1,131 @@
+"""
+This file contains a stage that removes points from the strokes of a fitted 2D toolpath that do
+not change its shape by more than a tolerance, so fewer points go through interpolation,
+inverse kinematics and the motors.
+
+It uses the Ramer-Douglas-Peucker algorithm. Instead of recursing into one piece of one stroke
+at a time, every piece of every stroke that still needs splitting is handled in one batch of
+NumPy operations, so the number of Python iterations only grows with the depth of the recursion.
+"""
+import numpy as np
+from constants import *
+from toolpath import Toolpath
+
+SIMPLIFY_PIECE_POINTS = 256     # points between points that are always kept in long strokes
+
+
+def segment_distances(points: np.array, starts: np.array, ends: np.array) -> np.array:
+    """the distance from each point to the line segment between its start and end point.
+
+    parameters:
+        points, starts, ends: (N, 2) arrays of x, y coordinates.
+
+    returns:
+        a 1D array of N distances, measured to the start point where start and end are the same.
+    """
+    direction = ends - starts
+    length_squared = np.einsum('nd,nd->n', direction, direction)
+    t = np.einsum('nd,nd->n', points - starts, direction) / np.where(length_squared > 0, length_squared, 1)
+    closest = starts + np.clip(t, 0, 1)[:, np.newaxis]*direction
+    return np.linalg.norm(points - closest, axis=1)
+
+
+def simplify_mask(points: np.array, lengths: np.array, tolerance: float) -> np.array:
+    """find which points of a batch of polylines are kept by Ramer-Douglas-Peucker simplification.
+
+    parameters:
+        points: a (N, 2) array of the points of every polyline one after the other.
+        lengths: the number of points in each polyline.
+        tolerance: the largest distance a removed point can be from the simplified polyline.
+
+    returns:
+        a boolean array that is True for each point that is kept. The first and last point of
+        every polyline are always kept.
+    """
+    ends = np.cumsum(lengths) - 1
+    starts = ends - lengths + 1
+    keep = np.zeros(len(points), dtype=bool)
+    keep[starts] = True
+    keep[ends] = True
+
+    # also keep every SIMPLIFY_PIECE_POINTS-th point so long strokes like spirals, which only
+    # lose a few points per split, do not take thousands of passes
+    keep[(np.arange(len(points)) - np.repeat(starts, lengths)) % SIMPLIFY_PIECE_POINTS == 0] = True
+    kept = np.flatnonzero(keep)
+    is_end = np.zeros(len(points), dtype=bool)
+    is_end[ends] = True
+    starts, ends = kept[:-1][~is_end[kept[:-1]]], kept[1:][~is_end[kept[:-1]]]
+
+    # pieces of polylines between two kept points that still have points between them
+    while len(starts):
+        interior = ends - starts - 1
+        starts, ends, interior = starts[interior > 0], ends[interior > 0], interior[interior > 0]
+        if len(starts) == 0:
+            break
+        piece = np.repeat(np.arange(len(starts)), interior)
+        first_interior = np.cumsum(interior) - interior
+        indices = np.arange(piece.size) - first_interior[piece] + starts[piece] + 1
+        distances = segment_distances(points[indices], points[starts[piece]], points[ends[piece]])
+
+        # split each piece at its farthest point if that point is out of tolerance
+        farthest_distance = np.maximum.reduceat(distances, first_interior)
+        is_farthest = distances == farthest_distance[piece]
+        farthest_piece, first_match = np.unique(piece[is_farthest], return_index=True)
+        farthest = indices[is_farthest][first_match]
+        split = farthest_distance[farthest_piece] > tolerance
+        farthest, farthest_piece = farthest[split], farthest_piece[split]
+        keep[farthest] = True
+        starts = np.concatenate((starts[farthest_piece], farthest))
+        ends = np.concatenate((farthest, ends[farthest_piece]))
+    return keep
+
+
+def simplify_path(flat_toolpath: Toolpath, tolerance: float = SIMPLIFY_TOLERANCE_MM, verbose: bool = False) -> Toolpath:
+    """simplify every stroke of a 2D toolpath to within a tolerance.
+
+    parameters:
+        flat_toolpath: a Toolpath, or a list of 2D arrays of the x, y coordinates of the pen tip
+            in mm in the base coordinate frame. ex: [[[x1, y1], [x2, y2]], [[x3, y3], [x4, y4]]]
+        tolerance: the largest distance in mm between a removed point and the simplified stroke.
+        verbose: print the number of points before and after simplifying.
+
+    returns:
+        a new Toolpath of the simplified strokes, each keeping its first and last point.
+    """
+    flat_toolpath = Toolpath.from_strokes(flat_toolpath)
+    points = flat_toolpath.points
+    if len(flat_toolpath) == 0:
+        return flat_toolpath.copy()
+    keep = simplify_mask(points, flat_toolpath.stroke_lengths(), tolerance)
+    kept_lengths = np.add.reduceat(keep.astype(int), flat_toolpath.offsets[:-1])
+    simplified_toolpath = Toolpath(points[keep], np.append(0, np.cumsum(kept_lengths)), flat_toolpath.flags[keep])
+
+    if verbose:
+        print(f"Simplified {len(points)} points to {np.count_nonzero(keep)} "
+              f"({100*(1 - np.count_nonzero(keep)/len(points)):.0f}% fewer).")
+    return simplified_toolpath
+
+
+if __name__ == "__main__":
+    import os
+    import time
+    from SVG_to_coords import parse_svg
+    from coords_to_toolpath import read_path
+    from fit_path import fit_path
+
+    file_name = 'hong'
+    svg_file = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'svgs', file_name + '.svg')
+    toolpath = fit_path(read_path(parse_svg(svg_file), CURVE_TOLERANCE_MM), DRAWING_BOUNDS)
+
+    start_time = time.perf_counter()
+    simplified_toolpath = simplify_path(toolpath, verbose=True)
+    print(f"simplified in {time.perf_counter() - start_time:.3f} s")
+
+    import plotly.graph_objects as go
+    consolidated_toolpath = toolpath.points
+    consolidated_simplified_toolpath = simplified_toolpath.points
+    fig = go.Figure()
+    fig.add_trace(go.Scatter(x=consolidated_toolpath[:,0], y=consolidated_toolpath[:,1], mode='lines', name='Original Toolpath'))
+    fig.add_trace(go.Scatter(x=consolidated_simplified_toolpath[:,0], y=consolidated_simplified_toolpath[:,1], mode='lines+markers', name='Simplified Toolpath'))
+    fig.update_layout(title='Toolpath Simplification', showlegend=True)
+    fig.show()
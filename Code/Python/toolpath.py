@@ -0,0 +1,112 @@
+"""
+This file contains the Toolpath class the pipeline stages pass between each other.
+
+A Toolpath keeps every point of every stroke in one contiguous array, with the index of the
+first point of each stroke and a flag for each point, instead of a list of small arrays. Stages
+can then work on all the points at once, and the whole toolpath is saved as three arrays.
+"""
+import numpy as np
+
+# point flags
+PEN_DOWN = 1        # the pen is on the paper at this point
+TRAVEL = 2          # the point is part of a pen-up move between strokes or to the home position
+
+
+class Toolpath:
+    """Class for a toolpath of strokes stored in one array of points"""
+    def __init__(self, points: np.array, offsets: np.array = None, flags: np.array = None) -> None:
+        """
+        Initialize the toolpath
+        parameters:
+            points: a (N, 2) or (N, 3) array of the coordinates of every point of every stroke
+                one after the other.
+            offsets: the index of the first point of each stroke followed by N, by default the
+                points are a single stroke.
+            flags: the PEN_DOWN and TRAVEL flags of each point, by default every point is PEN_DOWN.
+        """
+        self.points = np.asarray(points, dtype=float)
+        self.offsets = np.array([0, len(self.points)]) if offsets is None else np.asarray(offsets, dtype=int)
+        self.flags = np.full(len(self.points), PEN_DOWN, dtype=np.uint8) if flags is None else np.asarray(flags, dtype=np.uint8)
+
+    @classmethod
+    def from_strokes(cls, strokes, dimensions: int = 2) -> 'Toolpath':
+        """make a toolpath from a list of arrays of the points of each stroke.
+
+        Toolpaths are returned as they are, so stages can accept either.
+        """
+        if isinstance(strokes, cls):
+            return strokes
+        strokes = [np.asarray(stroke, dtype=float).reshape(-1, dimensions) for stroke in strokes]
+        points = np.concatenate(strokes) if strokes else np.zeros((0, dimensions))
+        return cls(points, np.append(0, np.cumsum([len(stroke) for stroke in strokes])))
+
+    @classmethod
+    def from_arrays(cls, arrays: dict) -> 'Toolpath':
+        """inverse of Toolpath.to_arrays."""
+        return cls(arrays['points'], arrays['offsets'], arrays['flags'])
+
+    @classmethod
+    def load(cls, file) -> 'Toolpath':
+        """load a toolpath saved with Toolpath.save."""
+        with np.load(file) as arrays:
+            return cls.from_arrays(arrays)
+
+    def to_arrays(self) -> dict:
+        """the arrays that make up the toolpath, by name."""
+        return {'points': self.points, 'offsets': self.offsets, 'flags': self.flags}
+
+    def save(self, file) -> None:
+        """save the toolpath to an .npz file."""
+        np.savez(file, **self.to_arrays())
+
+    def copy(self) -> 'Toolpath':
+        return Toolpath(self.points.copy(), self.offsets.copy(), self.flags.copy())
+
+    def stroke_lengths(self) -> np.array:
+        """the number of points in each stroke."""
+        return np.diff(self.offsets)
+
+    def stroke_index(self) -> np.array:
+        """the index of the stroke each point belongs to."""
+        return np.repeat(np.arange(len(self)), self.stroke_lengths())
+
+    def firsts(self) -> np.array:
+        """the first point of each stroke."""
+        return self.points[self.offsets[:-1]]
+
+    def lasts(self) -> np.array:
+        """the last point of each stroke."""
+        return self.points[self.offsets[1:] - 1]
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+    def __getitem__(self, stroke: int) -> np.array:
+        """a view of the points of one stroke."""
+        if stroke < 0:
+            stroke += len(self)
+        if not 0 <= stroke < len(self):
+            raise IndexError("stroke index out of range")
+        return self.points[self.offsets[stroke]:self.offsets[stroke + 1]]
+
+    def __iter__(self):
+        for start, stop in zip(self.offsets[:-1], self.offsets[1:]):
+            yield self.points[start:stop]
+
+    def __array__(self, dtype=None, copy=None):
+        return self.points if dtype is None else self.points.astype(dtype)
+
+    def __repr__(self) -> str:
+        return f"Toolpath({len(self)} strokes, {len(self.points)} points)"
+
+
+if __name__ == "__main__":
+    import io
+    toolpath = Toolpath.from_strokes([[[0, 0], [0, 10]], [[0, -20], [-20, -20], [-20, 0]]])
+    print(toolpath, toolpath.offsets, toolpath.stroke_lengths())
+    for stroke in toolpath:
+        print(stroke)
+    file = io.BytesIO()
+    toolpath.save(file)
+    file.seek(0)
+    print(Toolpath.load(file).points)
@@ -0,0 +1,305 @@
+"""
+This file contains a stage that turns the 3D cartesian toolpath into a trajectory: the position
+of the pen tip at every tick of a fixed control period, so the pen moves at a chosen feed rate
+instead of however fast the motor bus can take the next point.
+
+Every segment of the toolpath gets a trapezoidal velocity profile, accelerating at a fixed rate
+up to the drawing feed while the pen is down or the travel feed while it is up, and
+decelerating into the next segment. The speed through each corner is limited by how sharp it
+is (the junction deviation used by grbl) and the limits are carried forward and backward along
+the whole toolpath, so the pen slows down early enough for sharp corners and stops.
+
+Pen-up moves between lifted points don't need a straight pen path, so they are made in joint
+space instead: inverse kinematics is only solved where the pen lifts off and touches down, and
+the joints move straight between those angles in a few coarse steps.
+"""
+import numpy as np
+from constants import *
+from toolpath import Toolpath, PEN_DOWN, TRAVEL
+from inverse_kinematics import generate_angular_toolpath
+from forward_kinematics import pen_tip_positions
+
+JOINT_MOVE_CHECKS = 9           # points along each joint-space move where the pen height is checked
+JOINT_MOVE_SPLITS = 3           # times a joint-space move can be split to keep the pen off the table
+
+
+def junction_speeds(directions: np.array, feeds: np.array, acceleration: float, junction_deviation: float) -> np.array:
+    """the highest speed the pen can go through each point between two segments.
+
+    parameters:
+        directions: a (N, 3) array of the unit direction of each segment.
+        feeds: the feed rate of each segment in mm/s.
+        acceleration: the acceleration limit in mm/s^2.
+        junction_deviation: how far in mm the path may be rounded off at a corner.
+
+    returns:
+        the squared speed limit at each of the N - 1 points between segments.
+    """
+    cos_theta = -np.einsum('nd,nd->n', directions[:-1], directions[1:])
+    sin_half_theta = np.sqrt(np.clip(0.5*(1 - cos_theta), 0, 1))
+    with np.errstate(divide='ignore'):
+        corner_speeds = acceleration*junction_deviation*sin_half_theta/(1 - sin_half_theta)
+    return np.minimum(corner_speeds, np.minimum(feeds[:-1], feeds[1:])**2)
+
+
+def plan_speeds(lengths: np.array, limits: np.array, acceleration: float) -> np.array:
+    """lower the squared speed limits at each point so no segment needs more than the
+    acceleration limit to speed up or slow down.
+
+    Going forward, v[i+1]^2 <= v[i]^2 + 2*a*L[i], which unrolls into a running minimum, and
+    likewise going backward, so both passes are single NumPy operations.
+
+    parameters:
+        lengths: the length of each of the N segments in mm.
+        limits: the squared speed limit at each of the N + 1 points.
+        acceleration: the acceleration limit in mm/s^2.
+
+    returns:
+        the highest reachable squared speed at each point.
+    """
+    reach = np.concatenate(([0], np.cumsum(2*acceleration*lengths)))
+    forward = reach + np.minimum.accumulate(limits - reach)
+    backward = np.minimum.accumulate((limits + reach)[::-1])[::-1] - reach
+    return np.maximum(np.minimum(forward, backward), 0)
+
+
+def profile_distance(t: np.array, entry_speed: np.array, peak_speed: np.array, accelerate_time: np.array,
+                     cruise_time: np.array, acceleration: float) -> np.array:
+    """the distance travelled t seconds into trapezoidal velocity profiles.
+
+    parameters:
+        t: the time in s since the start of each profile.
+        entry_speed, peak_speed: the speed at the start of each profile and while cruising.
+        accelerate_time, cruise_time: how long each profile accelerates and then cruises for.
+        acceleration: the acceleration and deceleration of the profiles.
+
+    returns:
+        the distance along each profile, in the units of the speeds times s.
+    """
+    accelerate_distance = 0.5*(entry_speed + peak_speed)*accelerate_time
+    t_cruise = t - accelerate_time
+    t_decelerate = t_cruise - cruise_time
+    return np.where(t_cruise < 0, entry_speed*t + 0.5*acceleration*t**2,
+           np.where(t_decelerate < 0, accelerate_distance + peak_speed*t_cruise,
+                    accelerate_distance + peak_speed*(cruise_time + t_decelerate) - 0.5*acceleration*t_decelerate**2))
+
+
+def generate_trajectory(cartesian_toolpath: Toolpath, draw_feed: float = DRAW_FEED_MM_S,
+                        travel_feed: float = TRAVEL_FEED_MM_S, acceleration: float = ACCELERATION_MM_S2,
+                        period: float = CONTROL_PERIOD_S, junction_deviation: float = JUNCTION_DEVIATION_MM,
+                        joint_space_travel: bool = True, verbose: bool = False) -> Toolpath:
+    """sample a 3D toolpath at a fixed control period with trapezoidal velocity profiles.
+
+    parameters:
+        cartesian_toolpath: a Toolpath of the x, y, z coordinates of the pen tip in mm in the
+            base coordinate frame with PEN_DOWN and TRAVEL flags. (see generate_cartesian_toolpath)
+        draw_feed: the pen speed in mm/s between two PEN_DOWN points.
+        travel_feed: the pen speed in mm/s on any other segment.
+        acceleration: the acceleration limit in mm/s^2.
+        period: the time in s between two points of the trajectory.
+        junction_deviation: how far in mm a corner may be rounded off, lower makes the pen
+            slow down more at corners.
+        joint_space_travel: leave out the segments between two TRAVEL points, which are made
+            in joint space instead. (see generate_angular_trajectory)
+        verbose: print how long the trajectory takes.
+
+    returns:
+        a Toolpath of the position of the pen tip at every period, starting and ending at rest
+        on the first and last point. Points on a drawn segment are PEN_DOWN and the rest TRAVEL.
+        With joint_space_travel, each run of points between two joint-space moves is a stroke,
+        starting and ending at rest, otherwise the trajectory is a single stroke.
+    """
+    if not isinstance(cartesian_toolpath, Toolpath):
+        cartesian_toolpath = Toolpath(cartesian_toolpath)
+    points, flags = cartesian_toolpath.points, cartesian_toolpath.flags
+
+    # drop points that repeat the point before them, they have no direction
+    repeated = np.concatenate(([False], np.all(points[1:] == points[:-1], axis=1)))
+    points, flags = points[~repeated], flags[~repeated]
+    if len(points) < 2:
+        return Toolpath(points.copy(), flags=flags.copy())
+
+    vectors = np.diff(points, axis=0)
+    lengths = np.linalg.norm(vectors, axis=1)
+    directions = vectors/lengths[:, np.newaxis]
+    drawn = (flags[:-1] == PEN_DOWN) & (flags[1:] == PEN_DOWN)
+    feeds = np.where(drawn, draw_feed, travel_feed)
+    joint_moves = (flags[:-1] == TRAVEL) & (flags[1:] == TRAVEL) & joint_space_travel
+
+    # squared speed at each point, starting and ending at rest and stopping for joint-space
+    # moves, which take no time here
+    limits = np.concatenate(([0], junction_speeds(directions, feeds, acceleration, junction_deviation), [0]))
+    limits[:-1][joint_moves] = limits[1:][joint_moves] = 0
+    lengths = np.where(joint_moves, 0, lengths)
+    speeds_squared = plan_speeds(lengths, limits, acceleration)
+    entry_squared, exit_squared = speeds_squared[:-1], speeds_squared[1:]
+
+    # trapezoid of each segment, a triangle where the feed can't be reached
+    peak_squared = np.minimum(feeds**2, (2*acceleration*lengths + entry_squared + exit_squared)/2)
+    peak_squared = np.maximum(peak_squared, np.maximum(entry_squared, exit_squared))
+    entry_speed, exit_speed, peak_speed = np.sqrt(entry_squared), np.sqrt(exit_squared), np.sqrt(peak_squared)
+    accelerate_distance = (peak_squared - entry_squared)/(2*acceleration)
+    decelerate_distance = (peak_squared - exit_squared)/(2*acceleration)
+    cruise_distance = np.maximum(lengths - accelerate_distance - decelerate_distance, 0)
+    accelerate_time = (peak_speed - entry_speed)/acceleration
+    cruise_time = np.divide(cruise_distance, peak_speed, out=np.zeros_like(cruise_distance), where=peak_speed > 0)
+    decelerate_time = (peak_speed - exit_speed)/acceleration
+    segment_times = accelerate_time + cruise_time + decelerate_time
+    start_times = np.concatenate(([0], np.cumsum(segment_times)))
+
+    # every run of points between joint-space moves is sampled from its own start, slowed down
+    # just enough to end on a whole period so the next move starts right away, and never sped up
+    run_firsts = np.append(0, np.flatnonzero(joint_moves) + 1)
+    run_lasts = np.append(np.flatnonzero(joint_moves), len(points) - 1)
+    durations = start_times[run_lasts] - start_times[run_firsts]
+    intervals = np.where(durations > 0, np.maximum(np.ceil(durations/period - 1e-9), 1), 0).astype(int)
+    counts = intervals + 1
+    offsets = np.append(0, np.cumsum(counts))
+    run = np.repeat(np.arange(len(run_firsts)), counts)
+    tick = np.arange(offsets[-1]) - offsets[:-1][run]
+    times = start_times[run_firsts][run] + tick*(durations/np.maximum(intervals, 1))[run]
+
+    # position along its segment at every tick, a run of one point stays on it
+    segment = np.searchsorted(start_times, times, side='right') - 1
+    segment = np.clip(segment, run_firsts[run], np.maximum(run_lasts[run] - 1, run_firsts[run]))
+    moving = run_lasts[run] > run_firsts[run]
+    s = np.minimum(segment, len(lengths) - 1)
+    distance = profile_distance(times - start_times[s], entry_speed[s], peak_speed[s], accelerate_time[s],
+                                cruise_time[s], acceleration)
+    distance = np.where(moving, np.clip(distance, 0, lengths[s]), 0)
+    trajectory_points = points[segment] + directions[s]*distance[:, np.newaxis]
+    trajectory_flags = np.where(moving, np.where(drawn[s], PEN_DOWN, TRAVEL), flags[segment]).astype(np.uint8)
+
+    # each run ends exactly on its last point
+    trajectory_points[offsets[1:] - 1], trajectory_flags[offsets[1:] - 1] = points[run_lasts], flags[run_lasts]
+
+    if verbose:
+        # the time each segment is actually sent over, with its run stretched to whole periods
+        stretch = np.divide(intervals*period, durations, out=np.ones_like(durations), where=durations > 0)
+        sent_times = segment_times*stretch[np.searchsorted(run_firsts, np.arange(len(segment_times)), side='right') - 1]
+        print(f"Trajectory of {len(trajectory_points)} points takes {intervals.sum()*period:.1f} s "
+              f"({sent_times[drawn].sum():.1f} s drawing, {sent_times[~drawn].sum():.1f} s lifting and travelling)"
+              + (f" with {np.count_nonzero(joint_moves)} joint-space moves." if joint_space_travel else "."))
+    return Toolpath(trajectory_points, offsets, trajectory_flags)
+
+
+def lifted_waypoints(starts: np.array, ends: np.array, min_height: float) -> tuple:
+    """split joint-space moves whose pen tip would dip below a height at a raised midpoint.
+
+    parameters:
+        starts, ends: (N, 4) arrays of the joint angles at the start and end of each move.
+        min_height: the lowest the pen tip may go during a move, in mm, or the height of the
+            lower end of the move if that is lower.
+
+    returns:
+        the (M, 4) start and end angles of each piece of the moves, in order, and the index of
+        the move each piece belongs to.
+    """
+    moves = np.arange(len(starts))
+    fractions = np.linspace(0, 1, JOINT_MOVE_CHECKS)[:, np.newaxis, np.newaxis]
+    for _ in range(JOINT_MOVE_SPLITS):
+        # pen tip height along each move, checked at a few points
+        heights = pen_tip_positions((starts + fractions*(ends - starts)).reshape(-1, 4))[:, 2].reshape(JOINT_MOVE_CHECKS, -1)
+        floor = np.minimum(min_height, np.minimum(heights[0], heights[-1]))
+        low = np.flatnonzero(heights.min(axis=0) < floor - 1e-6)
+        if len(low) == 0:
+            break
+
+        # raise the midpoint of the move by how far it dipped, then move through it
+        middles = pen_tip_positions((starts[low] + ends[low])/2)
+        middles[:, 2] += 2*(floor[low] - heights[:, low].min(axis=0))
+        via = generate_angular_toolpath(middles)
+        order = np.argsort(np.concatenate((np.arange(len(starts)), low)), kind='stable')
+        first_ends = ends.copy()
+        first_ends[low] = via
+        starts = np.concatenate((starts, via))[order]
+        ends = np.concatenate((first_ends, ends[low]))[order]
+        moves = np.concatenate((moves, moves[low]))[order]
+    return starts, ends, moves
+
+
+def generate_angular_trajectory(trajectory: Toolpath, joint_speed: float = JOINT_SPEED_DEG_S,
+                                joint_acceleration: float = JOINT_ACCELERATION_DEG_S2,
+                                period: float = CONTROL_PERIOD_S, solver=generate_angular_toolpath,
+                                verbose: bool = False) -> np.array:
+    """find the joint angles at every control period of a trajectory, moving between its
+    strokes in joint space.
+
+    Inverse kinematics is only solved for the points of the trajectory, the pen-up moves
+    between strokes go straight from the angles at the end of one stroke to the angles at the
+    start of the next, at a joint speed and acceleration limit, so they only take as many
+    commands as their duration needs. A move that would bring the pen closer than
+    TRAVEL_CLEARANCE_MM to the table is routed through a raised midpoint.
+
+    parameters:
+        trajectory: a Toolpath of the pen tip positions at every period. (see generate_trajectory)
+        joint_speed: the speed limit of the fastest moving joint in degrees/s.
+        joint_acceleration: the acceleration limit of the fastest moving joint in degrees/s^2.
+        period: the time in s between two points of the trajectory.
+        solver: the function that finds the joint angles of a (N, 3) array of points, like
+            inverse_kinematics.generate_angular_toolpath or ik_table.IKTable.generate_angular_toolpath.
+        verbose: print how many joint-space moves were added.
+
+    returns:
+        a (N, 4) array of the angles of each joint of the model in degrees at every period.
+    """
+    stroke_angles = solver(trajectory.points)
+    if len(trajectory) < 2:
+        return stroke_angles
+    starts, ends, moves = lifted_waypoints(stroke_angles[trajectory.offsets[1:-1] - 1],
+                                           stroke_angles[trajectory.offsets[1:-1]],
+                                           TABLE_HEIGHT_MM + TRAVEL_CLEARANCE_MM)
+
+    # every piece of a move is a trapezoidal profile of the joint that moves furthest, from rest
+    # to rest, and the other joints move in proportion
+    spans = np.abs(ends - starts).max(axis=1)
+    peak_speed = np.minimum(joint_speed, np.sqrt(spans*joint_acceleration))
+    accelerate_time = peak_speed/joint_acceleration
+    cruise_time = np.divide(spans, peak_speed, out=np.zeros_like(spans), where=peak_speed > 0) - accelerate_time
+    durations = 2*accelerate_time + cruise_time
+
+    # sample each piece every period after its start, slowed down (never sped up) just enough to
+    # end on a whole period, up to and including its end, except the end of the last piece of each move,
+    # which is the first point of the next stroke
+    last_piece = np.append(moves[1:] != moves[:-1], True)
+    intervals = np.maximum(np.ceil(durations/period - 1e-9), 1).astype(int)
+    samples = intervals - last_piece
+    piece = np.repeat(np.arange(len(spans)), samples)
+    t = (np.arange(samples.sum()) - np.repeat(np.cumsum(samples) - samples, samples) + 1)*(durations/intervals)[piece]
+    distance = profile_distance(t, 0, peak_speed[piece], accelerate_time[piece], cruise_time[piece], joint_acceleration)
+    fraction = np.divide(distance, spans[piece], out=np.ones_like(distance), where=spans[piece] > 0)
+    travel_angles = starts[piece] + fraction[:, np.newaxis]*(ends[piece] - starts[piece])
+    travel_angles = np.clip(travel_angles, [THETA_1_MIN, THETA_2_MIN, THETA_3_MIN, THETA_4_MIN],
+                            [THETA_1_MAX, THETA_2_MAX, THETA_3_MAX, THETA_4_MAX])
+
+    # put the samples of each move after the stroke it starts from
+    stroke_of_point = trajectory.stroke_index()
+    order = np.lexsort((np.arange(len(stroke_of_point) + len(piece)),
+                        np.concatenate((2*stroke_of_point, 2*moves[piece] + 1))))
+    angular_trajectory = np.concatenate((stroke_angles, travel_angles))[order]
+
+    if verbose:
+        print(f"Added {len(travel_angles)} points for {len(trajectory) - 1} joint-space moves "
+              f"({len(spans) - len(trajectory) + 1} raised), taking {intervals.sum()*period:.1f} s.")
+    return angular_trajectory
+
+
+if __name__ == "__main__":
+    from generate_toolpath import generate_cartesian_toolpath
+
+    # a square, a zigzag with sharp corners and a straight line
+    toolpath = Toolpath.from_strokes([[[150, -40], [150, 40], [230, 40], [230, -40], [150, -40]],
+                                      [[160, 60], [220, 65], [160, 70], [220, 75], [160, 80]],
+                                      [[150, -100], [250, -100]]])
+    cartesian_toolpath = generate_cartesian_toolpath(toolpath, split_travel=False)
+    trajectory = generate_trajectory(cartesian_toolpath, verbose=True)
+    angular_trajectory = generate_angular_trajectory(trajectory, verbose=True)
+    pen_positions = pen_tip_positions(angular_trajectory)
+    speeds = np.linalg.norm(np.diff(pen_positions, axis=0), axis=1)/CONTROL_PERIOD_S
+
+    import plotly.graph_objects as go
+    fig = go.Figure()
+    fig.add_trace(go.Scatter(x=np.arange(len(speeds))*CONTROL_PERIOD_S, y=speeds, mode='lines', name='Pen Speed'))
+    fig.add_trace(go.Scatter(x=np.arange(len(pen_positions))*CONTROL_PERIOD_S, y=pen_positions[:,2], mode='lines', name='Pen Height'))
+    fig.update_layout(title='Trajectory Speed', xaxis_title='time (s)', yaxis_title='speed (mm/s), height (mm)')
+    fig.show()
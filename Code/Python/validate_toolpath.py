@@ -0,0 +1,175 @@
+"""
+This file contains a check of a whole 3D toolpath against the reach and joint limits of the arm,
+run before any motor moves.
+
+Inverse kinematics raises a ValueError at the first point out of reach and quietly clips angles
+past the joint limits, which moves the pen off the drawing. The check instead finds every point
+that is out of reach or would be clipped and how far clipping would move the pen. Points on the
+table or at pen lift height are first looked up in a reachability map of those planes, saved in
+the pipeline cache, so only points near the edge of the workspace or at other heights are solved.
+"""
+import numpy as np
+from constants import *
+from inverse_kinematics import generate_angular_toolpath
+from forward_kinematics import pen_tip_positions
+
+REACHABILITY_SPACING_MM = 1     # size of the cells of the reachability map
+
+ANGLE_MINIMUMS = np.array([THETA_1_MIN, THETA_2_MIN, THETA_3_MIN, THETA_4_MIN])
+ANGLE_MAXIMUMS = np.array([THETA_1_MAX, THETA_2_MAX, THETA_3_MAX, THETA_4_MAX])
+
+
+def check_points(positions: np.array) -> tuple:
+    """solve every point and compare its angles against the joint limits.
+
+    parameters:
+        positions: a (N, 3) array of pen tip positions in mm in the base coordinate frame.
+
+    returns:
+        a boolean array that is True for each point out of reach, a (N, 4) boolean array that is
+        True for each joint angle past its limits, and the distance in mm between each point and
+        where the pen ends up with its angles clipped, inf for points out of reach.
+    """
+    angles = generate_angular_toolpath(positions, clip=False, strict=False)
+    unreachable = np.isnan(angles).any(axis=1)
+    with np.errstate(invalid='ignore'):
+        clamped = ((angles < ANGLE_MINIMUMS) | (angles > ANGLE_MAXIMUMS)) & ~unreachable[:, np.newaxis]
+
+    # clipping the base angle moves the rest of the arm, which can put a point out of reach
+    clipped = np.flatnonzero(clamped.any(axis=1))
+    errors = np.zeros(len(positions))
+    errors[clipped] = np.linalg.norm(pen_tip_positions(generate_angular_toolpath(positions[clipped], strict=False)) - positions[clipped], axis=1)
+    unreachable |= np.isnan(errors)
+    errors[unreachable] = np.inf
+    return unreachable, clamped, errors
+
+
+class ReachabilityMap:
+    """Class for a map of the cells of the table plane the pen can reach without hitting a joint limit"""
+    def __init__(self, heights: tuple = (TABLE_HEIGHT_MM, TABLE_HEIGHT_MM + PEN_LIFT_MM),
+                 spacing: float = REACHABILITY_SPACING_MM, cache=None, verbose: bool = False) -> None:
+        """
+        Initialize the map, loading it from the cache or building and saving it
+        parameters:
+            heights: the z coordinates in mm of the planes that are mapped.
+            spacing: the size of the cells in mm.
+            cache: the PipelineCache the map is saved in, None to use the default one or False
+                to build it without saving it.
+            verbose: print whether the map was built and how much of it is reachable.
+        """
+        if cache is None:
+            from pipeline_cache import PipelineCache
+            cache = PipelineCache()
+        self.heights = np.asarray(heights, dtype=float)
+        self.spacing = spacing
+
+        # a square around the base as wide as the arm's longest reach
+        reach = L2 + L3 + L4 + L5
+        self.origin = np.array([-reach, -reach])
+        self.shape = np.full(2, int(np.ceil(2*reach/spacing)) + 1)
+
+        if cache is not False:
+            key = cache.key('reachability_map', self.heights, spacing, self.origin, self.shape, L0, L2, L3, L4, L5, THETA_5,
+                            ANGLE_MINIMUMS, ANGLE_MAXIMUMS)
+            arrays, from_cache = cache.cached(key, self.build)
+        else:
+            arrays, from_cache = self.build(), False
+        self.cells = arrays
+        if verbose:
+            print(f"{'Loaded' if from_cache else 'Built'} reachability map, {100*self.cells.mean():.0f}% of "
+                  f"{self.cells.shape[1]*self.spacing:.0f} mm square planes at {len(self.heights)} heights can be reached.")
+
+    def build(self) -> np.array:
+        """check every corner of every cell.
+
+        returns:
+            a (heights, x, y) boolean array that is True for each cell whose four corners can be
+            reached without hitting a joint limit.
+        """
+        x = self.origin[0] + np.arange(self.shape[0])*self.spacing
+        y = self.origin[1] + np.arange(self.shape[1])*self.spacing
+        z, x, y = np.meshgrid(self.heights, x, y, indexing='ij')
+        unreachable, clamped, _ = check_points(np.stack((x, y, z), axis=-1).reshape(-1, 3))
+        good = ~(unreachable | clamped.any(axis=1)).reshape(x.shape)
+        return good[:, :-1, :-1] & good[:, 1:, :-1] & good[:, :-1, 1:] & good[:, 1:, 1:]
+
+    def lookup(self, positions: np.array) -> np.array:
+        """find the points that are in a cell that can be reached.
+
+        parameters:
+            positions: a (N, 3) array of pen tip positions.
+
+        returns:
+            a boolean array that is True for each point known to be reachable within the joint
+            limits. Points that are False may still be, they need to be solved to find out.
+        """
+        level = np.full(len(positions), -1)
+        for index, height in enumerate(self.heights):
+            level[np.abs(positions[:, 2] - height) < 1e-9] = index
+        i = np.floor((positions[:, 0] - self.origin[0])/self.spacing).astype(int)
+        j = np.floor((positions[:, 1] - self.origin[1])/self.spacing).astype(int)
+        on_map = (level >= 0) & (i >= 0) & (i < self.cells.shape[1]) & (j >= 0) & (j < self.cells.shape[2])
+        known = np.zeros(len(positions), dtype=bool)
+        known[on_map] = self.cells[level[on_map], i[on_map], j[on_map]]
+        return known
+
+
+def validate_toolpath(cartesian_toolpath: np.array, reachability_map: ReachabilityMap = None, verbose: bool = False) -> dict:
+    """find every point of a toolpath that is out of reach or would have its angles clipped.
+
+    parameters:
+        cartesian_toolpath: a (N, 3) array of the x, y, z coordinates of the pen tip in mm in
+            the base coordinate frame, or a Toolpath of them.
+        reachability_map: a ReachabilityMap used to skip solving points known to be fine, or
+            None to solve every point.
+        verbose: print how many points are out of reach or clipped.
+
+    returns:
+        a dict of:
+            unreachable: a boolean array that is True for each point out of reach
+            clamped: a (N, 4) boolean array that is True for each joint angle past its limits
+            unreachable_indices: the indices of the points out of reach
+            clamped_indices: the indices of the points with at least one angle past its limits
+            error_mm: the distance in mm between each point and where the pen goes once its
+                angles are clipped, 0 for good points and inf for points out of reach
+    """
+    positions = np.asarray(cartesian_toolpath, dtype=float).reshape(-1, 3)
+    unreachable = np.zeros(len(positions), dtype=bool)
+    clamped = np.zeros((len(positions), 4), dtype=bool)
+    errors = np.zeros(len(positions))
+
+    # only solve the points the map doesn't already know are fine
+    unknown = np.flatnonzero(~reachability_map.lookup(positions)) if reachability_map is not None else np.arange(len(positions))
+    unreachable[unknown], clamped[unknown], errors[unknown] = check_points(positions[unknown])
+
+    validation = {'unreachable': unreachable,
+                  'clamped': clamped,
+                  'unreachable_indices': np.flatnonzero(unreachable),
+                  'clamped_indices': np.flatnonzero(clamped.any(axis=1)),
+                  'error_mm': errors}
+    if verbose:
+        clamped_errors = errors[validation['clamped_indices']]
+        clamped_errors = clamped_errors[np.isfinite(clamped_errors)]
+        print(f"Checked {len(positions)} points ({len(unknown)} solved): {len(validation['unreachable_indices'])} out of reach, "
+              f"{len(validation['clamped_indices'])} past the joint limits"
+              + (f" moving the pen up to {clamped_errors.max():.2f} mm." if len(clamped_errors) else "."))
+    return validation
+
+
+if __name__ == "__main__":
+    import time
+    reachability_map = ReachabilityMap(verbose=True)
+
+    # a grid over and past the drawing bounds
+    x, y = np.meshgrid(np.linspace(0, 350, 700), np.linspace(-300, 300, 1200))
+    positions = np.column_stack((x.ravel(), y.ravel(), np.full(x.size, TABLE_HEIGHT_MM)))
+    start_time = time.perf_counter()
+    validation = validate_toolpath(positions, reachability_map, verbose=True)
+    print(f"checked in {time.perf_counter() - start_time:.3f} s")
+
+    import plotly.graph_objects as go
+    status = np.where(validation['unreachable'], 2, validation['clamped'].any(axis=1).astype(int))
+    fig = go.Figure(go.Heatmap(x=x[0], y=y[:, 0], z=status.reshape(x.shape), colorscale=[[0, 'green'], [0.5, 'orange'], [1, 'red']]))
+    fig.add_trace(go.Scatter(x=DRAWING_BOUNDS[[0, 1, 1, 0, 0], 0], y=DRAWING_BOUNDS[[0, 0, 1, 1, 0], 1], mode='lines', name='Drawing Bounds'))
+    fig.update_layout(title='Reachable (green), clamped (orange) and unreachable (red) points on the table')
+    fig.show()